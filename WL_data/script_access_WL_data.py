@@ -4,7 +4,8 @@ import pytz
 from d22_data_format.dataset_accessor import DatasetAccessor
 
 # dataset_accessor_WL_nc4 = DatasetAccessor("./dataset_DK_test.nc4")
-dataset_accessor_WL_nc4 = DatasetAccessor("./WL_oil_platforms.nc4")
+# the file is kept open across the queries below, and each query only reads its time range
+dataset_accessor_WL_nc4 = DatasetAccessor("./WL_oil_platforms.nc4", keep_open=True)
 
 list_station_ids = dataset_accessor_WL_nc4.station_ids
 print(list_station_ids)
@@ -27,3 +28,5 @@ datetime_end = datetime.datetime(2019, 12, 1, 0, 0, 0, tzinfo=pytz.utc)
 
 for crrt_station in list_station_ids:
     dataset_accessor_WL_nc4.visualize_single_station(crrt_station, datetime_start, datetime_end)
+
+dataset_accessor_WL_nc4.close()
@@ -13,16 +13,18 @@ import matplotlib.pyplot as plt
 
 import numpy as np
 
-import netCDF4 as nc4
-
 from d22_data_format.datablocs_summary import show_summary_blocks_across_stations
 from d22_data_format.data_extractor import DataSpec, DataExtractor
+from d22_data_format.netcdf_writer import TimeSeriesNetCDFWriter, write_extracted_time_series, \
+    read_time_series_netcdf
+from d22_data_format.columnar_result import datetime_to_posix
 from d22_data_format.helpers.datetimes import datetime_range, assert_is_utc_datetime
 from d22_data_format.helpers.raise_assert import ras
 from d22_data_format.helpers.filters import three_stages_hampel, interpolate_short_dropouts, hampel, \
     butter_bandpass_filter
 from d22_data_format.helpers.filters import outlier_dropout_processing, running_average
 from d22_data_format.name_lookups import dict_name_to_position
+from d22_data_format.overview_store import OverviewStore
 
 logging.basicConfig(level=logging.INFO)
 
@@ -43,17 +45,17 @@ logging.basicConfig(level=logging.INFO)
 ############################################################
 
 # the first step is to have a look at which WL data are available form which stations
-with open('../d22_data_format/dict_pure_metadata.pkl', "rb") as fh:
-    dict_pure_metadata = pickle.load(fh)
+# only the WL blocks are read from the overview store
+dict_pure_metadata = OverviewStore("../d22_data_format/overview_store").load(list_block_prefixes=["WL"])
 
 if False:
     show_summary_blocks_across_stations(dict_pure_metadata, list_block_prefixes=["WL"])
 
 # based on this, we can define a series of specs in different station folders
 # for which we want to extract data.
-# out of this, we generate a pkl dataset
+# out of this, we generate a nc4 dataset, with one "station" per spec
 # we take data from the stations that have "a lot" of data
-path_WL_data = "./dict_data_WL.pkl"
+path_WL_data = "./WL_data_specs.nc4"
 path_interpolated_outlier_removed_data = "./dict_data_WL_interpolated_outliers_removed.pkl"
 
 # heimdal has some data
@@ -141,64 +143,45 @@ datetime_resolution = datetime.timedelta(minutes=10)
 timedelta_running_average_width = datetime.timedelta(days=10)
 timedelta_slow_running_average_width = datetime.timedelta(days=20)
 
+# all the platforms are extracted as a single job: the folders are parsed concurrently,
+# only the files within the time window are parsed, and all the time series share one time base
+list_all_specs = list_specs_heimdal + list_specs_ekofisk + list_specs_ekofiskL + list_specs_heidrun + \
+    list_specs_draugen + list_specs_trollb + list_specs_trollc + list_specs_veslefrikka + \
+    list_specs_veslefrikkb + list_specs_sleipner + list_specs_snorreb
+
 # then we need, for each of these datasets / specs, to parse, read, and put
 # together the data from the corresponding d22 files. This takes quite a while.
+# the time series are extracted one month at a time and appended to a chunked, compressed
+# nc4 file, so that the whole dataset never needs to be in memory.
 if False:
-    print("start populating the pkl data... This will take a while and needs lustre access")
-    # the dataset is first in the form of a dict
-    dict_dataset = {}
-
-    dict_dataset["timestamps"] = list(datetime_range(datetime_start,
-                                                     datetime_end,
-                                                     datetime_resolution))
-
-    # a few helper functions to avoid boiler plate code
-    def build_dict_data(crrt_list_spec):
-        data_extractor = DataExtractor()
-        data_extractor.extract_available_data(crrt_list_spec)
-        dict_time_series = data_extractor.data_as_time_series(datetime_start,
-                                                              datetime_end,
-                                                              datetime_resolution)
-
-        ras(dict_time_series["timestamps"] == dict_dataset["timestamps"]) 
-
-        for crrt_spec in crrt_list_spec:
-            dict_dataset[crrt_spec] = dict_time_series[crrt_spec]
-
-    build_dict_data(list_specs_heimdal)
-
-    build_dict_data(list_specs_ekofisk)
+    print("start populating the nc4 data... This will take a while and needs lustre access")
 
-    build_dict_data(list_specs_ekofiskL)
+    data_extractor = DataExtractor(nbr_workers=None)
 
-    build_dict_data(list_specs_heidrun)
+    with TimeSeriesNetCDFWriter(path_WL_data, [str(crrt_spec) for crrt_spec in list_all_specs],
+                                observation_units="m") as netcdf_writer:
+        write_extracted_time_series(data_extractor, list_all_specs, netcdf_writer,
+                                    datetime_start, datetime_end, datetime_resolution)
 
-    build_dict_data(list_specs_draugen)
+# at this stage, we have created the nc4 file with the dataset and it is available for loading
+print("start loading nc4 data...")
 
-    build_dict_data(list_specs_trollb)
+dict_time_series = read_time_series_netcdf(path_WL_data)
 
-    build_dict_data(list_specs_trollc)
+# the dataset is used in the form of a dict
+dict_dataset = {}
 
-    build_dict_data(list_specs_veslefrikka)
+dict_dataset["timestamps"] = list(datetime_range(datetime_start,
+                                                 datetime_end,
+                                                 datetime_resolution))
 
-    build_dict_data(list_specs_veslefrikkb)
+ras(np.array_equal(dict_time_series["timestamps"],
+                   [datetime_to_posix(crrt_datetime) for crrt_datetime in dict_dataset["timestamps"]]))
 
-    build_dict_data(list_specs_sleipner)
+for crrt_spec in list_all_specs:
+    dict_dataset[crrt_spec] = dict_time_series[str(crrt_spec)]
 
-    build_dict_data(list_specs_snorreb)
-
-    # save
-
-    with open(path_WL_data, "wb") as fh:
-        pickle.dump(dict_dataset, fh)
-
-# at this stage, we have created the pkl dict with the dataset and it is available for loading
-print("start loading pkl data...")
-
-with open(path_WL_data, "rb") as fh:
-    dict_dataset = pickle.load(fh)
-
-print("... done loading pkl data!")
+print("... done loading nc4 data!")
 
 ############################################################
 ############################################################
@@ -923,70 +906,46 @@ if False:
         "veslefrikk",
     ]
 
-    fill_value = 1.0e37
-
     print("start writing nc4 dataset...")
 
-    with nc4.Dataset(nc4_path, "w", format="NETCDF4") as nc4_fh: 
-        nc4_fh.set_auto_mask(False)
-
-        description_string = "Water Level (WL) dataset from the d22 data provided " +\
-                            "by the Norwegian oil platforms. These are cleaned and pre " +\
-                            "processed data from " +\
-                            "/lustre/storeB/immutable/archive/projects/metproduction/DNMI_OFFSHORE " +\
-                            "generated on {} ".format(datetime.datetime.now().isoformat()[:10]) +\
-                            "using code from https://gitlab.met.no/jeanr/d22_data_format/-/tree/master/WL_data " +\
-                            "in all the following, units are m, and all timestamps are UTC."
-
-        nc4_fh.Conventions = "CF-X.X"
-        nc4_fh.title = "water level from d22 WL blocks of Norwegian oil platforms"
-        nc4_fh.description = description_string
-        nc4_fh.institution = "IT department, Norwegian Meteorological Institute, using d22 WL data from oil platforms"
-        nc4_fh.Contact = "jeanr@met.no"
-
-        _ = nc4_fh.createDimension('station', len(list_usable_platforms))
-        number_of_time_entries = len(dict_dataset["timestamps"])
-        _ = nc4_fh.createDimension('time', number_of_time_entries)
-
-        stationid = nc4_fh.createVariable("stationid", str, ('station'))
-        latitude = nc4_fh.createVariable('latitude', 'f4', ('station'))
-        longitude = nc4_fh.createVariable('longitude', 'f4', ('station'))
-        timestamps = nc4_fh.createVariable('timestamps', 'i8', ('time'))
-        observation = nc4_fh.createVariable('observation', 'f4', ('station', 'time'))
-
-        stationid.description = "unique ID string of each station"
-        stationid.units = "none"
-
-        latitude.description = "latitude of each station"
-        latitude.units = "degree North"
-
-        longitude.description = "longitude of each station"
-        longitude.units = "degree East"
-
-        timestamps.description = "common time base for all data"
-        timestamps.units = "POSIX timestamp"
-
-        observation.description = "water level observation at each station over the time base"
-        observation.units = "m, fill value: 1.0e37"
-        observation.standard_name = "observed_sea_surface_height"
-
-        timestamps_vector = [crrt_datetime.timestamp()
-                            for crrt_datetime in dict_dataset["timestamps"]]
-
-        timestamps[:] = np.array(timestamps_vector)
-
-        for ind, crrt_station_id in enumerate(list_usable_platforms):
-            stationid[ind] = crrt_station_id
-
-            latitude[ind] = dict_name_to_position[crrt_station_id][0]
-            longitude[ind] = dict_name_to_position[crrt_station_id][1]
-
-            crrt_pkl_dict = "dict_fixed_{}.pkl".format(crrt_station_id)
-            with open(crrt_pkl_dict, "rb") as fh:
-                dict_read_pkl_data = pickle.load(fh)
-                np_observations = dict_read_pkl_data[crrt_station_id]
-                np_observations[np.where(np.isnan(np_observations))] = fill_value
-
-            observation[ind, :] = np_observations
+    description_string = "Water Level (WL) dataset from the d22 data provided " +\
+                        "by the Norwegian oil platforms. These are cleaned and pre " +\
+                        "processed data from " +\
+                        "/lustre/storeB/immutable/archive/projects/metproduction/DNMI_OFFSHORE " +\
+                        "generated on {} ".format(datetime.datetime.now().isoformat()[:10]) +\
+                        "using code from https://gitlab.met.no/jeanr/d22_data_format/-/tree/master/WL_data " +\
+                        "in all the following, units are m, and all timestamps are UTC."
+
+    dict_attributes = {
+        "Conventions": "CF-X.X",
+        "title": "water level from d22 WL blocks of Norwegian oil platforms",
+        "description": description_string,
+        "institution": "IT department, Norwegian Meteorological Institute, using d22 WL data from oil platforms",
+        "Contact": "jeanr@met.no",
+    }
+
+    dict_observation_attributes = {
+        "description": "water level observation at each station over the time base",
+        "standard_name": "observed_sea_surface_height",
+    }
+
+    list_observations = []
+
+    for crrt_station_id in list_usable_platforms:
+        crrt_pkl_dict = "dict_fixed_{}.pkl".format(crrt_station_id)
+        with open(crrt_pkl_dict, "rb") as fh:
+            dict_read_pkl_data = pickle.load(fh)
+            list_observations.append(dict_read_pkl_data[crrt_station_id])
+
+    with TimeSeriesNetCDFWriter(nc4_path, list_usable_platforms,
+                                list_latitudes=[dict_name_to_position[crrt_station_id][0]
+                                                for crrt_station_id in list_usable_platforms],
+                                list_longitudes=[dict_name_to_position[crrt_station_id][1]
+                                                 for crrt_station_id in list_usable_platforms],
+                                observation_units="m",
+                                dict_attributes=dict_attributes,
+                                dict_observation_attributes=dict_observation_attributes) as netcdf_writer:
+        netcdf_writer.append([datetime_to_posix(crrt_datetime) for crrt_datetime in dict_dataset["timestamps"]],
+                             list_observations)
 
     print("...done")
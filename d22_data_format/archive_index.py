@@ -0,0 +1,460 @@
+"""A persistent index of the d22 archive: each d22 file, with its station folder, size,
+mtime, first and last package datetimes, station IDs and block titles. This allows to
+find the files of a station over a time range without walking the archive tree nor
+opening the files.
+
+The index is refreshed incrementally: the tree is walked again, but a directory whose
+mtime did not change is not listed again (its subdirectories and files are taken from
+the index), and only the new or changed (size or mtime) files are scanned, with a
+HEADER_ONLY parsing. A file modified in place does not change the mtime of its
+directory; use refresh(check_all_files=True) to stat all the files.
+
+As with d22_global_dirs_generator, only the files in the leaf directories of the d22
+folder of each station are indexed. The index file is a sequence of pickles: the full
+index, written to a temporary file and atomically renamed, followed by the updates (the
+directories and files that changed) appended by the next saves, so that a refresh that
+finds a few new files does not write the whole index again. The index is written in full
+again once it holds max_nbr_appended_updates updates, or if its last update was cut (for
+example by a crash during the save, the cut update is then dropped at load)."""
+
+import logging
+
+import os
+
+import pickle
+
+import tempfile
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.helpers.datetimes import assert_is_utc_datetime
+from d22_data_format.helpers.raise_assert import ras
+from d22_data_format.name_lookups import list_station_ids_in_file
+
+default_path_index_file = os.path.join(os.path.expanduser("~"), ".cache", "d22_data_format", "archive_index.pkl")
+
+# increase if the content of the index changes, to discard the old index files
+index_format_version = 2
+
+# the number of updates appended to the index file before it is written in full again
+max_nbr_appended_updates = 64
+
+
+class ArchiveFileEntry():
+    """What the index knows about one d22 file. first_datetime and last_datetime are
+    None if no package could be read; error_message is not None if the scan of the
+    file stopped on an error (the entry then holds what was read until the error,
+    except list_station_ids that has the IDs of all the package headers of the file)."""
+
+    def __init__(self, path, folder, size, mtime_ns):
+        self.path = path
+        self.folder = folder
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.first_datetime = None
+        self.last_datetime = None
+        self.list_station_ids = []
+        self.list_block_titles = []
+        self.error_message = None
+
+    def overlaps(self, datetime_start=None, datetime_end=None):
+        """If the file may have packages within [datetime_start; datetime_end]. A file
+        that could not be scanned in full may have any."""
+        if self.first_datetime is None or self.error_message is not None:
+            return True
+
+        if datetime_start is not None and self.last_datetime < datetime_start:
+            return False
+
+        if datetime_end is not None and self.first_datetime > datetime_end:
+            return False
+
+        return True
+
+    def may_have_station_id(self, station_id):
+        """If the file may have packages of station_id. A file that could not be scanned
+        in full may have any."""
+        return self.error_message is not None or station_id in self.list_station_ids
+
+    def __str__(self):
+        return "{}: folder {} / ids {} / {} to {} / blocks {}".format(self.path,
+                                                                      self.folder,
+                                                                      self.list_station_ids,
+                                                                      self.first_datetime,
+                                                                      self.last_datetime,
+                                                                      self.list_block_titles)
+
+
+def scan_d22_file(path_to_file, folder, stat_file):
+    """Create the ArchiveFileEntry of a file, from a HEADER_ONLY parsing."""
+    archive_file_entry = ArchiveFileEntry(path_to_file, folder, stat_file.st_size, stat_file.st_mtime_ns)
+
+    try:
+        for crrt_package in D22Parser(path_to_file, parsing_mode=d22_parsing_mode.HEADER_ONLY).iter_packages():
+            crrt_datetime = crrt_package.utc_datetime
+
+            if archive_file_entry.first_datetime is None or crrt_datetime < archive_file_entry.first_datetime:
+                archive_file_entry.first_datetime = crrt_datetime
+            if archive_file_entry.last_datetime is None or crrt_datetime > archive_file_entry.last_datetime:
+                archive_file_entry.last_datetime = crrt_datetime
+
+            if crrt_package.station_name not in archive_file_entry.list_station_ids:
+                archive_file_entry.list_station_ids.append(crrt_package.station_name)
+
+            for crrt_block_title in crrt_package.dict_blocks:
+                if crrt_block_title not in archive_file_entry.list_block_titles:
+                    archive_file_entry.list_block_titles.append(crrt_block_title)
+
+    except Exception as crrt_except:
+        logging.warning("could not scan the whole file {}: {}".format(path_to_file, crrt_except))
+        archive_file_entry.error_message = "{}: {}".format(type(crrt_except).__name__, crrt_except)
+
+        # the station IDs after the error are not lost: take them from the tolerant scan of
+        # the package headers of the whole file
+        for crrt_station_id in list_station_ids_in_file(path_to_file):
+            if crrt_station_id not in archive_file_entry.list_station_ids:
+                archive_file_entry.list_station_ids.append(crrt_station_id)
+
+    return archive_file_entry
+
+
+class ArchiveIndex():
+    def __init__(self, path_root_data=None, path_index_file=None):
+        """Input:
+            - path_root_data: the root of the d22 data. None (default) is the right
+            location on lustreB.
+            - path_index_file: where the index is saved. None (default) uses
+            ~/.cache/d22_data_format/archive_index.pkl
+        The index is loaded from path_index_file if it exists (and is for the same
+        path_root_data); call refresh to bring it up to date with the archive.
+        """
+        if path_root_data is None:
+            path_root_data = "/lustre/storeB/immutable/archive/projects/metproduction/DNMI_OFFSHORE/"
+
+        if path_index_file is None:
+            path_index_file = default_path_index_file
+
+        self.path_root_data = os.path.normpath(str(path_root_data))
+        self.path_index_file = str(path_index_file)
+
+        # directory path -> {"mtime_ns", "list_subdirs", "list_files"}
+        self.dict_dirs = {}
+        # file path -> ArchiveFileEntry
+        self.dict_files = {}
+
+        # the changes since the last load or save, to append to the index file; None for
+        # a directory or file removed
+        self.dict_dirs_updates = {}
+        self.dict_files_updates = {}
+
+        # (inode, size) of the index file as last read or written, None if it must be
+        # written in full at the next save, and the number of updates it holds
+        self.index_file_state = None
+        self.nbr_appended_updates = 0
+
+        # statistics of the last refresh
+        self.nbr_dirs_listed = 0
+        self.nbr_files_scanned = 0
+
+        self.load()
+
+    def load(self):
+        """Load the index file, if there is a valid one: the full index, and the updates
+        appended to it."""
+        try:
+            crrt_fh = open(self.path_index_file, "rb")
+        except OSError:
+            return
+
+        with crrt_fh:
+            try:
+                dict_index = pickle.load(crrt_fh)
+            except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                return
+
+            if dict_index.get("index_format_version") != index_format_version or \
+                    dict_index.get("path_root_data") != self.path_root_data:
+                logging.info("discard the index file {}, it is outdated or for another root".format(
+                    self.path_index_file))
+                return
+
+            self.dict_dirs = dict_index["dict_dirs"]
+            self.dict_files = dict_index["dict_files"]
+            self.nbr_appended_updates = 0
+
+            stat_index_file = os.fstat(crrt_fh.fileno())
+
+            while crrt_fh.tell() < stat_index_file.st_size:
+                try:
+                    dict_update = pickle.load(crrt_fh)
+                except (EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+                    # the changes of the cut update are seen again at the next refresh
+                    logging.warning("drop the cut update at the end of the index file {}".format(
+                        self.path_index_file))
+                    return
+
+                self.apply_update(dict_update)
+                self.nbr_appended_updates += 1
+
+        self.index_file_state = (stat_index_file.st_ino, stat_index_file.st_size)
+
+    def apply_update(self, dict_update):
+        """Apply an update read from the index file."""
+        for dict_entries, dict_changes in [(self.dict_dirs, dict_update["dict_dirs"]),
+                                           (self.dict_files, dict_update["dict_files"])]:
+            for crrt_path, crrt_value in dict_changes.items():
+                if crrt_value is None:
+                    dict_entries.pop(crrt_path, None)
+                else:
+                    dict_entries[crrt_path] = crrt_value
+
+    def index_file_is_unchanged(self):
+        """If the index file is still the one last read or written by this index."""
+        try:
+            stat_index_file = os.stat(self.path_index_file)
+        except OSError:
+            return False
+
+        return self.index_file_state == (stat_index_file.st_ino, stat_index_file.st_size)
+
+    def save(self):
+        """Save the index file: append the changes since the last load or save to it, or
+        write it in full if it holds max_nbr_appended_updates updates already, or is not
+        the one last read or written by this index."""
+        if self.index_file_state is not None and self.nbr_appended_updates < max_nbr_appended_updates and \
+                self.index_file_is_unchanged():
+            if not self.dict_dirs_updates and not self.dict_files_updates:
+                return
+
+            dict_update = {"dict_dirs": self.dict_dirs_updates,
+                           "dict_files": self.dict_files_updates}
+
+            with open(self.path_index_file, "ab") as crrt_fh:
+                pickle.dump(dict_update, crrt_fh, protocol=pickle.HIGHEST_PROTOCOL)
+                crrt_fh.flush()
+                stat_index_file = os.fstat(crrt_fh.fileno())
+
+            self.nbr_appended_updates += 1
+
+        else:
+            dict_index = {"index_format_version": index_format_version,
+                          "path_root_data": self.path_root_data,
+                          "dict_dirs": self.dict_dirs,
+                          "dict_files": self.dict_files}
+
+            path_index_dir = os.path.dirname(os.path.abspath(self.path_index_file))
+            os.makedirs(path_index_dir, exist_ok=True)
+
+            with tempfile.NamedTemporaryFile(dir=path_index_dir, suffix=".tmp", delete=False) as crrt_fh:
+                path_tmp = crrt_fh.name
+                try:
+                    pickle.dump(dict_index, crrt_fh, protocol=pickle.HIGHEST_PROTOCOL)
+                except Exception:
+                    crrt_fh.close()
+                    os.remove(path_tmp)
+                    raise
+
+            os.replace(path_tmp, self.path_index_file)
+            stat_index_file = os.stat(self.path_index_file)
+
+            self.nbr_appended_updates = 0
+
+        self.index_file_state = (stat_index_file.st_ino, stat_index_file.st_size)
+        self.dict_dirs_updates = {}
+        self.dict_files_updates = {}
+
+    def list_dir(self, path_dir):
+        """The subdirectories and files of path_dir, from the index if the mtime of
+        path_dir did not change, else by listing it again. Return the dict of the
+        directory, and if it was listed again."""
+        stat_dir = os.stat(path_dir)
+        dict_dir = self.dict_dirs.get(path_dir)
+
+        if dict_dir is not None and dict_dir["mtime_ns"] == stat_dir.st_mtime_ns:
+            return (dict_dir, False)
+
+        self.nbr_dirs_listed += 1
+        list_subdirs = []
+        list_files = []
+
+        with os.scandir(path_dir) as iterator_entries:
+            for crrt_entry in iterator_entries:
+                if crrt_entry.is_dir():
+                    list_subdirs.append(crrt_entry.path)
+                elif crrt_entry.is_file():
+                    list_files.append(crrt_entry.path)
+
+        # the mtime is the one from before the listing, so that a change during the
+        # listing is seen at the next refresh
+        dict_dir = {"mtime_ns": stat_dir.st_mtime_ns,
+                    "list_subdirs": sorted(list_subdirs),
+                    "list_files": sorted(list_files)}
+        self.dict_dirs[path_dir] = dict_dir
+        self.dict_dirs_updates[path_dir] = dict_dir
+
+        return (dict_dir, True)
+
+    def refresh(self, check_all_files=False, save=True):
+        """Bring the index up to date with the archive, and save it if save.
+        Input:
+            - check_all_files: if True, stat all the files, also in the directories
+            that did not change, to catch the files modified in place.
+            - save: if the index file should be written after the refresh.
+        """
+        # 1. walk the station folders, and their d22 folders down to the leaf directories,
+        #    listing again only the directories that changed
+        # 2. in the leaf directories, scan the new or changed files
+        # 3. drop the directories and files that are not in the archive any longer
+
+        self.nbr_dirs_listed = 0
+        self.nbr_files_scanned = 0
+
+        set_seen_dirs = set()
+        set_seen_files = set()
+
+        # 1.
+        dict_root, _ = self.list_dir(self.path_root_data)
+        set_seen_dirs.add(self.path_root_data)
+
+        for crrt_station_path in dict_root["list_subdirs"]:
+            crrt_folder = os.path.basename(crrt_station_path)
+            crrt_d22_path = os.path.join(crrt_station_path, "d22")
+
+            if not os.path.isdir(crrt_d22_path):
+                logging.warning("seems like {} has no d22!".format(crrt_station_path))
+                continue
+
+            list_dirs_to_walk = [crrt_d22_path]
+
+            while list_dirs_to_walk:
+                crrt_dir = list_dirs_to_walk.pop()
+                dict_dir, dir_listed_again = self.list_dir(crrt_dir)
+                set_seen_dirs.add(crrt_dir)
+
+                if dict_dir["list_subdirs"]:
+                    list_dirs_to_walk.extend(dict_dir["list_subdirs"])
+                    continue
+
+                # 2.
+                for crrt_file in dict_dir["list_files"]:
+                    set_seen_files.add(crrt_file)
+                    archive_file_entry = self.dict_files.get(crrt_file)
+
+                    if archive_file_entry is not None and not (dir_listed_again or check_all_files):
+                        continue
+
+                    stat_file = os.stat(crrt_file)
+
+                    if archive_file_entry is not None and \
+                            archive_file_entry.size == stat_file.st_size and \
+                            archive_file_entry.mtime_ns == stat_file.st_mtime_ns and \
+                            archive_file_entry.folder == crrt_folder:
+                        continue
+
+                    logging.info("scan {}".format(crrt_file))
+                    self.dict_files[crrt_file] = scan_d22_file(crrt_file, crrt_folder, stat_file)
+                    self.dict_files_updates[crrt_file] = self.dict_files[crrt_file]
+                    self.nbr_files_scanned += 1
+
+        # 3.
+        for crrt_dir in [crrt_dir for crrt_dir in self.dict_dirs if crrt_dir not in set_seen_dirs]:
+            del self.dict_dirs[crrt_dir]
+            self.dict_dirs_updates[crrt_dir] = None
+
+        for crrt_file in [crrt_file for crrt_file in self.dict_files if crrt_file not in set_seen_files]:
+            del self.dict_files[crrt_file]
+            self.dict_files_updates[crrt_file] = None
+
+        logging.info("refreshed the archive index: {} directories listed, {} files scanned".format(
+            self.nbr_dirs_listed, self.nbr_files_scanned))
+
+        if save:
+            self.save()
+
+    def iter_leaf_dirs(self, path_dir):
+        """The leaf directories under path_dir, in order, from the index only."""
+        dict_dir = self.dict_dirs.get(path_dir)
+
+        if dict_dir is None:
+            return
+
+        if not dict_dir["list_subdirs"]:
+            yield path_dir
+            return
+
+        for crrt_subdir in dict_dir["list_subdirs"]:
+            yield from self.iter_leaf_dirs(crrt_subdir)
+
+    def files(self, folder=None, station_id=None, datetime_start=None, datetime_end=None):
+        """The ArchiveFileEntry of the files that match, from the index only, in the order
+        of d22_files_in_dir_generator.
+        Input:
+            - folder: the station folder, or a list of station folders, None for all. The
+            folders can be given with slashes, as "/heimdal/".
+            - station_id: the files that may have packages of this station ID, None for any.
+            - datetime_start, datetime_end: the files that may have packages within
+            [datetime_start; datetime_end], None for no bound.
+        """
+        if isinstance(folder, str):
+            folder = [folder]
+
+        if folder is not None:
+            folder = [crrt_folder.strip("/") for crrt_folder in folder]
+
+        if datetime_start is not None:
+            assert_is_utc_datetime(datetime_start)
+        if datetime_end is not None:
+            assert_is_utc_datetime(datetime_end)
+
+        dict_root = self.dict_dirs.get(self.path_root_data)
+        ras(dict_root is not None, "the index is empty, call refresh first")
+
+        list_entries = []
+
+        for crrt_station_path in dict_root["list_subdirs"]:
+            if folder is not None and os.path.basename(crrt_station_path) not in folder:
+                continue
+
+            for crrt_dir in self.iter_leaf_dirs(os.path.join(crrt_station_path, "d22")):
+                for crrt_file in self.dict_dirs[crrt_dir]["list_files"]:
+                    archive_file_entry = self.dict_files.get(crrt_file)
+
+                    if archive_file_entry is None:
+                        continue
+
+                    if station_id is not None and not archive_file_entry.may_have_station_id(station_id):
+                        continue
+
+                    if not archive_file_entry.overlaps(datetime_start, datetime_end):
+                        continue
+
+                    list_entries.append(archive_file_entry)
+
+        return list_entries
+
+    def folders(self):
+        """The station folders in the index, in order."""
+        dict_root = self.dict_dirs.get(self.path_root_data)
+        ras(dict_root is not None, "the index is empty, call refresh first")
+
+        return [os.path.basename(crrt_station_path) for crrt_station_path in dict_root["list_subdirs"]
+                if os.path.join(crrt_station_path, "d22") in self.dict_dirs]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    archive_index = ArchiveIndex()
+    archive_index.refresh()
+
+    for crrt_folder in archive_index.folders():
+        list_entries = archive_index.files(folder=crrt_folder)
+        list_entries_with_datetimes = [crrt_entry for crrt_entry in list_entries
+                                       if crrt_entry.first_datetime is not None]
+
+        if list_entries_with_datetimes:
+            print("{}: {} files, from {} to {}".format(
+                crrt_folder, len(list_entries),
+                min([crrt_entry.first_datetime for crrt_entry in list_entries_with_datetimes]),
+                max([crrt_entry.last_datetime for crrt_entry in list_entries_with_datetimes])))
+        else:
+            print("{}: {} files".format(crrt_folder, len(list_entries)))
@@ -0,0 +1,117 @@
+import os
+
+import shutil
+
+import tempfile
+
+import datetime
+import pytz
+
+from d22_data_format.archive_index import ArchiveIndex
+from d22_data_format.exploration_tools import d22_files_in_dir_generator
+from d22_data_format.helpers.load_test_data import write_dummy_d22_tree
+from d22_data_format.name_lookups import generate_dict_folder_to_id
+
+
+def test_archive_index_queries_and_refresh():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_root_data = tmpdirname + "/data/"
+        path_index_file = tmpdirname + "/index/archive_index.pkl"
+        write_dummy_d22_tree(path_root_data)
+
+        # a second station, with a year / month layout
+        for crrt_month in ["01", "02"]:
+            os.makedirs(path_root_data + "/other/d22/2014/" + crrt_month)
+            shutil.copy(path_root_data + "/dummy/d22/2013/20130901.d22",
+                        path_root_data + "/other/d22/2014/{}/2014{}01.d22".format(crrt_month, crrt_month))
+
+        archive_index = ArchiveIndex(path_root_data=path_root_data, path_index_file=path_index_file)
+        archive_index.refresh()
+
+        assert archive_index.folders() == ["dummy", "other"]
+        assert [crrt_entry.path for crrt_entry in archive_index.files()] == \
+            [str(crrt_file) for crrt_file in d22_files_in_dir_generator(path_root_data=path_root_data)]
+        assert list(d22_files_in_dir_generator(path_root_data=path_root_data, list_stations_subfolders=["other"],
+                                               archive_index=archive_index)) == \
+            list(d22_files_in_dir_generator(path_root_data=path_root_data, list_stations_subfolders=["other"]))
+
+        entry_first_day = archive_index.files(folder="dummy")[0]
+        assert entry_first_day.list_station_ids == ["DUMMY"]
+        assert entry_first_day.list_block_titles == ["MD1", "WL1"]
+        assert entry_first_day.first_datetime == datetime.datetime(2013, 9, 1, 0, 0, tzinfo=pytz.utc)
+        assert entry_first_day.last_datetime == datetime.datetime(2013, 9, 1, 23, 0, tzinfo=pytz.utc)
+
+        # the cut file could not be scanned in full, so it is always a candidate
+        list_entries = archive_index.files(folder="dummy", station_id="DUMMY",
+                                           datetime_start=datetime.datetime(2013, 9, 2, 0, 0, tzinfo=pytz.utc),
+                                           datetime_end=datetime.datetime(2013, 9, 3, 12, 0, tzinfo=pytz.utc))
+        assert [os.path.basename(crrt_entry.path) for crrt_entry in list_entries] == \
+            ["20130902.d22", "20130903.d22", "20130905.d22"]
+        assert list_entries[-1].error_message is not None
+        list_entries = archive_index.files(station_id="not a station")
+        assert [os.path.basename(crrt_entry.path) for crrt_entry in list_entries] == ["20130905.d22"]
+
+        # nothing changed: nothing is listed or scanned again, and the saved index is the same
+        archive_index = ArchiveIndex(path_root_data=path_root_data, path_index_file=path_index_file)
+        assert len(archive_index.files()) == 7
+        archive_index.refresh()
+        assert archive_index.nbr_dirs_listed == 0
+        assert archive_index.nbr_files_scanned == 0
+
+        # a new file: only its directory is listed, and only the new file is scanned
+        shutil.copy(path_root_data + "/dummy/d22/2013/20130901.d22", path_root_data + "/dummy/d22/2013/20130910.d22")
+        os.remove(path_root_data + "/other/d22/2014/02/20140201.d22")
+
+        archive_index.refresh()
+        assert archive_index.nbr_dirs_listed == 2
+        assert archive_index.nbr_files_scanned == 1
+        assert [os.path.basename(crrt_entry.path) for crrt_entry in archive_index.files()][-3:] == \
+            ["20130905.d22", "20130910.d22", "20140101.d22"]
+
+        # the changes were appended to the index file, and are read back
+        assert archive_index.nbr_appended_updates == 1
+        archive_index_reloaded = ArchiveIndex(path_root_data=path_root_data, path_index_file=path_index_file)
+        assert archive_index_reloaded.nbr_appended_updates == 1
+        assert archive_index_reloaded.dict_dirs == archive_index.dict_dirs
+        assert [str(crrt_entry) for crrt_entry in archive_index_reloaded.files()] == \
+            [str(crrt_entry) for crrt_entry in archive_index.files()]
+
+        # an update cut by a crash is dropped, its changes are seen again at the next refresh,
+        # and the index file is then written in full
+        with open(path_index_file, "r+b") as crrt_fh:
+            crrt_fh.truncate(os.path.getsize(path_index_file) - 10)
+
+        archive_index = ArchiveIndex(path_root_data=path_root_data, path_index_file=path_index_file)
+        assert len(archive_index.files()) == 7
+        archive_index.refresh()
+        assert archive_index.nbr_files_scanned == 1
+        assert archive_index.nbr_appended_updates == 0
+        assert [str(crrt_entry) for crrt_entry in archive_index.files()] == \
+            [str(crrt_entry) for crrt_entry in archive_index_reloaded.files()]
+
+
+def test_archive_index_station_ids_after_error():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_d22 = tmpdirname + "/dummy/d22/2013/"
+        os.makedirs(path_d22)
+
+        # the package of the second hour has a corrupt date, the next one is of another station
+        list_lines = []
+        for crrt_station_id, crrt_date, crrt_time in [("DUMMY", "01-09-2013", "00:00"),
+                                                      ("DUMMY", "xx-09-2013", "01:00"),
+                                                      ("OTHER", "01-09-2013", "02:00")]:
+            list_lines += ["!!!!", "DF022 1", crrt_station_id + " ", crrt_date, crrt_time,
+                           "\fMD1-2", "1.00", "\f$$$$$$$"]
+
+        with open(path_d22 + "20130901.d22", "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write("\n".join(list_lines) + "\n")
+
+        archive_index = ArchiveIndex(path_root_data=tmpdirname, path_index_file=tmpdirname + "/index.pkl")
+        archive_index.refresh()
+
+        archive_file_entry = archive_index.files()[0]
+        assert archive_file_entry.error_message is not None
+        assert archive_file_entry.last_datetime == datetime.datetime(2013, 9, 1, 0, 0, tzinfo=pytz.utc)
+        assert archive_file_entry.list_station_ids == ["DUMMY", "OTHER"]
+        assert generate_dict_folder_to_id(archive_index=archive_index) == \
+            {"dummy": [("DUMMY", path_d22 + "20130901.d22"), ("OTHER", path_d22 + "20130901.d22")]}
@@ -0,0 +1,377 @@
+"""A columnar container for the parsed d22 data. Instead of the nested dict of
+D22Parser (station -> datetime -> block title -> {"nbr_entries", "list_entries"}),
+the data of each station and block title are kept as:
+    - timestamps: int64 array of POSIX timestamps, one per package with this block
+    - values: float64 2D array (packages x entries), ragged blocks padded with NaN
+    - nbr_entries: int64 array, the number of entries declared for each package
+This is much lighter in memory than the Python floats in lists, and allows to work
+on whole blocks at once. A read only view that looks like the parsed dict is
+available through as_dict_view, for the code that still needs the dict."""
+
+import datetime
+import pytz
+
+from collections.abc import Mapping
+
+import numpy as np
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.helpers.datetimes import assert_is_utc_datetime
+from d22_data_format.helpers.raise_assert import ras
+
+
+def datetime_to_posix(datetime_in):
+    """Convert an UTC datetime to an int POSIX timestamp."""
+    assert_is_utc_datetime(datetime_in)
+    return int(datetime_in.timestamp())
+
+
+def posix_to_datetime(timestamp_in):
+    """Convert a POSIX timestamp to an UTC datetime, as used in the parsed dict."""
+    return datetime.datetime.fromtimestamp(int(timestamp_in), pytz.utc)
+
+
+class ColumnarBlock():
+    """All the packages of a given block title from a given station."""
+
+    def __init__(self, timestamps, values, nbr_entries):
+        ras(timestamps.dtype == np.int64)
+        ras(values.dtype == np.float64)
+        ras(len(values.shape) == 2)
+        ras(values.shape[0] == timestamps.shape[0])
+        ras(nbr_entries.shape == timestamps.shape)
+
+        self.timestamps = timestamps
+        self.values = values
+        self.nbr_entries = nbr_entries
+
+        # filled by process_dict_blocks: block field -> masked array, masked where the
+        # interpreter did not provide the field
+        self.dict_extracted = None
+
+    def __len__(self):
+        return self.timestamps.shape[0]
+
+    def datetimes(self):
+        """The timestamps as a list of UTC datetimes."""
+        return [posix_to_datetime(crrt_timestamp) for crrt_timestamp in self.timestamps]
+
+    def row_index(self, timestamp):
+        """Index of the row with the given POSIX timestamp, or None."""
+        crrt_ind = np.searchsorted(self.timestamps, timestamp)
+
+        if crrt_ind < self.timestamps.shape[0] and self.timestamps[crrt_ind] == timestamp:
+            return int(crrt_ind)
+
+        return None
+
+    def list_entries(self, row_index):
+        """The entries of a row, as in the "list_entries" of the parsed dict."""
+        return self.values[row_index, :max(0, self.nbr_entries[row_index])].tolist()
+
+    def row_as_dict(self, row_index):
+        """A row, as a block dict of the parsed dict."""
+        return {"nbr_entries": int(self.nbr_entries[row_index]),
+                "list_entries": self.list_entries(row_index)}
+
+    def set_extracted(self, list_dict_extracted):
+        """Store the output of a block interpreter, one dict per row, as one masked
+        column per block field."""
+        ras(len(list_dict_extracted) == len(self))
+
+        list_fields = []
+        for crrt_dict_extracted in list_dict_extracted:
+            for crrt_field in crrt_dict_extracted:
+                if crrt_field not in list_fields:
+                    list_fields.append(crrt_field)
+
+        self.dict_extracted = {}
+
+        for crrt_field in list_fields:
+            mask = np.array([crrt_field not in crrt_dict_extracted for crrt_dict_extracted in list_dict_extracted],
+                            dtype=bool)
+            list_values = [crrt_dict_extracted.get(crrt_field, np.nan) for crrt_dict_extracted in list_dict_extracted]
+
+            try:
+                column = np.array(list_values, dtype=np.float64)
+            except (TypeError, ValueError):
+                column = np.array(list_values, dtype=object)
+
+            self.dict_extracted[crrt_field] = np.ma.MaskedArray(column, mask=mask)
+
+    def set_extracted_columns(self, dict_columns):
+        """Store the output of a batch block interpreter, a masked column per block field."""
+        for crrt_column in dict_columns.values():
+            ras(crrt_column.shape == (len(self),))
+
+        self.dict_extracted = dict_columns
+
+
+class ColumnarStation():
+    """All the blocks of a given station. package_timestamps keeps all the packages,
+    including the ones without any block."""
+
+    def __init__(self, package_timestamps, dict_blocks):
+        self.package_timestamps = package_timestamps
+        self.dict_blocks = dict_blocks
+
+
+class ColumnarD22ResultBuilder():
+    """Accumulate packages and blocks, and build a ColumnarD22Result at the end."""
+
+    def __init__(self):
+        # station -> list of package timestamps
+        self.dict_package_timestamps = {}
+        # station -> block title -> (list timestamps, list nbr_entries, list of list_entries)
+        self.dict_blocks = {}
+        # (station, timestamp, block title) of the blocks added from packages
+        self.set_package_blocks = set()
+
+    def add_package(self, station, timestamp):
+        if station not in self.dict_package_timestamps:
+            self.dict_package_timestamps[station] = []
+            self.dict_blocks[station] = {}
+
+        self.dict_package_timestamps[station].append(timestamp)
+
+    def add_block(self, station, timestamp, block_title, nbr_entries, list_entries):
+        ras(list_entries is not None, "the columnar result needs the block values, not a HEADER_ONLY parsing")
+
+        dict_station_blocks = self.dict_blocks[station]
+
+        if block_title not in dict_station_blocks:
+            dict_station_blocks[block_title] = ([], [], [])
+
+        list_timestamps, list_nbr_entries, list_list_entries = dict_station_blocks[block_title]
+        list_timestamps.append(timestamp)
+        list_nbr_entries.append(nbr_entries)
+        list_list_entries.append(list_entries)
+
+    def add_dict_result(self, dict_result):
+        """Add the content of a dict as obtained from D22Parser."""
+        for crrt_station in dict_result:
+            for crrt_datetime in dict_result[crrt_station]:
+                crrt_timestamp = datetime_to_posix(crrt_datetime)
+                self.add_package(crrt_station, crrt_timestamp)
+
+                crrt_package_dict = dict_result[crrt_station][crrt_datetime]
+                for crrt_block_title in crrt_package_dict:
+                    self.add_block(crrt_station, crrt_timestamp, crrt_block_title,
+                                   crrt_package_dict[crrt_block_title]["nbr_entries"],
+                                   crrt_package_dict[crrt_block_title]["list_entries"])
+
+    def add_d22_package(self, package):
+        """Add a D22Package, as yielded by D22Parser.iter_packages. As in the dict of
+        D22Parser, a block met again for the same station and time is ignored."""
+        crrt_timestamp = datetime_to_posix(package.utc_datetime)
+        self.add_package(package.station_name, crrt_timestamp)
+
+        for crrt_block_title, crrt_dict_block in package.dict_blocks.items():
+            crrt_key = (package.station_name, crrt_timestamp, crrt_block_title)
+
+            if crrt_key in self.set_package_blocks:
+                continue
+
+            self.set_package_blocks.add(crrt_key)
+            self.add_block(package.station_name, crrt_timestamp, crrt_block_title,
+                           crrt_dict_block["nbr_entries"], crrt_dict_block["list_entries"])
+
+    def build(self):
+        columnar_result = ColumnarD22Result()
+
+        for crrt_station in self.dict_package_timestamps:
+            package_timestamps = np.unique(np.array(self.dict_package_timestamps[crrt_station], dtype=np.int64))
+            dict_blocks = {}
+
+            for crrt_block_title, (list_timestamps, list_nbr_entries, list_list_entries) \
+                    in self.dict_blocks[crrt_station].items():
+                dict_blocks[crrt_block_title] = block_from_lists(list_timestamps, list_nbr_entries,
+                                                                 list_list_entries)
+
+            columnar_result.dict_stations[crrt_station] = ColumnarStation(package_timestamps, dict_blocks)
+
+        return columnar_result
+
+
+def block_from_lists(list_timestamps, list_nbr_entries, list_list_entries):
+    """Build a ColumnarBlock, sorted by time, from the rows as lists."""
+    nbr_rows = len(list_timestamps)
+    nbr_columns = max([len(crrt_list_entries) for crrt_list_entries in list_list_entries], default=0)
+
+    timestamps = np.array(list_timestamps, dtype=np.int64)
+    nbr_entries = np.array(list_nbr_entries, dtype=np.int64)
+    values = np.full((nbr_rows, nbr_columns), np.nan, dtype=np.float64)
+
+    for crrt_row, crrt_list_entries in enumerate(list_list_entries):
+        values[crrt_row, :len(crrt_list_entries)] = crrt_list_entries
+
+    permutation = np.argsort(timestamps, kind="stable")
+
+    return ColumnarBlock(timestamps[permutation], values[permutation], nbr_entries[permutation])
+
+
+class ColumnarD22Result():
+    """The columnar equivalent of the dict_result of D22Parser."""
+
+    def __init__(self):
+        self.dict_stations = {}
+
+    @classmethod
+    def from_dict_result(cls, dict_result):
+        builder = ColumnarD22ResultBuilder()
+        builder.add_dict_result(dict_result)
+        return builder.build()
+
+    def stations(self):
+        return list(self.dict_stations.keys())
+
+    def block_titles(self, station):
+        return list(self.dict_stations[station].dict_blocks.keys())
+
+    def get_block(self, station, block_title):
+        """The ColumnarBlock for station / block_title, or None if not present."""
+        if station not in self.dict_stations:
+            return None
+
+        return self.dict_stations[station].dict_blocks.get(block_title, None)
+
+    def iter_blocks(self):
+        """Yield (station, block_title, ColumnarBlock) for all the blocks."""
+        for crrt_station, crrt_columnar_station in self.dict_stations.items():
+            for crrt_block_title, crrt_block in crrt_columnar_station.dict_blocks.items():
+                yield (crrt_station, crrt_block_title, crrt_block)
+
+    def to_dict_arrays(self):
+        """All the content as a flat dict of numpy arrays (no object arrays), for
+        example to be saved with np.savez and loaded without pickle."""
+        dict_arrays = {"station_names": np.array(self.stations(), dtype=str)}
+
+        for crrt_station_ind, crrt_station in enumerate(self.stations()):
+            crrt_columnar_station = self.dict_stations[crrt_station]
+            crrt_prefix = "s{}".format(crrt_station_ind)
+
+            dict_arrays[crrt_prefix + "_package_timestamps"] = crrt_columnar_station.package_timestamps
+            dict_arrays[crrt_prefix + "_block_titles"] = np.array(self.block_titles(crrt_station), dtype=str)
+
+            for crrt_block_ind, crrt_block_title in enumerate(self.block_titles(crrt_station)):
+                crrt_block = crrt_columnar_station.dict_blocks[crrt_block_title]
+                crrt_block_prefix = "{}_b{}".format(crrt_prefix, crrt_block_ind)
+
+                dict_arrays[crrt_block_prefix + "_timestamps"] = crrt_block.timestamps
+                dict_arrays[crrt_block_prefix + "_values"] = crrt_block.values
+                dict_arrays[crrt_block_prefix + "_nbr_entries"] = crrt_block.nbr_entries
+
+        return dict_arrays
+
+    @classmethod
+    def from_dict_arrays(cls, dict_arrays):
+        """Inverse of to_dict_arrays."""
+        columnar_result = cls()
+
+        for crrt_station_ind, crrt_station in enumerate(dict_arrays["station_names"].tolist()):
+            crrt_prefix = "s{}".format(crrt_station_ind)
+            dict_blocks = {}
+
+            for crrt_block_ind, crrt_block_title in enumerate(dict_arrays[crrt_prefix + "_block_titles"].tolist()):
+                crrt_block_prefix = "{}_b{}".format(crrt_prefix, crrt_block_ind)
+                dict_blocks[crrt_block_title] = ColumnarBlock(dict_arrays[crrt_block_prefix + "_timestamps"],
+                                                              dict_arrays[crrt_block_prefix + "_values"],
+                                                              dict_arrays[crrt_block_prefix + "_nbr_entries"])
+
+            columnar_result.dict_stations[crrt_station] = \
+                ColumnarStation(dict_arrays[crrt_prefix + "_package_timestamps"], dict_blocks)
+
+        return columnar_result
+
+    def as_dict_view(self):
+        """A read only view looking like the dict_result of D22Parser. Nothing is
+        materialized until it is accessed."""
+        return ColumnarDictView(self)
+
+    def to_dict_result(self):
+        """Materialize the full dict_result of D22Parser."""
+        return {crrt_station: {crrt_datetime: dict(crrt_package_view)
+                               for crrt_datetime, crrt_package_view in crrt_station_view.items()}
+                for crrt_station, crrt_station_view in self.as_dict_view().items()}
+
+
+class ColumnarDictView(Mapping):
+    """station -> ColumnarStationDictView"""
+
+    def __init__(self, columnar_result):
+        self.columnar_result = columnar_result
+
+    def __getitem__(self, station):
+        return ColumnarStationDictView(self.columnar_result.dict_stations[station])
+
+    def __iter__(self):
+        return iter(self.columnar_result.dict_stations)
+
+    def __len__(self):
+        return len(self.columnar_result.dict_stations)
+
+
+class ColumnarStationDictView(Mapping):
+    """datetime -> ColumnarPackageDictView"""
+
+    def __init__(self, columnar_station):
+        self.columnar_station = columnar_station
+
+    def __getitem__(self, datetime_package):
+        crrt_timestamp = datetime_to_posix(datetime_package)
+        package_timestamps = self.columnar_station.package_timestamps
+        crrt_ind = np.searchsorted(package_timestamps, crrt_timestamp)
+
+        if crrt_ind >= package_timestamps.shape[0] or package_timestamps[crrt_ind] != crrt_timestamp:
+            raise KeyError(datetime_package)
+
+        return ColumnarPackageDictView(self.columnar_station, crrt_timestamp)
+
+    def __iter__(self):
+        for crrt_timestamp in self.columnar_station.package_timestamps:
+            yield posix_to_datetime(crrt_timestamp)
+
+    def __len__(self):
+        return self.columnar_station.package_timestamps.shape[0]
+
+
+class ColumnarPackageDictView(Mapping):
+    """block title -> block dict {"nbr_entries", "list_entries"}"""
+
+    def __init__(self, columnar_station, timestamp):
+        self.columnar_station = columnar_station
+        self.timestamp = timestamp
+
+    def __getitem__(self, block_title):
+        crrt_block = self.columnar_station.dict_blocks.get(block_title, None)
+
+        if crrt_block is not None:
+            crrt_row = crrt_block.row_index(self.timestamp)
+            if crrt_row is not None:
+                return crrt_block.row_as_dict(crrt_row)
+
+        raise KeyError(block_title)
+
+    def __iter__(self):
+        for crrt_block_title, crrt_block in self.columnar_station.dict_blocks.items():
+            if crrt_block.row_index(self.timestamp) is not None:
+                yield crrt_block_title
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+
+def parse_d22_file_columnar(path_to_d22_file, parsing_mode=d22_parsing_mode.BULK_BUFFER, wanted_blocks=None):
+    """Parse a d22 file into a ColumnarD22Result, package by package, without
+    building the dict of the whole file. With wanted_blocks, only these blocks are
+    decoded and kept, see D22Parser. HEADER_ONLY is not supported, as it gives no values."""
+    ras(parsing_mode != d22_parsing_mode.HEADER_ONLY, "the columnar result needs the block values, "
+        "HEADER_ONLY parsing is not supported")
+
+    builder = ColumnarD22ResultBuilder()
+
+    for crrt_package in D22Parser(path_to_d22_file=path_to_d22_file, parsing_mode=parsing_mode,
+                                  wanted_blocks=wanted_blocks).iter_packages():
+        builder.add_d22_package(crrt_package)
+
+    return builder.build()
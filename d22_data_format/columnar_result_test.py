@@ -0,0 +1,75 @@
+import datetime
+import pytz
+
+import math
+
+import tempfile
+
+import numpy as np
+
+import pytest
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.columnar_result import ColumnarD22Result, parse_d22_file_columnar
+from d22_data_format.data_block_interpreters import process_dict_blocks
+from d22_data_format.helpers.load_test_data import path_to_test_data
+
+
+def test_columnar_same_as_dict():
+    for crrt_filename in ["short_20130923.d22", "20130923.d22", "20020927.d22.gz", "20150101.d22"]:
+        path_to_d22_file = path_to_test_data(crrt_filename)
+
+        dict_result = D22Parser(path_to_d22_file=path_to_d22_file).perform_parsing()
+        columnar_result = parse_d22_file_columnar(path_to_d22_file)
+
+        assert columnar_result.to_dict_result() == dict_result
+
+
+def test_columnar_ragged_blocks_and_view():
+    content = "\n".join([
+        "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:10",
+        "\fWL1-5", "56.72", "-56.72", "55.8", "57.51", "\f$$$$$$$",
+        "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:00",
+        "\fWL1-7", "56.97", "-56.97", "56.05", "57.86", "-57.86", "-999.99", "\fMD1-2", "2.0", "\f$$$$$$$",
+        "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:20",
+        "\f$$$$$$$",
+        ""])
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_to_d22_file = tmpdirname + "/20130923.d22"
+
+        with open(path_to_d22_file, "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write(content)
+
+        dict_result = D22Parser(path_to_d22_file=path_to_d22_file).perform_parsing()
+        columnar_result = ColumnarD22Result.from_dict_result(dict_result)
+
+        # HEADER_ONLY gives no values, to build the columnar result from
+        with pytest.raises(Exception, match="HEADER_ONLY"):
+            parse_d22_file_columnar(path_to_d22_file, parsing_mode=d22_parsing_mode.HEADER_ONLY)
+        with pytest.raises(Exception, match="HEADER_ONLY"):
+            ColumnarD22Result.from_dict_result(D22Parser(path_to_d22_file=path_to_d22_file,
+                                                         parsing_mode=d22_parsing_mode.HEADER_ONLY).perform_parsing())
+
+    block_WL1 = columnar_result.get_block("Heimdal", "WL1")
+
+    assert block_WL1.values.shape == (2, 6)
+    assert block_WL1.timestamps.tolist() == [1379894400, 1379895000]
+    assert block_WL1.nbr_entries.tolist() == [6, 4]
+    assert np.isnan(block_WL1.values[1, 4:]).all()
+    assert columnar_result.get_block("Heimdal", "MD1").values.shape == (1, 1)
+
+    dict_view = columnar_result.as_dict_view()
+    assert len(dict_view["Heimdal"]) == 3
+    assert dict(dict_view["Heimdal"][datetime.datetime(2013, 9, 23, 0, 20, tzinfo=pytz.utc)]) == {}
+    assert dict_view["Heimdal"][datetime.datetime(2013, 9, 23, 0, 10, tzinfo=pytz.utc)]["WL1"] == \
+        dict_result["Heimdal"][datetime.datetime(2013, 9, 23, 0, 10, tzinfo=pytz.utc)]["WL1"]
+    assert columnar_result.to_dict_result() == dict_result
+
+    process_dict_blocks(columnar_result)
+
+    column_average_air_gap = block_WL1.dict_extracted["average_air_gap"]
+    column_max_water_level = block_WL1.dict_extracted["max_water_level_ref_LAT"]
+    assert column_average_air_gap.tolist() == [56.97, 56.72]
+    assert math.isnan(column_max_water_level[0])
+    assert math.isnan(column_max_water_level[1])
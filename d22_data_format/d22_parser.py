@@ -13,7 +13,8 @@ import pprint
 import datetime
 import pytz
 
-from d22_data_format.helpers.readfile import FileLinesYielder
+from d22_data_format.helpers.readfile import FileLinesYielder, MappedLines, read_file_content, split_lines_keepends, \
+    is_gz_file
 from d22_data_format.helpers.datetimes import assert_is_utc_datetime
 from d22_data_format.helpers.raise_assert import ras
 from d22_data_format.helpers.load_test_data import path_to_test_data
@@ -30,26 +31,129 @@ class d22_parser_status(Enum):
     ERROR_END_OF_FILE = auto()
 
 
+@unique
+class d22_parsing_mode(Enum):
+    LINE_BY_LINE = auto()
+    BULK_BUFFER = auto()
+    HEADER_ONLY = auto()
+
+
+list_package_start_lines = ["!!!!\n", "!!!!\r\n"]
+list_package_end_lines = ["\f$$$$$$$\n", "\f$$$$$$$\r\n"]
+
+
+def is_wanted_block(block_title, wanted_blocks):
+    """If block_title is selected by wanted_blocks, a set of full block titles ("WL1")
+    and / or 2 letters block types ("WL", for all the WL blocks); None selects all."""
+    return wanted_blocks is None or block_title in wanted_blocks or block_title[0:2] in wanted_blocks
+
+
+class D22Package():
+    """One parsed package: the station name, the UTC datetime, and the blocks as
+    block title -> {"nbr_entries", "list_entries"}, as in the dict_result."""
+
+    def __init__(self, station_name, utc_datetime):
+        self.station_name = station_name
+        self.utc_datetime = utc_datetime
+        self.dict_blocks = {}
+
+
 class D22Parser():
-    def __init__(self, path_to_d22_file, automatic_gzip_recognition=True):
+    def __init__(self, path_to_d22_file, automatic_gzip_recognition=True,
+                 parsing_mode=d22_parsing_mode.LINE_BY_LINE, trace=False, background_decompression=False,
+                 wanted_blocks=None):
+        """Input:
+            - path_to_d22_file: the file to parse, either .d22 or .d22.gz
+            - automatic_gzip_recognition: if the .gz files should be unzipped
+            - parsing_mode: either LINE_BY_LINE (default, a state machine fed line
+            by line), or BULK_BUFFER (read the whole file at once and jump from
+            package to package and block to block; much faster on large files,
+            and gives the same dict_result), or HEADER_ONLY (as BULK_BUFFER, but only
+            the package headers and block titles are read, the block bodies are
+            skipped using the declared block sizes; "list_entries" is None).
+            - trace: if True, log (INFO) each step of the parsing and each line read.
+            This is slow, and meant for looking into a given file only; the warnings
+            about corrupt content are logged in any case.
+            - background_decompression: if True, the .gz files are decompressed on a
+            background thread, overlapping with the parsing.
+            - wanted_blocks: None (default) to keep all the blocks, or the full block
+            titles and / or 2 letters block types to keep, see is_wanted_block. The
+            other blocks are left out of the packages; in the BULK_BUFFER and
+            HEADER_ONLY modes, their bodies are skipped using the declared block sizes,
+            without converting the values (see skip_bulk_blocks).
+        """
         ras(Path(path_to_d22_file).is_file())
+        ras(isinstance(parsing_mode, d22_parsing_mode))
         # TODO: if the file is a gz, unzip first.
         self.path_to_d22_file = path_to_d22_file
         self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
-        self.file_lines_yielder_instance = FileLinesYielder()
+        self.trace = trace
+        self.background_decompression = background_decompression
+        self.file_lines_yielder_instance = FileLinesYielder(trace=trace,
+                                                            background_decompression=background_decompression)
         file_lines_yielder = self.file_lines_yielder_instance.file_lines_yielder
         self.line_yielder = GeneratorOneback(file_lines_yielder(path_to_d22_file,
                                                                 automatic_gzip_recognition=automatic_gzip_recognition,
                                                                 encoding=d22_encoding))
         self.automatic_gzip_recognition = automatic_gzip_recognition
+        self.parsing_mode = parsing_mode
+        self.wanted_blocks = None if wanted_blocks is None else frozenset(wanted_blocks)
         self.dict_result = {}
+        self.crrt_package = None
+        self.completed_package = None
 
     def perform_parsing(self):
         """Parse the whole file content into a dict."""
+        for crrt_package in self.iter_packages():
+            self.add_package_to_dict_result(crrt_package)
+
+        return self.dict_result
+
+    def iter_packages(self):
+        """Yield the packages of the file one at a time, as D22Package, in the order
+        of the file. A package is yielded once its end (or the unexpected start of the
+        next package, if it was cut) is found. If the same station and time is met
+        several times, each occurrence is yielded; perform_parsing merges them.
+        In LINE_BY_LINE mode the file is read as the packages are yielded, so that
+        stopping early does not read the rest of the file."""
+        if self.parsing_mode != d22_parsing_mode.LINE_BY_LINE:
+            yield from self.iter_bulk_packages()
+            return
+
         while self.parser_state != d22_parser_status.GRACIOUS_END_OF_FILE:
             self.parse_once_more()
 
-        return self.dict_result
+            if self.completed_package is not None:
+                yield self.completed_package
+                self.completed_package = None
+
+    def add_package_to_dict_result(self, package):
+        """Add a package to dict_result. If the station and time are already present,
+        the blocks are added to the existing package, except the ones already there."""
+        if package.station_name not in self.dict_result:
+            self.dict_result[package.station_name] = {}
+
+        dict_station = self.dict_result[package.station_name]
+
+        if package.utc_datetime not in dict_station:
+            dict_station[package.utc_datetime] = package.dict_blocks
+            return
+
+        logging.warning("meeting time {} again; this is unexpected; ".format(package.utc_datetime)
+                        + "will attempt to parse though")
+        self.warning_with_current_details()
+
+        dict_crrt_package = dict_station[package.utc_datetime]
+
+        for crrt_block_title, crrt_dict_block in package.dict_blocks.items():
+            if crrt_block_title in dict_crrt_package:
+                logging.warning("trying to insert again {} in {}/{}!".format(crrt_block_title,
+                                                                             package.station_name,
+                                                                             package.utc_datetime))
+                logging.warning("will ignore this block")
+                self.warning_with_current_details()
+            else:
+                dict_crrt_package[crrt_block_title] = crrt_dict_block
 
     def parse_once_more(self):
         """Perform one more step of parsing."""
@@ -89,7 +193,8 @@ class D22Parser():
         # 3) create the package entry in dict
         # 4) update the status
 
-        logging.info("parse from outside package")
+        if self.trace:
+            logging.info("parse from outside package")
 
         # 1
         while True:
@@ -99,50 +204,47 @@ class D22Parser():
                 break
 
             if crrt_line == "!!!!\n" or crrt_line == "!!!!\r\n":
-                logging.info("found start of package")
+                if self.trace:
+                    logging.info("found start of package")
                 data_format_line = self.obtain_next_line()
                 crrt_station_name = self.obtain_next_line()
                 utc_date_line = self.obtain_next_line()
                 utc_time_line = self.obtain_next_line()
                 break
 
-        # 2
+        # 2, 3
         if self.parser_state == d22_parser_status.OUTSIDE_PACKAGE:
-            logging.info("analyze package header")
+            self.register_package_header(data_format_line, crrt_station_name, utc_date_line, utc_time_line)
 
-            ras(data_format_line[0:5] == "DF022" or data_format_line[0:6] == "DF-022" or
-                data_format_line[0:9] == "DF-015/01")
+            # 4
+            self.parser_state = d22_parser_status.OUTSIDE_BLOCK
 
-            self.crrt_station_name = crrt_station_name[:-2].rstrip()
+    def register_package_header(self, data_format_line, crrt_station_name, utc_date_line, utc_time_line):
+        """Analyze the 4 header lines of a package, and start the current package."""
+        if self.trace:
+            logging.info("analyze package header")
 
-            crrt_day = int(utc_date_line[0:2])
-            crrt_month = int(utc_date_line[3:5])
-            crrt_year = int(utc_date_line[6:10])
+        ras(data_format_line[0:5] == "DF022" or data_format_line[0:6] == "DF-022" or
+            data_format_line[0:9] == "DF-015/01")
 
-            crrt_hour = int(utc_time_line[0:2])
-            crrt_minute = int(utc_time_line[3:5])
-            crrt_second = 0
+        self.crrt_station_name = crrt_station_name[:-2].rstrip()
 
-            self.crrt_utc_datetime = \
-                datetime.datetime(year=crrt_year, month=crrt_month, day=crrt_day,
-                                  hour=crrt_hour, minute=crrt_minute, second=crrt_second,
-                                  tzinfo=pytz.utc)
+        crrt_day = int(utc_date_line[0:2])
+        crrt_month = int(utc_date_line[3:5])
+        crrt_year = int(utc_date_line[6:10])
 
-            assert_is_utc_datetime(self.crrt_utc_datetime)
+        crrt_hour = int(utc_time_line[0:2])
+        crrt_minute = int(utc_time_line[3:5])
+        crrt_second = 0
 
-            # 3
-            if self.crrt_station_name not in self.dict_result:
-                self.dict_result[self.crrt_station_name] = {}
+        self.crrt_utc_datetime = \
+            datetime.datetime(year=crrt_year, month=crrt_month, day=crrt_day,
+                              hour=crrt_hour, minute=crrt_minute, second=crrt_second,
+                              tzinfo=pytz.utc)
 
-            if self.crrt_utc_datetime in self.dict_result[self.crrt_station_name]:
-                logging.warning("meeting time {} again; this is unexpected; ".format(self.crrt_utc_datetime)
-                                + "will attempt to parse though")
-                self.warning_with_current_details()
-            else:
-                self.dict_result[self.crrt_station_name][self.crrt_utc_datetime] = {}
+        assert_is_utc_datetime(self.crrt_utc_datetime)
 
-            # 4
-            self.parser_state = d22_parser_status.OUTSIDE_BLOCK
+        self.crrt_package = D22Package(self.crrt_station_name, self.crrt_utc_datetime)
 
     def act_from_outside_block(self):
         """Perform one step of parsing when outside a data block, but inside a
@@ -153,55 +255,34 @@ class D22Parser():
         # 2) if block start, parse block and add entry
         # 3) update status
 
-        logging.info("parse from outside block")
+        if self.trace:
+            logging.info("parse from outside block")
 
         block_title_line = self.obtain_next_line()
 
         # 1
         if block_title_line == "\f$$$$$$$\n" or block_title_line == "\f$$$$$$$\r\n":
-            logging.info("found end of package")
+            if self.trace:
+                logging.info("found end of package")
             # 3 a
             self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
+            self.completed_package = self.crrt_package
         elif block_title_line == "!!!!\n" or block_title_line == "!!!!\r\n":
             logging.warning("found an unexpected start of package, probably transmission was cut!")
             self.warning_with_current_details()
             self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
+            self.completed_package = self.crrt_package
         elif "-" in block_title_line:
             # 2
-            logging.info("found start of block")
-            ras(block_title_line[0]) == "\f"
-            block_title_line = block_title_line[1:]
-
-            ras("-" in block_title_line)
-            position_delimiter = block_title_line.find("-")
-            ras(position_delimiter != -1)
-            ras(block_title_line[-1:] == "\n")
-
-            block_title = block_title_line[0:position_delimiter]
-            block_size = int(block_title_line[position_delimiter+1:-1])
+            if self.trace:
+                logging.info("found start of block")
+            block_title, block_size = self.parse_block_title_line(block_title_line)
 
-            logging.info("block_title: {}".format(block_title))
-            logging.info("block size: {}".format(block_size))
-
-            log_block = True
-
-            if block_title in self.dict_result[self.crrt_station_name][self.crrt_utc_datetime]:
-                logging.warning("trying to insert again {} in {}/{}!".format(block_title,
-                                                                             self.crrt_station_name,
-                                                                             self.crrt_utc_datetime))
-                logging.warning("will ignore this block")
-                self.warning_with_current_details()
+            if is_wanted_block(block_title, self.wanted_blocks):
+                log_block = self.register_block(block_title, block_size)
+            else:
                 log_block = False
 
-            if log_block:
-                self.dict_result[self.crrt_station_name][self.crrt_utc_datetime][block_title] = {}
-
-                self.dict_result[self.crrt_station_name][self.crrt_utc_datetime][block_title]\
-                    ["nbr_entries"] = block_size - 1
-
-                self.dict_result[self.crrt_station_name][self.crrt_utc_datetime][block_title]\
-                    ["list_entries"] = []
-
             valid_block = True
 
             for _ in range(block_size - 1):
@@ -219,8 +300,7 @@ class D22Parser():
                         self.line_yielder.use_last_value()
 
                 if log_block:
-                    self.dict_result[self.crrt_station_name][self.crrt_utc_datetime][block_title]\
-                        ['list_entries'].append(crrt_value)
+                    self.crrt_package.dict_blocks[block_title]['list_entries'].append(crrt_value)
 
             # 3 b
             self.parser_state = d22_parser_status.OUTSIDE_BLOCK
@@ -230,12 +310,394 @@ class D22Parser():
             logging.warning("this may be due to a corrupt line or block. The error can be a few lines up in the file.")
             self.warning_with_current_details()
 
+    def parse_block_title_line(self, block_title_line):
+        """Get the block title and block size from a block title line."""
+        ras(block_title_line[0]) == "\f"
+        block_title_line = block_title_line[1:]
+
+        ras("-" in block_title_line)
+        position_delimiter = block_title_line.find("-")
+        ras(position_delimiter != -1)
+        ras(block_title_line[-1:] == "\n")
+
+        block_title = block_title_line[0:position_delimiter]
+        block_size = int(block_title_line[position_delimiter+1:-1])
+
+        if self.trace:
+            logging.info("block_title: %s", block_title)
+            logging.info("block size: %s", block_size)
+
+        return (block_title, block_size)
+
+    def register_block(self, block_title, block_size):
+        """Create the block entry in the current package. Return False if the block
+        was already present, in which case it should be ignored."""
+        if block_title in self.crrt_package.dict_blocks:
+            logging.warning("trying to insert again {} in {}/{}!".format(block_title,
+                                                                         self.crrt_station_name,
+                                                                         self.crrt_utc_datetime))
+            logging.warning("will ignore this block")
+            self.warning_with_current_details()
+            return False
+
+        self.crrt_package.dict_blocks[block_title] = {}
+        self.crrt_package.dict_blocks[block_title]["nbr_entries"] = block_size - 1
+        self.crrt_package.dict_blocks[block_title]["list_entries"] = []
+
+        return True
+
+    def iter_bulk_packages(self):
+        """Yield the packages, reading the whole file in one buffer and jumping
+        directly from package to package and block to block, instead of feeding the
+        state machine line by line. The values of each block are converted in one
+        batch. This gives the same packages as the line by line parsing, including
+        on the corrupt / cut packages. In HEADER_ONLY mode, the block bodies are
+        skipped when possible, see skip_package_blocks."""
+
+        # 1) read the whole file (memory mapped if plain) and find the lines
+        # 2) find the next package start, or reach end of file
+        # 3) parse the package header and create the package entry in dict
+        # 4) go through the blocks until the end of the package
+
+        logging.info("bulk parsing of %s", self.path_to_d22_file)
+
+        # 1
+        self.list_lines = self.read_bulk_lines()
+        self.dict_next_package_start = {crrt_marker: -1 for crrt_marker in list_package_start_lines}
+        list_lines = self.list_lines
+        nbr_lines = len(list_lines)
+        self.crrt_line_ind = 0
+
+        # the map is closed also if the consumer stops early, or on a parse error
+        try:
+            while True:
+                # 2
+                self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
+                ind_package_start = self.find_next_package_start(self.crrt_line_ind)
+
+                if ind_package_start is None:
+                    break
+
+                self.crrt_line_ind = ind_package_start + 5
+
+                if self.crrt_line_ind > nbr_lines:
+                    # same behavior as the line by line parser: exactly one missing header
+                    # line is a gracious end of file, more is an error
+                    if self.crrt_line_ind == nbr_lines + 1:
+                        break
+                    self.parser_state = d22_parser_status.ERROR_END_OF_FILE
+                    raise ValueError("Hit end of file, but we are not outside of a data package yet!")
+
+                # 3
+                self.register_package_header(*list_lines[ind_package_start+1:ind_package_start+5])
+                self.parser_state = d22_parser_status.OUTSIDE_BLOCK
+
+                # 4
+                dict_crrt_package = self.crrt_package.dict_blocks
+
+                if self.parsing_mode == d22_parsing_mode.HEADER_ONLY and self.skip_package_blocks():
+                    self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
+                    yield self.crrt_package
+                    continue
+
+                while self.parser_state == d22_parser_status.OUTSIDE_BLOCK:
+                    block_title_line = self.obtain_next_bulk_line()
+
+                    if block_title_line in list_package_end_lines:
+                        self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
+                    elif block_title_line in list_package_start_lines:
+                        logging.warning("found an unexpected start of package, probably transmission was cut!")
+                        self.warning_with_current_details()
+                        self.parser_state = d22_parser_status.OUTSIDE_PACKAGE
+                    elif "-" in block_title_line:
+                        # fast path for the well formed block titles; the others go through the
+                        # checks of the line by line parser, which raise as they should
+                        position_delimiter = block_title_line.find("-", 1)
+
+                        if position_delimiter == -1 or block_title_line[-1:] != "\n":
+                            block_title, block_size = self.parse_block_title_line(block_title_line)
+                        else:
+                            block_title = block_title_line[1:position_delimiter]
+                            block_size = int(block_title_line[position_delimiter+1:-1])
+
+                        if not is_wanted_block(block_title, self.wanted_blocks):
+                            self.skip_bulk_blocks(block_size - 1)
+                            continue
+
+                        if block_title in dict_crrt_package:
+                            log_block = self.register_block(block_title, block_size)
+                        else:
+                            log_block = True
+
+                        # fast path for the well formed blocks: convert all values at once
+                        nbr_entries = block_size - 1
+                        ind_start = self.crrt_line_ind
+                        ind_end = ind_start + nbr_entries
+                        list_values = None
+
+                        if 0 < nbr_entries and ind_end <= nbr_lines and list_lines[ind_end - 1][-1:] == "\n":
+                            try:
+                                list_values = self.bulk_lines_to_floats(ind_start, ind_end)
+                                self.crrt_line_ind = ind_end
+                            except ValueError:
+                                pass
+
+                        if list_values is None:
+                            list_values = self.obtain_bulk_block_values(nbr_entries)
+
+                        if log_block:
+                            dict_crrt_package[block_title] = {"nbr_entries": nbr_entries,
+                                                              "list_entries": list_values}
+                    else:
+                        logging.warning("looking for either end of package, or start of package, or start of block,")
+                        logging.warning("current line does not correspond to any of that!")
+                        logging.warning("this may be due to a corrupt line or block. "
+                                        "The error can be a few lines up in the file.")
+                        self.warning_with_current_details()
+
+                if self.parsing_mode == d22_parsing_mode.HEADER_ONLY:
+                    for crrt_dict_block in dict_crrt_package.values():
+                        crrt_dict_block["list_entries"] = None
+
+                yield self.crrt_package
+        finally:
+            if isinstance(self.list_lines, MappedLines):
+                self.list_lines.close()
+
+        logging.info("Gracefully end parsing")
+        self.parser_state = d22_parser_status.GRACIOUS_END_OF_FILE
+
+    def read_bulk_lines(self):
+        """The lines of the file, for the bulk parsing. A plain file is memory mapped
+        (MappedLines), so that only the lines actually used are decoded, and the block
+        values are converted from the bytes; a gz file is read in full and split."""
+        if not is_gz_file(self.path_to_d22_file, self.automatic_gzip_recognition):
+            mapped_lines = MappedLines(self.path_to_d22_file, encoding=d22_encoding)
+
+            if not mapped_lines.has_lone_cr:
+                return mapped_lines
+
+            mapped_lines.close()
+
+        content = read_file_content(self.path_to_d22_file, encoding=d22_encoding,
+                                    automatic_gzip_recognition=self.automatic_gzip_recognition,
+                                    background_decompression=self.background_decompression)
+
+        return split_lines_keepends(content)
+
+    def bulk_lines_to_floats(self, ind_start, ind_end):
+        """Convert the lines ind_start to ind_end (excluded) of the buffer to float, from
+        the bytes when the file is memory mapped. Raise ValueError if any line cannot
+        be converted."""
+        if isinstance(self.list_lines, MappedLines):
+            try:
+                return self.list_lines.floats(ind_start, ind_end)
+            except ValueError:
+                # try again from the str, that accepts a few more whitespaces
+                pass
+
+        return list(map(float, self.list_lines[ind_start:ind_end]))
+
+    def skip_package_blocks(self):
+        """For HEADER_ONLY: register the blocks of the current package from their title
+        lines only, jumping over the block bodies using the declared block sizes. If
+        the blocks do not chain up to the end of the package before the next package
+        start, or a block body holds a form feed (cut or corrupt package), return False
+        without changing anything, and the package should be parsed in full."""
+        list_lines = self.list_lines
+        ind_next_package = self.find_next_package_start(self.crrt_line_ind)
+
+        if ind_next_package is None:
+            ind_next_package = len(list_lines)
+
+        list_blocks = []
+        crrt_ind = self.crrt_line_ind
+
+        while crrt_ind < ind_next_package:
+            block_title_line = list_lines[crrt_ind]
+
+            if block_title_line in list_package_end_lines:
+                self.crrt_line_ind = crrt_ind + 1
+                dict_crrt_package = self.crrt_package.dict_blocks
+
+                for (crrt_block_title, crrt_block_size) in list_blocks:
+                    if not is_wanted_block(crrt_block_title, self.wanted_blocks):
+                        continue
+
+                    if crrt_block_title in dict_crrt_package:
+                        # warns and ignores the block
+                        self.register_block(crrt_block_title, crrt_block_size)
+                    else:
+                        dict_crrt_package[crrt_block_title] = {"nbr_entries": crrt_block_size - 1,
+                                                               "list_entries": None}
+
+                return True
+
+            position_delimiter = block_title_line.find("-", 1)
+
+            if block_title_line[:1] != "\f" or position_delimiter == -1 or block_title_line[-1:] != "\n":
+                return False
+
+            try:
+                block_size = int(block_title_line[position_delimiter+1:-1])
+            except ValueError:
+                return False
+
+            if block_size < 1:
+                return False
+
+            # a block cut by the title of a next block, or by the package end
+            ind_body_end = min(crrt_ind + block_size, ind_next_package)
+
+            if isinstance(list_lines, MappedLines):
+                has_form_feed = list_lines.lines_contain(b"\f", crrt_ind + 1, ind_body_end)
+            else:
+                has_form_feed = any(["\f" in crrt_line for crrt_line in list_lines[crrt_ind + 1:ind_body_end]])
+
+            if has_form_feed:
+                return False
+
+            list_blocks.append((block_title_line[1:position_delimiter], block_size))
+            crrt_ind += block_size
+
+        return False
+
+    def skip_bulk_blocks(self, nbr_entries):
+        """Go past the nbr_entries lines of the body of a block that is not wanted, and
+        past the next blocks as long as they are not wanted either. The lines are jumped
+        over without conversion when a body is well delimited: it ends before the next
+        package start, holds no form feed (the title of a next block, or a package end,
+        showing that the block was cut), and is followed by a line starting with a form
+        feed, or the end of the file. Else, the body is read as for any block, so that
+        the parsing goes on at the same line."""
+        list_lines = self.list_lines
+        is_mapped = isinstance(list_lines, MappedLines)
+        nbr_lines = len(list_lines)
+        ind_next_package = self.find_next_package_start(self.crrt_line_ind)
+
+        if ind_next_package is None:
+            ind_next_package = nbr_lines
+
+        while True:
+            ind_start = self.crrt_line_ind
+            ind_end = ind_start + max(nbr_entries, 0)
+
+            if ind_end > ind_next_package:
+                break
+
+            # checked on the bytes when memory mapped, without decoding the lines
+            if is_mapped:
+                has_form_feed = list_lines.lines_contain(b"\f", ind_start, ind_end)
+            else:
+                has_form_feed = any(["\f" in crrt_line for crrt_line in list_lines[ind_start:ind_end]])
+
+            if has_form_feed:
+                break
+
+            if ind_end == nbr_lines:
+                self.crrt_line_ind = ind_end
+                return
+
+            if is_mapped:
+                is_delimited = list_lines.line_startswith(ind_end, b"\f")
+            else:
+                is_delimited = list_lines[ind_end][:1] == "\f"
+
+            if not is_delimited:
+                break
+
+            self.crrt_line_ind = ind_end
+
+            # the next block, if its title is well formed and it is not wanted either;
+            # else the main loop takes over
+            block_title_line = list_lines[ind_end]
+            position_delimiter = block_title_line.find("-", 1)
+
+            if position_delimiter == -1 or block_title_line[-1:] != "\n" or \
+                    is_wanted_block(block_title_line[1:position_delimiter], self.wanted_blocks):
+                return
+
+            try:
+                nbr_entries = int(block_title_line[position_delimiter+1:-1]) - 1
+            except ValueError:
+                return
+
+            self.crrt_line_ind = ind_end + 1
+
+        self.obtain_bulk_block_values(nbr_entries)
+
+    def find_next_package_start(self, ind_start):
+        """Find the index of the next package start line, at or after ind_start, or
+        None if there is no more package. The search is performed by list.index, and
+        the next position of each kind of start line is cached so that the whole
+        file is scanned only once."""
+        ind_next = None
+
+        for crrt_marker in list_package_start_lines:
+            crrt_ind = self.dict_next_package_start[crrt_marker]
+
+            if crrt_ind is not None and crrt_ind < ind_start:
+                try:
+                    crrt_ind = self.list_lines.index(crrt_marker, ind_start)
+                except ValueError:
+                    crrt_ind = None
+                self.dict_next_package_start[crrt_marker] = crrt_ind
+
+            if crrt_ind is not None and (ind_next is None or crrt_ind < ind_next):
+                ind_next = crrt_ind
+
+        return ind_next
+
+    def obtain_next_bulk_line(self):
+        """Get one more line of the buffer, when inside a package."""
+        if self.crrt_line_ind >= len(self.list_lines):
+            self.parser_state = d22_parser_status.ERROR_END_OF_FILE
+            raise ValueError("Hit end of file, but we are not outside of a data package yet!")
+
+        crrt_line = self.list_lines[self.crrt_line_ind]
+        self.crrt_line_ind += 1
+
+        return crrt_line
+
+    def obtain_bulk_block_values(self, nbr_entries):
+        """Convert the nbr_entries next lines of the buffer to float, entry by entry,
+        exactly as the line by line parser does. This is only used for the cut or
+        corrupt blocks, the well formed ones are converted in one batch."""
+        list_values = []
+        valid_block = True
+
+        for _ in range(nbr_entries):
+            if valid_block:
+                crrt_entry = self.obtain_next_bulk_line()
+                ras(crrt_entry[-1:] == "\n")
+
+                try:
+                    crrt_value = float(crrt_entry[:-1])
+                except ValueError:
+                    logging.warning("cannot be converted to float!")
+                    self.warning_with_current_details()
+                    crrt_value = -999.88
+                    valid_block = False
+                    self.crrt_line_ind -= 1
+
+            list_values.append(crrt_value)
+
+        return list_values
+
     def warning_with_current_details(self):
+        if self.parsing_mode != d22_parsing_mode.LINE_BY_LINE:
+            crrt_ind = self.crrt_line_ind - 1
+            logging.warning("this error happened line {} file {}".format(crrt_ind, self.path_to_d22_file))
+            logging.warning("line content: {}".format(self.list_lines[crrt_ind]))
+            logging.warning("previous read lines are:")
+            logging.warning(self.list_lines[max(0, crrt_ind - 4):crrt_ind + 1])
+            return
+
         logging.warning("this error happened line {} file {}".format(self.file_lines_yielder_instance.crrt_ind,
                                                                      self.file_lines_yielder_instance.path_to_file))
         logging.warning("line content: {}".format(self.file_lines_yielder_instance.crrt_line))
         logging.warning("previous read lines are:")
-        logging.warning(self.file_lines_yielder_instance.list_lines)
+        logging.warning(list(self.file_lines_yielder_instance.list_lines))
 
 
 if __name__ == "__main__":
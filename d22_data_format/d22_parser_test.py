@@ -5,7 +5,11 @@ import pprint
 
 import logging
 
-from d22_data_format.d22_parser import D22Parser
+import tempfile
+
+import gzip
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
 from d22_data_format.helpers.load_test_data import path_to_test_data, get_parsed_correct_data
 
 
@@ -137,6 +141,186 @@ def test_parser_DF15():
     dict_result = d22_parser.perform_parsing()
 
 
+def test_bulk_parsing_same_as_line_by_line():
+    for crrt_filename in ["short_20130923.d22", "20130923.d22", "20130923_repeat.d22", "20020927.d22.gz",
+                          "20150101.d22", "20130713.d22", "20010322.d22.gz", "20010831.d22.gz",
+                          "19970307.d22.gz"]:
+        path_to_d22_file = path_to_test_data(crrt_filename)
+
+        dict_result_lines = D22Parser(path_to_d22_file=path_to_d22_file).perform_parsing()
+        dict_result_bulk = D22Parser(path_to_d22_file=path_to_d22_file,
+                                     parsing_mode=d22_parsing_mode.BULK_BUFFER).perform_parsing()
+
+        assert dict_result_lines == dict_result_bulk
+
+
+# a small file with: a corrupt line between packages, a non float value, a package met
+# twice with a block met twice, a cut transmission, and empty lines
+content_corrupt_d22 = "\n".join([
+    "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:00",
+    "\fMD1-2", "2.0", "\fWL1-5", "56.72", "-56.72", "55.8", "57.51", "\f$$$$$$$",
+    "corrupt line",
+    "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:10",
+    "\fWL1-7", "56.72", "-56.72", "abc", "57.51", "1.0", "2.0", "\fMD1-2", "3.0", "\f$$$$$$$",
+    "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:00",
+    "\fMSB-3", "4.5", "23.51", "\fMD1-2", "4.0", "\f$$$$$$$",
+    "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:20",
+    "\fMD1-2",
+    "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:30",
+    "\fMD1-2", "5.0", "\f$$$$$$$",
+    "", "",
+    "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:40",
+    "\fMD1-2", "6.0", "\f$$$$$$$",
+    ""])
+
+
+def test_bulk_parsing_corrupt_content():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_plain = tmpdirname + "/20130923.d22"
+        path_gz = tmpdirname + "/20130923.d22.gz"
+
+        with open(path_plain, "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write(content_corrupt_d22)
+
+        with gzip.open(path_gz, "wb") as crrt_fh:
+            crrt_fh.write(content_corrupt_d22.replace("\n", "\r\n").encode("latin-1"))
+
+        for crrt_path in [path_plain, path_gz]:
+            dict_result_lines = D22Parser(path_to_d22_file=crrt_path).perform_parsing()
+            dict_result_bulk = D22Parser(path_to_d22_file=crrt_path,
+                                         parsing_mode=d22_parsing_mode.BULK_BUFFER).perform_parsing()
+
+            assert dict_result_lines == dict_result_bulk
+
+            dict_station = dict_result_bulk["Heimdal"]
+            assert dict_station[datetime.datetime(2013, 9, 23, 0, 10, tzinfo=pytz.utc)]["WL1"]["list_entries"] == \
+                [56.72, -56.72, -999.88, -999.88, -999.88, -999.88]
+            assert dict_station[datetime.datetime(2013, 9, 23, 0, 0, tzinfo=pytz.utc)]["MD1"]["list_entries"] == [2.0]
+            assert dict_station[datetime.datetime(2013, 9, 23, 0, 0, tzinfo=pytz.utc)]["MSB"]["list_entries"] == \
+                [4.5, 23.51]
+            assert dict_station[datetime.datetime(2013, 9, 23, 0, 20, tzinfo=pytz.utc)]["MD1"]["list_entries"] == \
+                [-999.88]
+            assert datetime.datetime(2013, 9, 23, 0, 30, tzinfo=pytz.utc) not in dict_station
+            assert dict_station[datetime.datetime(2013, 9, 23, 0, 40, tzinfo=pytz.utc)]["MD1"]["list_entries"] == [6.0]
+
+
+def test_iter_packages():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_plain = tmpdirname + "/20130923.d22"
+
+        with open(path_plain, "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write(content_corrupt_d22)
+
+        for crrt_parsing_mode in [d22_parsing_mode.LINE_BY_LINE, d22_parsing_mode.BULK_BUFFER]:
+            d22_parser = D22Parser(path_to_d22_file=path_plain, parsing_mode=crrt_parsing_mode)
+            list_packages = list(d22_parser.iter_packages())
+
+            # each occurrence of a time is yielded, the dict merges them
+            assert [(crrt_package.station_name, crrt_package.utc_datetime.minute, list(crrt_package.dict_blocks))
+                    for crrt_package in list_packages] == \
+                [("Heimdal", 0, ["MD1", "WL1"]), ("Heimdal", 10, ["WL1", "MD1"]), ("Heimdal", 0, ["MSB", "MD1"]),
+                 ("Heimdal", 20, ["MD1"]), ("Heimdal", 40, ["MD1"])]
+            assert list_packages[2].dict_blocks["MD1"]["list_entries"] == [4.0]
+
+            # stopping early
+            d22_parser = D22Parser(path_to_d22_file=path_plain, parsing_mode=crrt_parsing_mode)
+            iterator_packages = d22_parser.iter_packages()
+            crrt_package = next(iterator_packages)
+            assert crrt_package.dict_blocks["WL1"]["list_entries"] == [56.72, -56.72, 55.8, 57.51]
+
+            # the memory map of the bulk parsing is closed with the iterator
+            iterator_packages.close()
+            if crrt_parsing_mode == d22_parsing_mode.BULK_BUFFER:
+                assert d22_parser.list_lines.mmap.closed
+
+
+def test_header_only_parsing():
+    # and a WL1 block cut by the next block title, its declared size landing on the package end
+    content = content_corrupt_d22 + "\n".join([
+        "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:50",
+        "\fWL1-3", "\fMD1-2", "5.0", "\f$$$$$$$",
+        ""])
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_plain = tmpdirname + "/20130923.d22"
+
+        with open(path_plain, "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write(content)
+
+        dict_result = D22Parser(path_to_d22_file=path_plain).perform_parsing()
+        dict_result_header_only = D22Parser(path_to_d22_file=path_plain,
+                                            parsing_mode=d22_parsing_mode.HEADER_ONLY).perform_parsing()
+
+    # same stations, times, blocks and number of entries, but no values
+    for crrt_station in dict_result:
+        assert list(dict_result[crrt_station]) == list(dict_result_header_only[crrt_station])
+
+        for crrt_datetime in dict_result[crrt_station]:
+            dict_blocks = dict_result[crrt_station][crrt_datetime]
+            dict_blocks_header_only = dict_result_header_only[crrt_station][crrt_datetime]
+
+            assert list(dict_blocks) == list(dict_blocks_header_only)
+
+            for crrt_block in dict_blocks:
+                assert dict_blocks[crrt_block]["nbr_entries"] == dict_blocks_header_only[crrt_block]["nbr_entries"]
+                assert dict_blocks_header_only[crrt_block]["list_entries"] is None
+
+    assert list(dict_result) == list(dict_result_header_only)
+    assert list(dict_result_header_only["Heimdal"][datetime.datetime(2013, 9, 23, 0, 50, tzinfo=pytz.utc)]) == \
+        ["WL1", "MD1"]
+
+def test_wanted_blocks_parsing():
+    # and a WL1 block cut by the next block title
+    content = content_corrupt_d22 + "\n".join([
+        "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "00:50",
+        "\fWL1-7", "1.0", "\fMD1-2", "7.0", "\fMSB-3", "4.5", "23.51", "\f$$$$$$$",
+        ""])
+    # and a last package, with a cut block whose declared size goes to the end of the file
+    content_cut_at_end = content + "\n".join([
+        "!!!!", "DF022 1", "Heimdal ", "23-09-2013", "01:00",
+        "\fXX1-5", "1.0", "\fMD1-2", "7.0", "\f$$$$$$$",
+        ""])
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_plain = tmpdirname + "/20130923.d22"
+        path_gz = tmpdirname + "/20130923.d22.gz"
+        path_cut_at_end = tmpdirname + "/20130924.d22"
+
+        with open(path_plain, "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write(content)
+
+        with gzip.open(path_gz, "wb") as crrt_fh:
+            crrt_fh.write(content.replace("\n", "\r\n").encode("latin-1"))
+
+        with open(path_cut_at_end, "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write(content_cut_at_end)
+
+        for crrt_path in [path_plain, path_gz, path_cut_at_end]:
+            for crrt_parsing_mode in d22_parsing_mode:
+                dict_result = D22Parser(path_to_d22_file=crrt_path, parsing_mode=crrt_parsing_mode).perform_parsing()
+
+                for crrt_wanted_blocks in [{"MD1"}, {"WL"}, {"MSB", "WL1"}, set()]:
+                    dict_result_wanted = D22Parser(path_to_d22_file=crrt_path, parsing_mode=crrt_parsing_mode,
+                                                   wanted_blocks=crrt_wanted_blocks).perform_parsing()
+
+                    # the same packages, with only the wanted blocks
+                    assert dict_result_wanted == \
+                        {crrt_station: {crrt_datetime: {crrt_block: crrt_dict_block
+                                                        for crrt_block, crrt_dict_block in crrt_dict_blocks.items()
+                                                        if crrt_block in crrt_wanted_blocks
+                                                        or crrt_block[0:2] in crrt_wanted_blocks}
+                                        for crrt_datetime, crrt_dict_blocks in dict_station.items()}
+                         for crrt_station, dict_station in dict_result.items()}
+
+        # the cut blocks are read through, to find the MD1 block after them
+        dict_result_wanted = D22Parser(path_to_d22_file=path_cut_at_end, parsing_mode=d22_parsing_mode.BULK_BUFFER,
+                                       wanted_blocks={"MD"}).perform_parsing()
+
+    assert dict_result_wanted["Heimdal"][datetime.datetime(2013, 9, 23, 0, 50, tzinfo=pytz.utc)] == \
+        {"MD1": {"nbr_entries": 1, "list_entries": [7.0]}}
+    assert dict_result_wanted["Heimdal"][datetime.datetime(2013, 9, 23, 1, 0, tzinfo=pytz.utc)] == \
+        {"MD1": {"nbr_entries": 1, "list_entries": [7.0]}}
+
 # TODO: should add tests on the file 20200419.d22 , around line 31233 where missing
 # / faulty transmission, to check that parsing around is fine
 
@@ -1,14 +1,22 @@
 """Implement individual data block interpreters."""
 
 import math
+import time
 import logging
 
+import importlib.metadata
+
+from collections.abc import Mapping
+
 import datetime
 
 import pprint
 
+import numpy as np
+
 from d22_data_format.helpers.raise_assert import ras
-from d22_data_format.d22_parser import D22Parser
+from d22_data_format.d22_parser import D22Parser, is_wanted_block
+from d22_data_format.columnar_result import ColumnarD22Result
 from d22_data_format.helpers.load_test_data import path_to_test_data
 
 dict_error_codes = {
@@ -151,20 +159,358 @@ def raw_MT_to_extracted_dict(dict_raw_MT_block):
     return dict_result
 
 ############################################################
-########## fill in the block analyzers dict under
+########## the batch versions of the data bloc analyzers, that interpret all the
+########## packages of a ColumnarBlock at once, and give the same columns as the
+########## analyzers above applied row by row
 ############################################################
 
-dict_block_processers = {
-    "WL": raw_WL_to_extracted_dict,
-    "MD": raw_MD_to_extracted_dict,
-    "MT": raw_MT_to_extracted_dict,
-}
+array_error_codes = np.array(list(dict_error_codes.keys()), dtype=np.float64)
+
+
+def block_entries_matrix(columnar_block, nbr_columns):
+    """The entries of all the rows of columnar_block as a matrix with nbr_columns
+    columns (padded with NaN), the error codes substituted by NaN, and the number of
+    entries of each row (as len(list_entries) of the row)."""
+    values = columnar_block.values
+    nbr_rows = values.shape[0]
+
+    matrix = np.full((nbr_rows, nbr_columns), np.nan)
+    nbr_columns_used = min(nbr_columns, values.shape[1])
+    matrix[:, :nbr_columns_used] = values[:, :nbr_columns_used]
+
+    is_error_code = np.zeros(matrix.shape, dtype=bool)
+    for crrt_error_code in array_error_codes:
+        is_error_code |= matrix == crrt_error_code
+    matrix[is_error_code] = np.nan
+
+    nbr_entries = np.minimum(np.maximum(columnar_block.nbr_entries, 0), values.shape[1])
+
+    return (matrix, nbr_entries)
+
+
+def batch_WL_to_extracted_columns(columnar_block):
+    list_fields = ["average_air_gap", "average_water_level_ref_LAT", "minimum_air_gap",
+                   "maximum_air_gap", "min_water_level_ref_LAT", "max_water_level_ref_LAT"]
+
+    matrix, nbr_entries = block_entries_matrix(columnar_block, 6)
+
+    has_6 = nbr_entries == 6
+    has_4 = nbr_entries == 4
+
+    # the blocks with another number of entries give no field
+    if not np.any(has_6 | has_4):
+        return {}
+
+    matrix[~has_6, 4:6] = np.nan
+    matrix[~(has_6 | has_4), :] = np.nan
+    mask = ~(has_6 | has_4)
+
+    return {crrt_field: np.ma.MaskedArray(matrix[:, crrt_ind].copy(), mask=mask.copy())
+            for crrt_ind, crrt_field in enumerate(list_fields)}
+
+
+def batch_MD_to_extracted_columns(columnar_block):
+    matrix, nbr_entries = block_entries_matrix(columnar_block, 1)
+
+    column = np.where(nbr_entries == 1, matrix[:, 0], np.nan)
+
+    return {"magnetic_declination": np.ma.MaskedArray(column, mask=np.zeros(column.shape, dtype=bool))}
+
+
+def batch_MT_to_extracted_columns(columnar_block):
+    matrix, nbr_entries = block_entries_matrix(columnar_block, 4)
+    raw_values = columnar_block.values
+
+    # the times are decoded from the raw entries, before substitution of the error codes
+    def raw_column(crrt_ind):
+        if crrt_ind < raw_values.shape[1]:
+            return raw_values[:, crrt_ind]
+        return np.full(raw_values.shape[0], np.nan)
+
+    # as datetime_minute_hour_from_decimal: NaN for a negative hour or minute, and the
+    # whole block fails (all NaN) if the decimal is not finite or the hour is over 23
+    def decode_time(decimal_in):
+        with np.errstate(invalid="ignore"):
+            hour = np.trunc(decimal_in)
+            minute = np.trunc((decimal_in - hour) * 10)
+
+        is_error = (hour < 0) | (minute < 0)
+        is_failed = ~np.isfinite(decimal_in) | (~is_error & (hour > 23))
+
+        return (hour, minute, is_error, is_failed)
+
+    gust_hour, gust_minute, gust_is_error, gust_is_failed = decode_time(raw_column(1))
+    average_hour, average_minute, average_is_error, average_is_failed = decode_time(raw_column(3))
+
+    is_valid = (nbr_entries == 4) & ~gust_is_failed & ~average_is_failed
+
+    def time_column(hour, minute, is_error):
+        list_values = [datetime.datetime(year=1, month=1, day=1, hour=int(crrt_hour), minute=int(crrt_minute))
+                       if (crrt_valid and not crrt_error) else math.nan
+                       for (crrt_hour, crrt_minute, crrt_error, crrt_valid)
+                       in zip(hour.tolist(), minute.tolist(), is_error.tolist(), is_valid.tolist())]
+
+        # as in ColumnarBlock.set_extracted: float if possible, else object
+        try:
+            return np.array(list_values, dtype=np.float64)
+        except (TypeError, ValueError):
+            return np.array(list_values, dtype=object)
+
+    no_mask = np.zeros(is_valid.shape, dtype=bool)
+
+    return {
+        "max_gust_last_period": np.ma.MaskedArray(np.where(is_valid, matrix[:, 0], np.nan), mask=no_mask.copy()),
+        "time_max_gust": np.ma.MaskedArray(time_column(gust_hour, gust_minute, gust_is_error), mask=no_mask.copy()),
+        "max_average_wind_speed_last_period": np.ma.MaskedArray(np.where(is_valid, matrix[:, 2], np.nan),
+                                                                mask=no_mask.copy()),
+        "time_max_average": np.ma.MaskedArray(time_column(average_hour, average_minute, average_is_error),
+                                              mask=no_mask.copy()),
+    }
+
+############################################################
+########## the registry of the block interpreters
+############################################################
+
+class BlockInterpreter():
+    def __init__(self, block_type, list_column_names, list_nbr_entries, row_processer=None, batch_processer=None):
+        """The interpreter of a block type.
+        Input:
+            - block_type: the 2 letters prefix of the block titles (for example "WL" for
+            WL1, WL2, ...).
+            - list_column_names: the fields given by the interpreter.
+            - list_nbr_entries: the numbers of entries a block of this type may have.
+            - row_processer: function raw block dict -> extracted dict. If None, the
+            entries are taken in order as the list_column_names fields (missing ones as
+            NaN, all NaN if the number of entries is not in list_nbr_entries), with the
+            error codes as NaN.
+            - batch_processer: function ColumnarBlock -> dict field -> masked column,
+            giving the same columns as row_processer used row by row. If None, the
+            generic batch version is used when there is no row_processer, and else
+            row_processer is used row by row.
+        """
+        ras(len(block_type) == 2, "the block type is the 2 letters prefix of the block titles")
+        ras(len(list_column_names) > 0)
+        ras(len(list_nbr_entries) > 0)
+
+        self.block_type = block_type
+        self.list_column_names = list(list_column_names)
+        self.list_nbr_entries = list(list_nbr_entries)
+        self.row_processer = row_processer
+        self.batch_processer = batch_processer
+
+        if row_processer is None:
+            ras(max(self.list_nbr_entries) <= len(self.list_column_names),
+                "more entries than columns, give a row_processer")
+            self.row_processer = self.columns_row_processer
+
+            if batch_processer is None:
+                self.batch_processer = self.columns_batch_processer
+
+    def columns_row_processer(self, dict_raw_block):
+        list_entries = dict_raw_block["list_entries"]
+
+        if len(list_entries) not in self.list_nbr_entries:
+            return {crrt_column: math.nan for crrt_column in self.list_column_names}
+
+        dict_result = {crrt_column: math.nan for crrt_column in self.list_column_names}
+        for crrt_column, crrt_entry in zip(self.list_column_names, list_entries):
+            dict_result[crrt_column] = crrt_entry
+
+        perform_substitution_errors(dict_result)
+
+        return dict_result
+
+    def columns_batch_processer(self, columnar_block):
+        matrix, nbr_entries = block_entries_matrix(columnar_block, len(self.list_column_names))
+        matrix[~np.isin(nbr_entries, self.list_nbr_entries), :] = np.nan
+
+        return {crrt_column: np.ma.MaskedArray(matrix[:, crrt_ind].copy(), mask=np.zeros(matrix.shape[0], dtype=bool))
+                for crrt_ind, crrt_column in enumerate(self.list_column_names)}
+
+
+# the packages providing further block interpreters declare an entry point in this
+# group, named by the block type and giving a BlockInterpreter, for example in setup.cfg:
+# [options.entry_points]
+# d22_data_format.block_interpreters =
+#     WI = my_package.my_module:wind_block_interpreter
+block_interpreters_entry_point_group = "d22_data_format.block_interpreters"
+
+
+class BlockInterpreterRegistry():
+    def __init__(self, entry_point_group=block_interpreters_entry_point_group):
+        """The block interpreters by block type. The ones registered by other packages
+        through entry_point_group are only discovered when a block type without
+        interpreter is met, and only the interpreter of that block type is then loaded.
+
+        The number of calls, blocks interpreted and time spent are counted by block type
+        (see profiling_stats); in worker processes, these are the ones of the worker."""
+        self.entry_point_group = entry_point_group
+        self.dict_interpreters = {}
+        # block type -> entry point, None until discovered
+        self.dict_entry_points = None
+
+        self.reset_profiling()
+
+    def register(self, block_interpreter):
+        ras(isinstance(block_interpreter, BlockInterpreter))
+        ras(block_interpreter.block_type not in self.dict_interpreters,
+            "block type {} already has an interpreter".format(block_interpreter.block_type))
+
+        self.dict_interpreters[block_interpreter.block_type] = block_interpreter
+
+    def discover_entry_points(self):
+        if self.dict_entry_points is None:
+            self.dict_entry_points = {crrt_entry_point.name: crrt_entry_point for crrt_entry_point
+                                      in importlib.metadata.entry_points(group=self.entry_point_group)}
+
+    def get_interpreter(self, block_type):
+        """The BlockInterpreter of block_type, None if there is none."""
+        if block_type in self.dict_interpreters:
+            return self.dict_interpreters[block_type]
+
+        self.discover_entry_points()
+
+        if block_type not in self.dict_entry_points:
+            return None
+
+        # load only once, also if failing
+        crrt_entry_point = self.dict_entry_points.pop(block_type)
+
+        try:
+            block_interpreter = crrt_entry_point.load()
+            ras(isinstance(block_interpreter, BlockInterpreter))
+            ras(block_interpreter.block_type == block_type)
+        except Exception as crrt_except:
+            logging.error("could not load the interpreter of block type {} from {}: {}".format(
+                block_type, crrt_entry_point.value, crrt_except))
+            return None
+
+        logging.info("loaded the interpreter of block type {} from {}".format(block_type, crrt_entry_point.value))
+        self.register(block_interpreter)
+
+        return block_interpreter
+
+    def load_all_entry_points(self):
+        """Load the interpreters of all the entry points not loaded yet."""
+        self.discover_entry_points()
+
+        for crrt_block_type in list(self.dict_entry_points):
+            self.get_interpreter(crrt_block_type)
+
+    def block_types(self):
+        """All the block types that have an interpreter, registered or not loaded yet."""
+        self.discover_entry_points()
+        return sorted(set(self.dict_interpreters) | set(self.dict_entry_points))
+
+    def interpret_row(self, block_interpreter, dict_raw_block):
+        time_start = time.perf_counter()
+        dict_extracted = block_interpreter.row_processer(dict_raw_block)
+        self.count_call(block_interpreter.block_type, 1, time.perf_counter() - time_start)
+
+        return dict_extracted
+
+    def interpret_columnar_block(self, block_interpreter, columnar_block):
+        """Set the extracted columns of columnar_block, in batch if possible."""
+        time_start = time.perf_counter()
+
+        if block_interpreter.batch_processer is not None and len(columnar_block) > 0:
+            columnar_block.set_extracted_columns(block_interpreter.batch_processer(columnar_block))
+
+        else:
+            list_extracted_dicts = [block_interpreter.row_processer(columnar_block.row_as_dict(crrt_row))
+                                    for crrt_row in range(len(columnar_block))]
+            columnar_block.set_extracted(list_extracted_dicts)
+
+        self.count_call(block_interpreter.block_type, len(columnar_block), time.perf_counter() - time_start)
+
+    def count_call(self, block_type, nbr_blocks, time_spent):
+        if block_type not in self.dict_profiling:
+            self.dict_profiling[block_type] = {"nbr_calls": 0, "nbr_blocks": 0, "time_spent": 0.0}
+
+        self.dict_profiling[block_type]["nbr_calls"] += 1
+        self.dict_profiling[block_type]["nbr_blocks"] += nbr_blocks
+        self.dict_profiling[block_type]["time_spent"] += time_spent
+
+    def profiling_stats(self):
+        """block type -> {"nbr_calls", "nbr_blocks", "time_spent" (s)} since the last
+        reset_profiling."""
+        return {crrt_block_type: dict(crrt_stats) for crrt_block_type, crrt_stats in self.dict_profiling.items()}
+
+    def reset_profiling(self):
+        self.dict_profiling = {}
+
+    def log_profiling(self):
+        for crrt_block_type, crrt_stats in sorted(self.dict_profiling.items(),
+                                                  key=lambda crrt_item: -crrt_item[1]["time_spent"]):
+            logging.info("block type {}: {} calls, {} blocks, {:.3f} s".format(
+                crrt_block_type, crrt_stats["nbr_calls"], crrt_stats["nbr_blocks"], crrt_stats["time_spent"]))
+
+
+############################################################
+########## fill in the block analyzers registry under
+############################################################
+
+block_interpreter_registry = BlockInterpreterRegistry()
+
+block_interpreter_registry.register(BlockInterpreter(
+    "WL", ["average_air_gap", "average_water_level_ref_LAT", "minimum_air_gap", "maximum_air_gap",
+           "min_water_level_ref_LAT", "max_water_level_ref_LAT"], [4, 6],
+    row_processer=raw_WL_to_extracted_dict, batch_processer=batch_WL_to_extracted_columns))
+
+block_interpreter_registry.register(BlockInterpreter(
+    "MD", ["magnetic_declination"], [1],
+    row_processer=raw_MD_to_extracted_dict, batch_processer=batch_MD_to_extracted_columns))
+
+block_interpreter_registry.register(BlockInterpreter(
+    "MT", ["max_gust_last_period", "time_max_gust", "max_average_wind_speed_last_period", "time_max_average"], [4],
+    row_processer=raw_MT_to_extracted_dict, batch_processer=batch_MT_to_extracted_columns))
+
+
+class BlockProcessersView(Mapping):
+    """block type -> row by row block analyzer, read only, from a BlockInterpreterRegistry.
+    This is what dict_block_processers was before the registry. Iterating loads all the
+    entry points, so that the keys do not depend on the block types already met."""
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def __getitem__(self, block_type):
+        block_interpreter = self.registry.get_interpreter(block_type)
+
+        if block_interpreter is None:
+            raise KeyError(block_type)
+
+        return block_interpreter.row_processer
+
+    def __iter__(self):
+        self.registry.load_all_entry_points()
+        return iter(list(self.registry.dict_interpreters))
+
+    def __len__(self):
+        self.registry.load_all_entry_points()
+        return len(self.registry.dict_interpreters)
+
+
+# kept for the code using the former dict; register new interpreters in block_interpreter_registry
+dict_block_processers = BlockProcessersView(block_interpreter_registry)
 
 ############################################################
 ########## the main function to go through the parsed dict
 ############################################################
 
-def process_dict_blocks(dict_in):
+def process_dict_blocks(dict_in, registry=None, wanted_blocks=None):
+    """Interpret all the blocks that have an interpreter in registry (by default,
+    block_interpreter_registry). dict_in can be either the dict from D22Parser, in which
+    case an "extracted" dict is added to each block, or a ColumnarD22Result, in which case
+    the extracted fields are set as columns on each ColumnarBlock. With wanted_blocks (see
+    is_wanted_block), only these blocks are interpreted."""
+    if registry is None:
+        registry = block_interpreter_registry
+
+    if isinstance(dict_in, ColumnarD22Result):
+        process_columnar_blocks(dict_in, registry, wanted_blocks)
+        return
+
     ras(isinstance(dict_in, dict)) 
 
     missing_block_processor = MissingBlockProcessor()
@@ -174,17 +520,42 @@ def process_dict_blocks(dict_in):
         for crrt_datetime in crrt_platform_dict:
             crrt_package_dict = crrt_platform_dict[crrt_datetime]
             for crrt_block_fulltitle in list(crrt_package_dict.keys()):
+                if not is_wanted_block(crrt_block_fulltitle, wanted_blocks):
+                    continue
+
                 crrt_block_type = get_block_type(crrt_block_fulltitle)
+                crrt_interpreter = registry.get_interpreter(crrt_block_type)
 
-                if crrt_block_type not in dict_block_processers:
+                if crrt_interpreter is None:
                     missing_block_processor.register_missing_block_processor(crrt_block_type)
 
                 else:
-                    crrt_processer = dict_block_processers[crrt_block_type]
-                    crrt_extracted_dict = crrt_processer(crrt_package_dict[crrt_block_fulltitle])
+                    crrt_extracted_dict = registry.interpret_row(crrt_interpreter,
+                                                                 crrt_package_dict[crrt_block_fulltitle])
                     crrt_package_dict[crrt_block_fulltitle]["extracted"] = crrt_extracted_dict
 
 
+def process_columnar_blocks(columnar_in, registry=None, wanted_blocks=None):
+    if registry is None:
+        registry = block_interpreter_registry
+
+    ras(isinstance(columnar_in, ColumnarD22Result))
+
+    missing_block_processor = MissingBlockProcessor()
+
+    for _, crrt_block_fulltitle, crrt_block in columnar_in.iter_blocks():
+        if not is_wanted_block(crrt_block_fulltitle, wanted_blocks):
+            continue
+
+        crrt_block_type = get_block_type(crrt_block_fulltitle)
+        crrt_interpreter = registry.get_interpreter(crrt_block_type)
+
+        if crrt_interpreter is None:
+            missing_block_processor.register_missing_block_processor(crrt_block_type)
+
+        else:
+            registry.interpret_columnar_block(crrt_interpreter, crrt_block)
+
 if __name__ == "__main__":
     pp = pprint.PrettyPrinter(indent=1).pprint
 
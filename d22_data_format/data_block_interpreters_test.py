@@ -3,9 +3,18 @@ import pytz
 
 import math
 
+import os
+import sys
+
+import tempfile
+
+import numpy as np
+
 from d22_data_format.d22_parser import D22Parser
-from d22_data_format.data_block_interpreters import process_dict_blocks
-from d22_data_format.helpers.load_test_data import path_to_test_data
+from d22_data_format.columnar_result import block_from_lists, parse_d22_file_columnar
+from d22_data_format.data_block_interpreters import process_dict_blocks, block_interpreter_registry, \
+    BlockInterpreter, BlockInterpreterRegistry, BlockProcessersView, dict_block_processers, raw_WL_to_extracted_dict
+from d22_data_format.helpers.load_test_data import path_to_test_data, write_dummy_d22_tree
 
 def test_1():
     path_to_d22_file = path_to_test_data("short_20130923.d22")
@@ -19,3 +28,119 @@ def test_1():
 
     assert math.isnan(dict_result["Heimdal"][datetime.datetime(2013, 9, 23, 0, 0, tzinfo=pytz.utc)]["WL1"]
                       ["extracted"]["max_water_level_ref_LAT"])
+
+
+def assert_batch_same_as_row_by_row(block_type, list_list_entries, registry=None):
+    columnar_block = block_from_lists(list(range(len(list_list_entries))),
+                                      [len(crrt_list_entries) for crrt_list_entries in list_list_entries],
+                                      list_list_entries)
+    if registry is None:
+        registry = block_interpreter_registry
+
+    block_interpreter = registry.get_interpreter(block_type)
+    columnar_block.set_extracted([block_interpreter.row_processer(columnar_block.row_as_dict(crrt_row))
+                                  for crrt_row in range(len(columnar_block))])
+    dict_row_by_row = columnar_block.dict_extracted
+
+    dict_batch = block_interpreter.batch_processer(columnar_block)
+
+    assert list(dict_batch.keys()) == list(dict_row_by_row.keys())
+
+    for crrt_field in dict_row_by_row:
+        assert dict_batch[crrt_field].dtype == dict_row_by_row[crrt_field].dtype
+        np.testing.assert_array_equal(np.ma.getmaskarray(dict_batch[crrt_field]),
+                                      np.ma.getmaskarray(dict_row_by_row[crrt_field]))
+
+        if dict_row_by_row[crrt_field].dtype == np.float64:
+            np.testing.assert_array_equal(dict_batch[crrt_field].data, dict_row_by_row[crrt_field].data)
+        else:
+            for crrt_batch, crrt_row in zip(dict_batch[crrt_field].data.tolist(),
+                                            dict_row_by_row[crrt_field].data.tolist()):
+                assert crrt_batch == crrt_row or (math.isnan(crrt_batch) and math.isnan(crrt_row))
+
+
+def test_batch_same_as_row_by_row():
+    assert_batch_same_as_row_by_row("WL", [[56.72, 1.5, 55.0, 58.0, 1.0, 2.0],
+                                           [56.72, -999.99, 55.0, -999.88],
+                                           [1.0, 2.0, 3.0],
+                                           [56.1, 1.7, -999.77, 58.0, 1.0, 2.0]])
+    # only blocks with a wrong number of entries: no field
+    assert_batch_same_as_row_by_row("WL", [[1.0, 2.0, 3.0], []])
+
+    assert_batch_same_as_row_by_row("MD", [[1.5], [-999.99], [1.0, 2.0], []])
+
+    assert_batch_same_as_row_by_row("MT", [[12.1, 14.3, 8.2, 3.5],
+                                           [12.1, -999.99, 8.2, 23.9],
+                                           [-999.99, 24.0, 8.2, 3.5],
+                                           [12.1, float("nan"), 8.2, 3.5],
+                                           [12.1, -0.5, 8.2, 3.5],
+                                           [12.1, 14.3, 8.2]])
+    # no valid time: the time columns are float
+    assert_batch_same_as_row_by_row("MT", [[12.1, -999.99, 8.2, -999.99], [1.0, 2.0]])
+
+
+# a block type declared only by its columns, as a package would provide it
+XX_block_interpreter = BlockInterpreter("XX", ["first", "second", "third"], [2, 3])
+
+
+def test_registry_entry_points_and_profiling():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        # an installed distribution declaring the XX interpreter as an entry point
+        os.makedirs(tmpdirname + "/xx_blocks-1.0.dist-info")
+        with open(tmpdirname + "/xx_blocks-1.0.dist-info/METADATA", "w") as fh:
+            fh.write("Metadata-Version: 2.1\nName: xx_blocks\nVersion: 1.0\n")
+        with open(tmpdirname + "/xx_blocks-1.0.dist-info/entry_points.txt", "w") as fh:
+            fh.write("[d22_data_format.block_interpreters]\n"
+                     "XX = d22_data_format.data_block_interpreters_test:XX_block_interpreter\n"
+                     "YY = not_a_module:not_an_interpreter\n")
+
+        sys.path.insert(0, tmpdirname)
+
+        try:
+            registry = BlockInterpreterRegistry()
+
+            # the entry points are discovered on the first block type without interpreter
+            registry.register(BlockInterpreter("MD", ["magnetic_declination"], [1]))
+            assert registry.get_interpreter("MD") is not None
+            assert registry.dict_entry_points is None
+
+            assert registry.block_types() == ["MD", "XX", "YY"]
+            assert registry.get_interpreter("XX").list_column_names == ["first", "second", "third"]
+            assert registry.get_interpreter("YY") is None
+            assert registry.get_interpreter("ZZ") is None
+
+            assert_batch_same_as_row_by_row("XX", [[1.0, 2.0, 3.0], [1.0, -999.99], [1.0], []], registry=registry)
+
+            # the view lists the entry points that load, also before they are accessed
+            block_processers_view = BlockProcessersView(BlockInterpreterRegistry())
+            assert list(block_processers_view) == ["XX"]
+            assert block_processers_view["XX"]({"list_entries": [1.0, 2.0, 3.0]})["third"] == 3.0
+            assert len(block_processers_view) == 1
+
+        finally:
+            sys.path.remove(tmpdirname)
+
+    # the former dict of the row by row analyzers
+    assert list(dict_block_processers) == ["WL", "MD", "MT"]
+    assert dict_block_processers["WL"] is raw_WL_to_extracted_dict
+    assert "ZZ" not in dict_block_processers
+
+    dict_extracted = XX_block_interpreter.row_processer({"list_entries": [1.0, -999.88]})
+    assert dict_extracted["first"] == 1.0
+    assert math.isnan(dict_extracted["second"]) and math.isnan(dict_extracted["third"])
+
+    # one call per block in the dict, one per ColumnarBlock in the columnar result
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname)
+        path_to_d22_file = tmpdirname + "/dummy/d22/2013/20130901.d22"
+
+        block_interpreter_registry.reset_profiling()
+        process_dict_blocks(D22Parser(path_to_d22_file=path_to_d22_file).perform_parsing())
+        assert block_interpreter_registry.profiling_stats()["WL"]["nbr_calls"] == 24
+
+        block_interpreter_registry.reset_profiling()
+        process_dict_blocks(parse_d22_file_columnar(path_to_d22_file))
+        dict_stats = block_interpreter_registry.profiling_stats()
+        assert dict_stats["WL"]["nbr_calls"] == 1
+        assert dict_stats["WL"]["nbr_blocks"] == 24
+        assert dict_stats["MD"]["time_spent"] >= 0.0
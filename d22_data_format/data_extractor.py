@@ -14,13 +14,21 @@
 import logging
 import math
 
+import os
+
+import itertools
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
 import matplotlib.pyplot as plt
 
 import datetime
 
-from d22_data_format.helpers.datetimes import assert_is_utc_datetime, datetime_range
+from d22_data_format.helpers.datetimes import assert_is_utc_datetime
 
-from d22_data_format.d22_parser import D22Parser
+from d22_data_format.columnar_result import parse_d22_file_columnar, datetime_to_posix
 from d22_data_format.data_block_interpreters import process_dict_blocks
 from d22_data_format.exploration_tools import d22_files_in_dir_generator
 from d22_data_format.helpers.raise_assert import ras
@@ -54,156 +62,481 @@ class DataSpec():
                                                           self.block_field)
 
 
+def find_matching_spec(list_data_specs, crrt_station_id, crrt_block_id, crrt_block_field):
+    """Find the spec in list_data_specs corresponding to station / block / field, or None.
+    This is a linear search, prefer DataSpecIndex when doing many lookups."""
+    for crrt_spec in list_data_specs:
+        if (
+            crrt_spec.station_id == crrt_station_id and
+            crrt_spec.block_id == crrt_block_id and
+            crrt_spec.block_field == crrt_block_field
+        ):
+            return crrt_spec
+
+    return None
+
+
+class DataSpecIndex():
+    """A hash index of a list of DataSpec, by (station_id, block_id, block_field), and
+    by (station_id, block_id) to go directly to the blocks the specs need. If several
+    equal specs are given, the first one is used, as with find_matching_spec."""
+
+    def __init__(self, list_data_specs):
+        self.list_data_specs = list(list_data_specs)
+
+        # (station_id, block_id, block_field) -> spec
+        self.dict_specs = {}
+        # (station_id, block_id) -> list of (block_field, spec)
+        self.dict_blocks = {}
+
+        for crrt_spec in self.list_data_specs:
+            crrt_key = (crrt_spec.station_id, crrt_spec.block_id, crrt_spec.block_field)
+
+            if crrt_key in self.dict_specs:
+                continue
+
+            self.dict_specs[crrt_key] = crrt_spec
+
+            crrt_block_key = (crrt_spec.station_id, crrt_spec.block_id)
+            if crrt_block_key not in self.dict_blocks:
+                self.dict_blocks[crrt_block_key] = []
+            self.dict_blocks[crrt_block_key].append((crrt_spec.block_field, crrt_spec))
+
+        # the block titles the specs need, the only ones to decode and interpret
+        self.wanted_blocks = frozenset([crrt_block_id for (_, crrt_block_id) in self.dict_blocks])
+
+    def find(self, crrt_station_id, crrt_block_id, crrt_block_field):
+        return self.dict_specs.get((crrt_station_id, crrt_block_id, crrt_block_field), None)
+
+
+def extract_data_from_columnar(columnar_result, data_spec_index):
+    """Extract the data corresponding to the specs of data_spec_index from a parsed
+    and interpreted ColumnarD22Result. Only the blocks used by the specs are visited.
+    Output:
+        - dict_data: for each spec, the list of (datetime, value) found
+    """
+    dict_data = {crrt_spec: [] for crrt_spec in data_spec_index.list_data_specs}
+
+    for (crrt_station_id, crrt_block_id), list_fields_specs in data_spec_index.dict_blocks.items():
+        crrt_block = columnar_result.get_block(crrt_station_id, crrt_block_id)
+
+        if crrt_block is None or crrt_block.dict_extracted is None:
+            continue
+
+        list_block_datetimes = None
+
+        for (crrt_block_field, crrt_spec) in list_fields_specs:
+            if crrt_block_field not in crrt_block.dict_extracted:
+                continue
+
+            if list_block_datetimes is None:
+                list_block_datetimes = crrt_block.datetimes()
+
+            crrt_column = crrt_block.dict_extracted[crrt_block_field]
+            list_values = crrt_column.data.tolist()
+            list_valid = (~np.ma.getmaskarray(crrt_column)).tolist()
+
+            dict_data[crrt_spec].extend(
+                [(crrt_datetime, crrt_value) for (crrt_datetime, crrt_value, crrt_valid)
+                 in zip(list_block_datetimes, list_values, list_valid) if crrt_valid]
+            )
+
+    return dict_data
+
+
+def extract_data_from_file(path_to_file, data_specs, parsed_file_cache=None):
+    """Parse and interpret a single d22 file, and extract the data corresponding to
+    the specs. This is a module level function so that it can be used in worker processes.
+    Input:
+        - path_to_file: the d22 file to use
+        - data_specs: the DataSpecIndex, or list of DataSpec, to look for
+        - parsed_file_cache: if not None, a ParsedFileCache to get the parsed file from;
+        the cache keeps the whole files, else only the blocks used by the specs are decoded
+    Output:
+        - dict_file_data: for each spec, the list of (datetime, value) found
+        - error_message: None if the file was processed fine, the error otherwise
+    """
+    if isinstance(data_specs, DataSpecIndex):
+        data_spec_index = data_specs
+    else:
+        data_spec_index = DataSpecIndex(data_specs)
+
+    try:
+        # extract information and label fields, as columns
+        if parsed_file_cache is None:
+            crrt_columnar_result = parse_d22_file_columnar(path_to_file,
+                                                           wanted_blocks=data_spec_index.wanted_blocks)
+        else:
+            crrt_columnar_result = parsed_file_cache.get_or_parse(path_to_file)
+
+        process_dict_blocks(crrt_columnar_result, wanted_blocks=data_spec_index.wanted_blocks)
+
+        dict_file_data = extract_data_from_columnar(crrt_columnar_result, data_spec_index)
+
+    except Exception as crrt_except:
+        dict_file_data = {crrt_spec: [] for crrt_spec in data_spec_index.list_data_specs}
+        return (dict_file_data, "{}: {}".format(type(crrt_except).__name__, crrt_except))
+
+    return (dict_file_data, None)
+
+
+def date_from_d22_file_name(path_to_file):
+    """The date of a daily d22 file from its name, that starts with YYYYMMDD (as
+    20130923.d22 or 19960201.heidrun.gz), or None if the name does not start with a date."""
+    file_name = os.path.basename(str(path_to_file))
+
+    if not file_name[:8].isdigit():
+        return None
+
+    try:
+        return datetime.datetime.strptime(file_name[:8], "%Y%m%d").date()
+    except ValueError:
+        return None
+
+
+def d22_file_may_overlap(path_to_file, datetime_start=None, datetime_end=None,
+                         margin=datetime.timedelta(days=1)):
+    """If a daily d22 file may have packages within [datetime_start; datetime_end],
+    from the date in its name. A file with no date in its name always may. The margin
+    allows for packages written in the file of the previous or next day."""
+    file_date = date_from_d22_file_name(path_to_file)
+
+    if file_date is None:
+        return True
+
+    if datetime_start is not None and file_date < (datetime_start - margin).date():
+        return False
+
+    if datetime_end is not None and file_date > (datetime_end + margin).date():
+        return False
+
+    return True
+
+
+def values_as_array(list_values):
+    """The values as a float64 array if possible, else as an object array (for
+    example for the fields that are datetimes)."""
+    try:
+        return np.array(list_values, dtype=np.float64)
+    except (TypeError, ValueError):
+        array_values = np.empty(len(list_values), dtype=object)
+        array_values[:] = list_values
+        return array_values
+
+
+def time_base_samples_indexes(data_timestamps, time_base, resolution, max_nbr_iterations=32,
+                              reuse_last_sample=True):
+    """For each time of time_base, the index in data_timestamps of the sample to use,
+    or -1 if none. The sample used is the first not yet used sample within
+    resolution / 2 of the time (the last sample can be used several times, unless
+    reuse_last_sample is False).
+    Input:
+        - data_timestamps: sorted int64 array of the times of the samples
+        - time_base: sorted int64 array, regular with step resolution
+        - resolution: int, the step of the time base
+        - reuse_last_sample: False when data_timestamps are only the samples up to a
+        time window end, so that the last one may not be the last of all the data
+    """
+    nbr_samples = data_timestamps.shape[0]
+
+    if nbr_samples == 0:
+        return np.full(time_base.shape, -1, dtype=np.int64)
+
+    if not reuse_last_sample:
+        # a sample far after all the times, never within resolution / 2 of any of them
+        data_timestamps = np.append(data_timestamps, np.iinfo(np.int64).max // 4)
+        nbr_samples += 1
+
+    max_ind = nbr_samples - 1
+
+    # 1. the first sample not before time - resolution / 2
+    # 2. a sample exactly resolution / 2 after a time can be used by this time and the
+    #    next one; it is then used by the first one only, and the next time looks at the
+    #    following samples. Chains of such samples are resolved by iterating (each
+    #    iteration makes at least one more index right), with a plain loop as fallback.
+
+    # 1.
+    first_in_window = np.searchsorted(data_timestamps, time_base - resolution // 2, side="left")
+    first_in_window = np.minimum(first_in_window, max_ind)
+
+    def is_within_window(samples_indexes):
+        return 2 * np.abs(data_timestamps[samples_indexes] - time_base) <= resolution
+
+    # 2.
+    crrt_indexes = first_in_window
+
+    for _ in range(max_nbr_iterations):
+        crrt_is_used = is_within_window(crrt_indexes)
+
+        next_indexes = first_in_window.copy()
+        next_indexes[1:] = np.maximum(next_indexes[1:],
+                                      crrt_indexes[:-1] + (crrt_is_used[:-1] & (crrt_indexes[:-1] < max_ind)))
+
+        if np.array_equal(next_indexes, crrt_indexes):
+            break
+
+        crrt_indexes = next_indexes
+
+    else:
+        list_data_timestamps = data_timestamps.tolist()
+        list_indexes = []
+        crrt_ind = 0
+
+        for crrt_time, crrt_first_in_window in zip(time_base.tolist(), first_in_window.tolist()):
+            crrt_ind = max(crrt_ind, crrt_first_in_window)
+            list_indexes.append(crrt_ind)
+
+            if 2 * abs(list_data_timestamps[crrt_ind] - crrt_time) <= resolution and crrt_ind < max_ind:
+                crrt_ind += 1
+
+        crrt_indexes = np.array(list_indexes, dtype=np.int64)
+
+    return np.where(is_within_window(crrt_indexes), crrt_indexes, -1)
+
+
 class DataExtractor():
-    def __init__(self, path_root_data=None):
+    def __init__(self, path_root_data=None, nbr_workers=1, parsed_file_cache=None, archive_index=None):
+        """Input:
+            - path_root_data: the root of the d22 data. None (default) is the right
+            location on lustreB.
+            - nbr_workers: the number of processes used to parse the files in
+            extract_available_data. 1 (default) parses in the calling process, None
+            uses as many processes as CPUs.
+            - parsed_file_cache: if not None, a ParsedFileCache, so that the files
+            are parsed only once across runs.
+            - archive_index: if not None, an ArchiveIndex to take the list of the
+            files of a folder from, instead of walking the archive tree.
+        """
         if path_root_data is None:
             path_root_data = "/lustre/storeB/immutable/archive/projects/metproduction/DNMI_OFFSHORE/"
 
+        if nbr_workers is None:
+            nbr_workers = os.cpu_count()
+
+        ras(isinstance(nbr_workers, int) and nbr_workers >= 1)
+
         self.path_root_data = path_root_data
-        self.data_files_yielder = None
+        self.nbr_workers = nbr_workers
+        self.parsed_file_cache = parsed_file_cache
+        self.archive_index = archive_index
+        self.datetime_start = None
+        self.datetime_end = None
+        self.nbr_files_processed = 0
 
         self.extract_available_data_is_run = False
         self.data_as_time_series_is_run = False
 
-    def set_data_files_yielder(self, folder):
+    def folder_files_yielder(self, folder, datetime_start=None, datetime_end=None):
+        """The files of folder that may have packages within [datetime_start; datetime_end],
+        from the archive index if any, else from the dates in the file names."""
         folder_as_list = [folder]
-        self.data_files_yielder = d22_files_in_dir_generator(path_root_data=self.path_root_data,
-                                                             list_stations_subfolders=folder_as_list)
 
-    def extract_available_data(self, list_data_specs_same_folder):
+        if self.archive_index is not None:
+            return d22_files_in_dir_generator(path_root_data=self.path_root_data,
+                                              list_stations_subfolders=folder_as_list,
+                                              archive_index=self.archive_index,
+                                              datetime_start=datetime_start,
+                                              datetime_end=datetime_end)
+
+        return (crrt_file for crrt_file
+                in d22_files_in_dir_generator(path_root_data=self.path_root_data,
+                                              list_stations_subfolders=folder_as_list)
+                if d22_file_may_overlap(crrt_file, datetime_start, datetime_end))
+
+    def extract_available_data(self, list_data_specs, datetime_start=None, datetime_end=None):
+        """Extract the data of the specs, that can be in several folders. The specs are
+        grouped by folder, and the files of all the folders are parsed as a single job,
+        so that with nbr_workers > 1 the folders are processed concurrently.
+        If datetime_start and / or datetime_end are given, only the files that may
+        have packages within [datetime_start; datetime_end] are parsed, and only
+        the data within are kept."""
         # list_data_specs: list of data_specs, each with 1) folder, 2) station_id, 3) block_id, 4) block_field
 
-        # 1: check that all from same folder
-        # 2: generate the files yielder
-        # 3: file by file, parse, and extract the data of interest. Put it in a dict
+        # 1: group the specs by folder, in the order of first appearance
+        # 2: for each folder, generate the files yielder, skipping the files out of the time window
+        # 3: file by file, parse, and extract the data of interest of the specs of its folder, either
+        #    in this process or in a pool of processes shared by all folders. Put it in a dict, in
+        #    the order of the files of each folder.
+
+        self.list_data_specs = list(list_data_specs)
+        self.data_spec_index = DataSpecIndex(self.list_data_specs)
+
+        if datetime_start is not None:
+            assert_is_utc_datetime(datetime_start)
+        if datetime_end is not None:
+            assert_is_utc_datetime(datetime_end)
 
-        self.list_data_specs_same_folder = list_data_specs_same_folder
+        self.datetime_start = datetime_start
+        self.datetime_end = datetime_end
 
         # 1.
-        for crrt_spec in list_data_specs_same_folder:
-            ras(crrt_spec.folder == list_data_specs_same_folder[0].folder)
+        dict_folder_specs = {}
+        for crrt_spec in self.list_data_specs:
+            if crrt_spec.folder not in dict_folder_specs:
+                dict_folder_specs[crrt_spec.folder] = []
+            dict_folder_specs[crrt_spec.folder].append(crrt_spec)
+
+        self.dict_folder_spec_index = {crrt_folder: DataSpecIndex(list_folder_specs)
+                                       for crrt_folder, list_folder_specs in dict_folder_specs.items()}
 
         # 2.
-        crrt_folder = list_data_specs_same_folder[0].folder
-        self.set_data_files_yielder(crrt_folder)
+        def files_and_indexes():
+            for crrt_folder, crrt_spec_index in self.dict_folder_spec_index.items():
+                for crrt_file in self.folder_files_yielder(crrt_folder, datetime_start, datetime_end):
+                    yield (crrt_file, crrt_spec_index)
 
         # 3.
         self.dict_gathered_data = {}
-        for crrt_spec in list_data_specs_same_folder:
+        for crrt_spec in self.list_data_specs:
             self.dict_gathered_data[crrt_spec] = []
 
-        for crrt_file in self.data_files_yielder:
-            logging.info("looking at {}".format(crrt_file)) 
-
-            try:
+        self.dict_file_errors = {}
+        self.nbr_files_processed = 0
 
-                # extract information and label fields
-                d22_parser = D22Parser(path_to_d22_file=crrt_file)
-                crrt_dict_result = d22_parser.perform_parsing()
-                process_dict_blocks(crrt_dict_result)
+        if self.nbr_workers == 1:
+            iterator_files_results = ((crrt_file, extract_data_from_file(crrt_file, crrt_spec_index,
+                                                                         self.parsed_file_cache))
+                                      for (crrt_file, crrt_spec_index) in files_and_indexes())
+            self.merge_files_results(iterator_files_results)
 
-                # go through all specs, and append the results at the right location
-                for crrt_station_id in crrt_dict_result:
-                    for crrt_timestamp in crrt_dict_result[crrt_station_id]:
-                        for crrt_block_id in crrt_dict_result[crrt_station_id][crrt_timestamp]:
-                            if "extracted" in crrt_dict_result[crrt_station_id][crrt_timestamp][crrt_block_id]:
-                                for crrt_block_field in crrt_dict_result[crrt_station_id][crrt_timestamp]\
-                                        [crrt_block_id]["extracted"]:
-                                    matching_spec = self.find_spec(crrt_station_id,
-                                                                   crrt_block_id, crrt_block_field)
+        else:
+            list_files_indexes = list(files_and_indexes())
+            list_files = [crrt_file for (crrt_file, _) in list_files_indexes]
+            list_spec_indexes = [crrt_spec_index for (_, crrt_spec_index) in list_files_indexes]
+            chunksize = max(1, len(list_files) // (4 * self.nbr_workers))
 
-                                    if matching_spec is not None:
-                                        crrt_value = crrt_dict_result[crrt_station_id][crrt_timestamp]\
-                                            [crrt_block_id]["extracted"][crrt_block_field]
-                                        self.dict_gathered_data[matching_spec].append((crrt_timestamp, crrt_value))
+            with ProcessPoolExecutor(max_workers=self.nbr_workers) as executor:
+                iterator_results = executor.map(extract_data_from_file, list_files,
+                                                list_spec_indexes,
+                                                itertools.repeat(self.parsed_file_cache),
+                                                chunksize=chunksize)
+                self.merge_files_results(zip(list_files, iterator_results))
 
-                self.extract_available_data_is_run = True
+        if self.dict_file_errors:
+            logging.warning("{} files could not be processed, see dict_file_errors".format(
+                len(self.dict_file_errors)))
 
-            except:
-                pass
+        # also with no file in the time window: the time series are then all NaN
+        self.extract_available_data_is_run = True
 
         return self.dict_gathered_data
 
-    def find_spec(self, crrt_station_id, crrt_block_id, crrt_block_field):
-        for crrt_spec in self.list_data_specs_same_folder:
-            if (
-                crrt_spec.station_id == crrt_station_id and
-                crrt_spec.block_id == crrt_block_id and
-                crrt_spec.block_field == crrt_block_field
-            ):
-                return crrt_spec
+    def merge_files_results(self, iterator_files_results):
+        """Merge the results of extract_data_from_file, in the order of the files."""
+        for crrt_file, (dict_file_data, error_message) in iterator_files_results:
+            logging.info("looking at {}".format(crrt_file))
+            self.nbr_files_processed += 1
 
-        return None
+            if error_message is not None:
+                logging.error("could not process file {}: {}".format(crrt_file, error_message))
+                self.dict_file_errors[crrt_file] = error_message
+                continue
+
+            for crrt_spec in dict_file_data:
+                if self.datetime_start is None and self.datetime_end is None:
+                    self.dict_gathered_data[crrt_spec].extend(dict_file_data[crrt_spec])
+                else:
+                    self.dict_gathered_data[crrt_spec].extend(
+                        [crrt_entry for crrt_entry in dict_file_data[crrt_spec]
+                         if (self.datetime_start is None or crrt_entry[0] >= self.datetime_start) and
+                         (self.datetime_end is None or crrt_entry[0] <= self.datetime_end)]
+                    )
+
+    def find_spec(self, crrt_station_id, crrt_block_id, crrt_block_field):
+        return self.data_spec_index.find(crrt_station_id, crrt_block_id, crrt_block_field)
 
     def data_as_time_series(self, datetime_start, datetime_end, datetime_resolution):
-        # use the dict of data generated to provide time series, in a dict
-        # 1. double check that the specs are ordered
-        # 2. put the data, interpolate / fill with NaNs where necessary
+        """Put the extracted data on the regular time base [datetime_start; datetime_end[
+        with step datetime_resolution. For each time of the time base, the first not yet
+        used sample within half a resolution is taken (the nearest one for regularly
+        sampled data), else NaN.
+        Output:
+            - dict_time_series: "timestamps" is the time base as an int64 array of POSIX
+            timestamps, and each spec gives an array of values (float64, or object if
+            the field is not numeric) of the same length."""
+        # 1. build the time base, as int64 POSIX timestamps
+        # 2. for each spec, sort the data and find the sample used at each time
 
         ras(self.extract_available_data_is_run, "need to call extract_available_data first!")
 
         assert_is_utc_datetime(datetime_start)
         assert_is_utc_datetime(datetime_end)
         ras(isinstance(datetime_resolution, datetime.timedelta))
+        ras(datetime_start < datetime_end)
+        ras(datetime_resolution > datetime.timedelta(0))
+        ras(datetime_resolution.microseconds == 0, "the resolution must be a whole number of seconds")
+
+        # the samples within half a resolution of the time base can be used
+        if (self.datetime_start is not None and datetime_start - datetime_resolution / 2 < self.datetime_start) or \
+                (self.datetime_end is not None and datetime_end + datetime_resolution / 2 > self.datetime_end):
+            logging.warning("the time series goes beyond the time window of the extraction, "
+                            "some data may be missing")
+
+        # 1.
+        resolution_seconds = int(datetime_resolution.total_seconds())
+        time_base = np.arange(datetime_to_posix(datetime_start), datetime_to_posix(datetime_end),
+                              resolution_seconds, dtype=np.int64)
 
         self.dict_time_series = {}
-        self.dict_time_series["timestamps"] = list(datetime_range(datetime_start, datetime_end, datetime_resolution))
+        self.dict_time_series["timestamps"] = time_base
 
+        # 2.
         for crrt_spec in self.dict_gathered_data:
-            self.dict_gathered_data[crrt_spec].sort(key=lambda x: x[0])
-            for crrt_entry, next_entry in zip(self.dict_gathered_data[crrt_spec][:-1],
-                                              self.dict_gathered_data[crrt_spec][1:]):
-                try:
-                    ras(crrt_entry[0] <= next_entry[0])
-                except:
-                    logging.error("got badly ordered entries in {}: {} and {} are not ordered"
-                                  .format(
-                                      crrt_spec,
-                                      crrt_entry[0],
-                                      next_entry[0]
-                                  )
-                                  )
-
-        datetime_tolerance = datetime_resolution / 2
+            list_crrt_data = self.dict_gathered_data[crrt_spec]
 
-        for crrt_spec in self.dict_gathered_data:
-            crrt_entry_index = 0
-            max_entry_index = len(self.dict_gathered_data[crrt_spec]) - 1
-            self.dict_time_series[crrt_spec] = []
-
-            for crrt_timestamp in self.dict_time_series["timestamps"]:
-
-                while (
-                    self.dict_gathered_data[crrt_spec][crrt_entry_index][0] < crrt_timestamp - datetime_tolerance and
-                    crrt_entry_index < max_entry_index
-                ):
-                    crrt_entry_index += 1
-
-                if (
-                    crrt_entry_index > max_entry_index or
-                    abs(crrt_timestamp - self.dict_gathered_data[crrt_spec][crrt_entry_index][0]) > datetime_tolerance
-                ):
-                    self.dict_time_series[crrt_spec].append(math.nan)
-                else:
-                    self.dict_time_series[crrt_spec].append(self.dict_gathered_data[crrt_spec][crrt_entry_index][1])
-                    if crrt_entry_index < max_entry_index:
-                        crrt_entry_index += 1
+            data_timestamps = np.array([int(crrt_entry[0].timestamp()) for crrt_entry in list_crrt_data],
+                                       dtype=np.int64)
+            data_values = values_as_array([crrt_entry[1] for crrt_entry in list_crrt_data])
+
+            order = np.argsort(data_timestamps, kind="stable")
+            data_timestamps = data_timestamps[order]
+            data_values = data_values[order]
+
+            samples_indexes = time_base_samples_indexes(data_timestamps, time_base, resolution_seconds,
+                                                        reuse_last_sample=self.datetime_end is None)
+            has_sample = samples_indexes >= 0
+
+            if data_values.dtype == np.float64:
+                crrt_time_series = np.full(time_base.shape, np.nan)
+            else:
+                crrt_time_series = np.full(time_base.shape, math.nan, dtype=object)
+
+            crrt_time_series[has_sample] = data_values[samples_indexes[has_sample]]
 
-            ras(len(self.dict_time_series["timestamps"]) == len(self.dict_time_series[crrt_spec]))
+            self.dict_time_series[crrt_spec] = crrt_time_series
 
         self.data_as_time_series_is_run = True
 
         return self.dict_time_series
 
+    def extract_data_as_time_series(self, list_data_specs, datetime_start, datetime_end, datetime_resolution):
+        """extract_available_data, only from the files and data that data_as_time_series
+        needs for this time base, followed by data_as_time_series. This gives the same
+        time series as extracting all the data (except if the last sample of all the data
+        falls exactly half a resolution after a time of the time base: it is then not
+        used again by the next time), but the cost is proportional to the time window
+        instead of the whole archive. The specs can be in several folders,
+        all the time series are on the same time base."""
+        ras(isinstance(datetime_resolution, datetime.timedelta))
+
+        self.extract_available_data(list_data_specs,
+                                    datetime_start=datetime_start - datetime_resolution / 2,
+                                    datetime_end=datetime_end + datetime_resolution / 2)
+
+        return self.data_as_time_series(datetime_start, datetime_end, datetime_resolution)
+
     def extract_value_from_time_series(self, datetime_of_sample, spec):
         ras(self.data_as_time_series_is_run, "need to call data_as_time_series first!")
 
         assert_is_utc_datetime(datetime_of_sample)
         ras(isinstance(spec, DataSpec))
-        ras(datetime_of_sample in self.dict_time_series["timestamps"])
         ras(spec in self.dict_time_series)
 
-        index_of_datetime = self.dict_time_series["timestamps"].index(datetime_of_sample)
+        time_base = self.dict_time_series["timestamps"]
+        timestamp_of_sample = datetime_to_posix(datetime_of_sample)
+        index_of_datetime = int(np.searchsorted(time_base, timestamp_of_sample))
+
+        ras(index_of_datetime < time_base.shape[0] and time_base[index_of_datetime] == timestamp_of_sample)
 
         return self.dict_time_series[spec][index_of_datetime]
 
@@ -214,12 +547,12 @@ class DataExtractor():
         ras(self.data_as_time_series_is_run, "need to call data_as_time_series first!")
 
         for crrt_spec in list_specs:
-            ras(crrt_spec in self.list_data_specs_same_folder)
+            ras(crrt_spec in self.list_data_specs)
 
         plt.figure()
 
         for crrt_spec in list_specs:
-            plt.plot(self.dict_time_series["timestamps"],
+            plt.plot(self.dict_time_series["timestamps"].astype("datetime64[s]"),
                      self.dict_time_series[crrt_spec],
                      label="{}: {}/{}".format(crrt_spec.station_id,
                                               crrt_spec.block_id,
@@ -3,8 +3,16 @@ import pytz
 
 import math
 
-from d22_data_format.data_extractor import DataExtractor, DataSpec
-from d22_data_format.helpers.load_test_data import path_to_test_data
+import tempfile
+
+import shutil
+
+import numpy as np
+
+from d22_data_format.archive_index import ArchiveIndex
+from d22_data_format.data_extractor import DataExtractor, DataSpec, DataSpecIndex, find_matching_spec, \
+    time_base_samples_indexes, date_from_d22_file_name
+from d22_data_format.helpers.load_test_data import path_to_test_data, write_dummy_d22_tree
 
 def test_1():
     list_data_specs = [DataSpec("aastahansteen", "AASTA", "MD1", "magnetic_declination"),
@@ -70,6 +78,243 @@ def test_1():
     data_extractor.plot_time_series(
         list_specs=[DataSpec("aastahansteen", "AASTA", "MTB", "max_gust_last_period")])
 
+def test_parallel_extraction():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination"),
+                       DataSpec("dummy", "DUMMY", "WL1", "average_water_level_ref_LAT")]
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname)
+
+        data_extractor_serial = DataExtractor(path_root_data=tmpdirname)
+        dict_result_serial = data_extractor_serial.extract_available_data(list_data_specs)
+
+        data_extractor_parallel = DataExtractor(path_root_data=tmpdirname, nbr_workers=2)
+        dict_result_parallel = data_extractor_parallel.extract_available_data(list_data_specs)
+
+    assert dict_result_serial == dict_result_parallel
+    assert len(dict_result_parallel[list_data_specs[0]]) == 4 * 24
+    assert dict_result_parallel[list_data_specs[0]][25] == \
+        (datetime.datetime(2013, 9, 2, 1, 0, 0, tzinfo=pytz.utc), 2.01)
+    assert dict_result_parallel[list_data_specs[1]][25][1] == -1.0
+
+    assert len(data_extractor_parallel.dict_file_errors) == 1
+    assert str(list(data_extractor_parallel.dict_file_errors.keys())[0]).endswith("20130905.d22")
+
+
+def test_spec_index_same_as_linear_search():
+    list_data_specs = [DataSpec("folder_{}".format(crrt_ind % 3), "STATION_{}".format(crrt_ind % 7),
+                                "WL{}".format(crrt_ind % 2), "field_{}".format(crrt_ind % 5))
+                       for crrt_ind in range(60)]
+    data_spec_index = DataSpecIndex(list_data_specs)
+
+    for crrt_station in ["STATION_{}".format(crrt_ind) for crrt_ind in range(8)]:
+        for crrt_block in ["WL0", "WL1", "MD1"]:
+            for crrt_field in ["field_{}".format(crrt_ind) for crrt_ind in range(6)]:
+                assert data_spec_index.find(crrt_station, crrt_block, crrt_field) is \
+                    find_matching_spec(list_data_specs, crrt_station, crrt_block, crrt_field)
+
+
+def time_series_reference(list_data, list_time_base, tolerance):
+    """The original loop of data_as_time_series, kept as the reference."""
+    list_time_series = []
+    crrt_entry_index = 0
+    max_entry_index = len(list_data) - 1
+
+    for crrt_timestamp in list_time_base:
+        while (
+            list_data[crrt_entry_index][0] < crrt_timestamp - tolerance and
+            crrt_entry_index < max_entry_index
+        ):
+            crrt_entry_index += 1
+
+        if abs(crrt_timestamp - list_data[crrt_entry_index][0]) > tolerance:
+            list_time_series.append(math.nan)
+        else:
+            list_time_series.append(list_data[crrt_entry_index][1])
+            if crrt_entry_index < max_entry_index:
+                crrt_entry_index += 1
+
+    return list_time_series
+
+
+def test_time_base_samples_same_as_reference():
+    random_generator = np.random.default_rng(seed=42)
+    resolution = 600
+    time_base = np.arange(0, 200 * resolution, resolution, dtype=np.int64)
+
+    # irregular samples, samples on the half resolution (chains of ties), duplicates
+    list_cases = [
+        np.sort(random_generator.integers(-2000, 130000, size=150)),
+        np.arange(300, 130000, 600),
+        np.sort(np.concatenate([np.arange(-300, 50000, 300), np.arange(0, 50000, 1200)])),
+        np.array([5 * resolution, 5 * resolution, 5 * resolution + 300]),
+        np.array([130 * resolution + 300]),
+    ]
+
+    for crrt_data_timestamps in list_cases:
+        crrt_data_timestamps = crrt_data_timestamps.astype(np.int64)
+        list_data = [(crrt_time, crrt_ind) for (crrt_ind, crrt_time) in enumerate(crrt_data_timestamps.tolist())]
+
+        list_reference = time_series_reference(list_data, time_base.tolist(), resolution / 2)
+
+        for crrt_max_nbr_iterations in [1, 32]:
+            samples_indexes = time_base_samples_indexes(crrt_data_timestamps, time_base, resolution,
+                                                        max_nbr_iterations=crrt_max_nbr_iterations)
+            list_result = [math.nan if crrt_ind < 0 else crrt_ind for crrt_ind in samples_indexes.tolist()]
+
+            assert np.array_equal(np.array(list_result), np.array(list_reference), equal_nan=True)
+
+    assert (time_base_samples_indexes(np.array([], dtype=np.int64), time_base, resolution) == -1).all()
+
+
+def test_data_as_time_series():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination"),
+                       DataSpec("dummy", "DUMMY", "MD2", "magnetic_declination")]
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=2)
+
+        data_extractor = DataExtractor(path_root_data=tmpdirname)
+        data_extractor.extract_available_data(list_data_specs)
+
+    datetime_start = datetime.datetime(2013, 9, 1, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_end = datetime.datetime(2013, 9, 3, 12, 0, 0, tzinfo=pytz.utc)
+
+    dict_time_series = data_extractor.data_as_time_series(datetime_start, datetime_end,
+                                                          datetime.timedelta(minutes=30))
+
+    assert dict_time_series["timestamps"].dtype == np.int64
+    assert dict_time_series["timestamps"].shape == (120,)
+    assert dict_time_series["timestamps"][2] == 1377993600 + 3600
+
+    time_series_MD1 = dict_time_series[list_data_specs[0]]
+    assert time_series_MD1[2] == 1.01
+    assert np.isnan(time_series_MD1[3])
+    assert np.isnan(time_series_MD1[100:]).all()
+    assert np.isnan(dict_time_series[list_data_specs[1]]).all()
+
+    assert data_extractor.extract_value_from_time_series(
+        datetime.datetime(2013, 9, 2, 1, 0, 0, tzinfo=pytz.utc), list_data_specs[0]) == 2.01
+
+
+def test_extraction_time_window():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination"),
+                       DataSpec("dummy", "DUMMY", "WL1", "max_water_level_ref_LAT")]
+
+    datetime_start = datetime.datetime(2013, 9, 6, 6, 0, 0, tzinfo=pytz.utc)
+    datetime_end = datetime.datetime(2013, 9, 6, 18, 0, 0, tzinfo=pytz.utc)
+    datetime_resolution = datetime.timedelta(minutes=30)
+
+    assert date_from_d22_file_name("/some/path/20130923.d22.gz") == datetime.date(2013, 9, 23)
+    assert date_from_d22_file_name("19960201.heidrun.gz") == datetime.date(1996, 2, 1)
+    assert date_from_d22_file_name("20131323.d22") is None
+
+    # a sample exactly half a resolution after a time is used by this time only, also when
+    # the samples after the window end are cut off
+    time_base = np.array([0, 600, 1200], dtype=np.int64)
+    assert time_base_samples_indexes(np.array([0, 900, 6000], dtype=np.int64), time_base, 600).tolist() == \
+        [0, 1, -1]
+    assert time_base_samples_indexes(np.array([0, 900], dtype=np.int64), time_base, 600,
+                                     reuse_last_sample=False).tolist() == [0, 1, -1]
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=8)
+
+        data_extractor = DataExtractor(path_root_data=tmpdirname)
+        data_extractor.extract_available_data(list_data_specs)
+        dict_time_series_all_files = data_extractor.data_as_time_series(datetime_start, datetime_end,
+                                                                        datetime_resolution)
+        assert data_extractor.nbr_files_processed == 9
+
+        # from the dates in the file names: the files of the day before, the day, and the day after
+        data_extractor = DataExtractor(path_root_data=tmpdirname)
+        dict_time_series = data_extractor.extract_data_as_time_series(list_data_specs, datetime_start, datetime_end,
+                                                                      datetime_resolution)
+        assert data_extractor.nbr_files_processed == 3
+        assert min([crrt_entry[0] for crrt_entry in data_extractor.dict_gathered_data[list_data_specs[0]]]) == \
+            datetime.datetime(2013, 9, 6, 6, 0, 0, tzinfo=pytz.utc)
+
+        for crrt_key in dict_time_series_all_files:
+            np.testing.assert_array_equal(dict_time_series[crrt_key], dict_time_series_all_files[crrt_key])
+
+        # from an index: the file of the day, and the cut file that could not be indexed in full
+        archive_index = ArchiveIndex(path_root_data=tmpdirname, path_index_file=tmpdirname + "/index.pkl")
+        archive_index.refresh()
+
+        data_extractor = DataExtractor(path_root_data=tmpdirname, archive_index=archive_index)
+        dict_time_series = data_extractor.extract_data_as_time_series(list_data_specs, datetime_start, datetime_end,
+                                                                      datetime_resolution)
+        assert data_extractor.nbr_files_processed == 2
+
+        for crrt_key in dict_time_series_all_files:
+            np.testing.assert_array_equal(dict_time_series[crrt_key], dict_time_series_all_files[crrt_key])
+
+
+def test_extraction_empty_time_window():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination"),
+                       DataSpec("dummy", "DUMMY", "WL1", "max_water_level_ref_LAT")]
+
+    datetime_start = datetime.datetime(2013, 7, 1, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_end = datetime.datetime(2013, 7, 2, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_resolution = datetime.timedelta(hours=1)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=2)
+
+        archive_index = ArchiveIndex(path_root_data=tmpdirname, path_index_file=tmpdirname + "/index.pkl")
+        archive_index.refresh()
+
+        # no file in the window, from the file names or from an index (that still gives the cut
+        # file, as it could not be indexed in full): all NaN on the time base
+        for crrt_archive_index, crrt_nbr_files in [(None, 0), (archive_index, 1)]:
+            data_extractor = DataExtractor(path_root_data=tmpdirname, archive_index=crrt_archive_index)
+            dict_time_series = data_extractor.extract_data_as_time_series(list_data_specs, datetime_start,
+                                                                          datetime_end, datetime_resolution)
+            assert data_extractor.nbr_files_processed == crrt_nbr_files
+            assert dict_time_series["timestamps"].shape == (24,)
+
+            for crrt_spec in list_data_specs:
+                assert np.all(np.isnan(dict_time_series[crrt_spec]))
+
+
+def test_multiple_folders_extraction():
+    list_specs_dummy = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination"),
+                        DataSpec("dummy", "DUMMY", "WL1", "max_water_level_ref_LAT")]
+    list_specs_other = [DataSpec("/other/", "DUMMY", "MD1", "magnetic_declination")]
+
+    datetime_start = datetime.datetime(2013, 9, 2, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_end = datetime.datetime(2013, 9, 4, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_resolution = datetime.timedelta(minutes=30)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname)
+        shutil.copytree(tmpdirname + "/dummy", tmpdirname + "/other")
+
+        # reference: one extraction per folder
+        dict_reference = {}
+        for crrt_list_specs in [list_specs_dummy, list_specs_other]:
+            data_extractor = DataExtractor(path_root_data=tmpdirname)
+            dict_reference.update(data_extractor.extract_data_as_time_series(crrt_list_specs, datetime_start,
+                                                                             datetime_end, datetime_resolution))
+
+        archive_index = ArchiveIndex(path_root_data=tmpdirname, path_index_file=tmpdirname + "/index.pkl")
+        archive_index.refresh()
+
+        for crrt_nbr_workers, crrt_archive_index in [(1, None), (2, None), (2, archive_index)]:
+            data_extractor = DataExtractor(path_root_data=tmpdirname, nbr_workers=crrt_nbr_workers,
+                                           archive_index=crrt_archive_index)
+            dict_time_series = data_extractor.extract_data_as_time_series(list_specs_dummy + list_specs_other,
+                                                                          datetime_start, datetime_end,
+                                                                          datetime_resolution)
+
+            assert list(dict_time_series.keys()) == ["timestamps"] + list_specs_dummy + list_specs_other
+            assert data_extractor.find_spec("DUMMY", "MD1", "magnetic_declination") == list_specs_dummy[0]
+            assert np.sum(~np.isnan(dict_time_series[list_specs_other[0]])) == 48
+
+            for crrt_key in dict_reference:
+                np.testing.assert_array_equal(dict_time_series[crrt_key], dict_reference[crrt_key])
+
+
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.WARN)
@@ -14,6 +14,12 @@ import logging
 
 import os
 
+import time
+
+import itertools
+
+from concurrent.futures import ProcessPoolExecutor
+
 from pathlib import Path
 
 import datetime
@@ -23,30 +29,90 @@ import pickle
 
 import pprint
 
+import numpy as np
+
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.collections import LineCollection
 
-from d22_data_format.d22_parser import D22Parser
-from d22_data_format.exploration_tools import d22_global_dirs_generator
+from d22_data_format.columnar_result import datetime_to_posix, posix_to_datetime
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.exploration_tools import d22_files_in_dir_generator
 from d22_data_format.helpers.load_test_data import path_to_test_data
+from d22_data_format.helpers.raise_assert import ras
 from d22_data_format.name_lookups import list_stations_ids, dict_ids_lookup
+from d22_data_format.overview_store import OverviewStore, write_overview_store
 
-def extend_dict_metadata(dict_metadata, d22_file):
-    try:
-        dict_parsed_data = D22Parser(path_to_d22_file=d22_file).perform_parsing()
 
-        station_name = list(dict_parsed_data.keys())[0]
-        if station_name not in dict_metadata:
+def scan_block_timestamps(d22_file):
+    """The first station of d22_file, and for each of its block titles the sorted int64
+    array of the POSIX timestamps of the packages that have it. Only the package headers
+    and the block titles are read (HEADER_ONLY parsing)."""
+    station_name = None
+    dict_block_timestamps = {}
+
+    for crrt_package in D22Parser(d22_file, parsing_mode=d22_parsing_mode.HEADER_ONLY).iter_packages():
+        if station_name is None:
+            station_name = crrt_package.station_name
+
+        if crrt_package.station_name != station_name:
+            continue
+
+        crrt_timestamp = datetime_to_posix(crrt_package.utc_datetime)
+
+        for crrt_block_title in crrt_package.dict_blocks:
+            if crrt_block_title not in dict_block_timestamps:
+                dict_block_timestamps[crrt_block_title] = set()
+            dict_block_timestamps[crrt_block_title].add(crrt_timestamp)
+
+    ras(station_name is not None, "no package in {}".format(d22_file))
+
+    return (station_name, {crrt_block_title: np.array(sorted(crrt_set_timestamps), dtype=np.int64)
+                           for crrt_block_title, crrt_set_timestamps in dict_block_timestamps.items()})
+
+
+def add_block_timestamps(dict_metadata, station_name, dict_block_timestamps, log_additions=True):
+    """Add the int64 arrays of timestamps of each block title of station_name to
+    dict_metadata. While the overview is generated, "all_timestamps" is a list of arrays,
+    see concatenate_dict_metadata."""
+    if station_name not in dict_metadata:
+        if log_additions:
             logging.warning("Add new station: {}".format(station_name))
-            dict_metadata[station_name] = {}
+        dict_metadata[station_name] = {}
+
+    for crrt_header in dict_block_timestamps:
+        if crrt_header not in dict_metadata[station_name]:
+            if log_additions:
+                logging.warning("Add new header: {}".format(crrt_header))
+            dict_metadata[station_name][crrt_header] = {}
+            dict_metadata[station_name][crrt_header]["all_timestamps"] = []
+        dict_metadata[station_name][crrt_header]["all_timestamps"].append(dict_block_timestamps[crrt_header])
+
 
-        for crrt_time in dict_parsed_data[station_name]:
-            for crrt_header in dict_parsed_data[station_name][crrt_time]:
-                if crrt_header not in dict_metadata[station_name]:
-                    logging.warning("Add new header: {}".format(crrt_header))
-                    dict_metadata[station_name][crrt_header] = {}
-                    dict_metadata[station_name][crrt_header]["all_timestamps"] = []
-                dict_metadata[station_name][crrt_header]["all_timestamps"].append(crrt_time)
+def concatenate_dict_metadata(dict_metadata):
+    """Turn the lists of arrays of timestamps of dict_metadata into single int64 arrays."""
+    for crrt_station in dict_metadata:
+        for crrt_header in dict_metadata[crrt_station]:
+            crrt_header_dict = dict_metadata[crrt_station][crrt_header]
+            crrt_header_dict["all_timestamps"] = np.concatenate(crrt_header_dict["all_timestamps"]).astype(np.int64)
+
+    return dict_metadata
+
+
+def extend_dict_metadata(dict_metadata, d22_file, parsed_file_cache=None, log_additions=True):
+    """Add the block titles and timestamps of the first station of d22_file to
+    dict_metadata (see add_block_timestamps). The file is only scanned for its headers,
+    unless parsed_file_cache is given, in which case the cached parsed file is used."""
+    try:
+        if parsed_file_cache is None:
+            (station_name, dict_block_timestamps) = scan_block_timestamps(d22_file)
+        else:
+            columnar_result = parsed_file_cache.get_or_parse(d22_file)
+            station_name = columnar_result.stations()[0]
+            dict_block_timestamps = {crrt_header: columnar_result.get_block(station_name, crrt_header).timestamps
+                                     for crrt_header in columnar_result.block_titles(station_name)}
+
+        add_block_timestamps(dict_metadata, station_name, dict_block_timestamps, log_additions=log_additions)
 
     except Exception as crrt_except:
         logging.error("attempting to parse file: {}".format(d22_file))
@@ -56,25 +122,108 @@ def extend_dict_metadata(dict_metadata, d22_file):
     return dict_metadata
 
 
-def generate_datablocks_overview_dict(path_root_data=None, list_stations_subfolders=None):
-    dict_metadata = {}
+def generate_partial_datablocks_overview(list_files, parsed_file_cache=None):
+    """The overview dict of list_files only. This is a module level function so that
+    it can be used in worker processes. The timestamps are not concatenated yet."""
+    dict_partial_metadata = {}
 
-    for crrt_folder in d22_global_dirs_generator(path_root_data=path_root_data,
-                                                 list_stations_subfolders=list_stations_subfolders):
-        files = sorted([x for x in Path(crrt_folder).glob("*") if x.is_file()])
-        logging.info("found files: {}".format(files))
+    for crrt_file in list_files:
+        extend_dict_metadata(dict_partial_metadata, crrt_file, parsed_file_cache=parsed_file_cache,
+                             log_additions=False)
 
-        for crrt_file in files:
-            crrt_file = str(crrt_file)
-            if not (crrt_file[-4:] == ".d22" or crrt_file[-7:] == ".d22.gz"):
-                logging.warning("found a non d22 file: {}".format(crrt_file))
-                continue
+    return dict_partial_metadata
 
-            logging.info("get header information for {}".format(crrt_file))
-            dict_metadata = extend_dict_metadata(dict_metadata, crrt_file)
+
+def merge_dict_metadata(dict_metadata, dict_partial_metadata):
+    """Merge an overview dict of the next files into dict_metadata. Merging the
+    partial overviews of consecutive batches of files, in order, gives the same dict
+    as extending dict_metadata file by file."""
+    for crrt_station in dict_partial_metadata:
+        if crrt_station not in dict_metadata:
+            logging.warning("Add new station: {}".format(crrt_station))
+            dict_metadata[crrt_station] = {}
+
+        for crrt_header, crrt_header_dict in dict_partial_metadata[crrt_station].items():
+            if crrt_header not in dict_metadata[crrt_station]:
+                logging.warning("Add new header: {}".format(crrt_header))
+                dict_metadata[crrt_station][crrt_header] = {}
+                dict_metadata[crrt_station][crrt_header]["all_timestamps"] = []
+            dict_metadata[crrt_station][crrt_header]["all_timestamps"].extend(crrt_header_dict["all_timestamps"])
 
     return dict_metadata
 
+
+def print_overview_progress(nbr_files_done, nbr_files, time_start):
+    crrt_duration = time.perf_counter() - time_start
+    print("datablocks overview: {} / {} files, {:.1f} s, {:.1f} files/s".format(
+        nbr_files_done, nbr_files, crrt_duration, nbr_files_done / max(crrt_duration, 1.0e-9)))
+
+
+def generate_datablocks_overview_dict(path_root_data=None, list_stations_subfolders=None, parsed_file_cache=None,
+                                      archive_index=None, nbr_workers=1, nbr_files_per_task=64, print_progress=False):
+    """Go through the d22 files, and gather for each station and block title all the
+    timestamps, as an int64 array of POSIX timestamps in the order of the files. If
+    archive_index is not None, the list of the files is taken from it instead of walking
+    the archive tree.
+    With nbr_workers > 1 (None for as many as CPUs), the files are split in batches of
+    nbr_files_per_task, the batches are processed in a pool of processes, and their
+    partial overviews are merged in the order of the files, so that the dict is the same
+    as with nbr_workers = 1. If print_progress, the progress and throughput are printed
+    after each batch of files."""
+    # 1: list the d22 files
+    # 2: file by file in this process, or batch by batch in a pool of processes; merge in order
+
+    if nbr_workers is None:
+        nbr_workers = os.cpu_count()
+
+    ras(isinstance(nbr_workers, int) and nbr_workers >= 1)
+    ras(nbr_files_per_task >= 1)
+
+    # 1.
+    list_files = []
+
+    for crrt_file in d22_files_in_dir_generator(path_root_data=path_root_data,
+                                                list_stations_subfolders=list_stations_subfolders,
+                                                archive_index=archive_index):
+        crrt_file = str(crrt_file)
+        if not (crrt_file[-4:] == ".d22" or crrt_file[-7:] == ".d22.gz"):
+            logging.warning("found a non d22 file: {}".format(crrt_file))
+            continue
+
+        list_files.append(crrt_file)
+
+    # 2.
+    dict_metadata = {}
+    nbr_files = len(list_files)
+    time_start = time.perf_counter()
+
+    if nbr_workers == 1:
+        for crrt_ind, crrt_file in enumerate(list_files):
+            logging.info("get header information for {}".format(crrt_file))
+            dict_metadata = extend_dict_metadata(dict_metadata, crrt_file, parsed_file_cache=parsed_file_cache)
+
+            if print_progress and ((crrt_ind + 1) % nbr_files_per_task == 0 or crrt_ind + 1 == nbr_files):
+                print_overview_progress(crrt_ind + 1, nbr_files, time_start)
+
+    else:
+        list_batches = [list_files[crrt_start:crrt_start + nbr_files_per_task]
+                        for crrt_start in range(0, nbr_files, nbr_files_per_task)]
+        nbr_files_done = 0
+
+        with ProcessPoolExecutor(max_workers=nbr_workers) as executor:
+            for crrt_batch, dict_partial_metadata in zip(list_batches,
+                                                         executor.map(generate_partial_datablocks_overview,
+                                                                      list_batches,
+                                                                      itertools.repeat(parsed_file_cache))):
+                merge_dict_metadata(dict_metadata, dict_partial_metadata)
+                nbr_files_done += len(crrt_batch)
+
+                if print_progress:
+                    print_overview_progress(nbr_files_done, nbr_files, time_start)
+
+    return concatenate_dict_metadata(dict_metadata)
+
+
 def order_dict_metadata(dict_metadata):
     for crrt_station in dict_metadata:
         crrt_station_dict = dict_metadata[crrt_station]
@@ -82,12 +231,26 @@ def order_dict_metadata(dict_metadata):
             dict_metadata[crrt_station][crrt_header]["all_timestamps"].sort()
 
 
+def dropouts_as_datetimes(data_dropouts):
+    """The list of (start, end) UTC datetimes of an array of dropouts."""
+    return [(posix_to_datetime(crrt_start), posix_to_datetime(crrt_end))
+            for (crrt_start, crrt_end) in data_dropouts.tolist()]
+
+
 def generate_stats_on_dict_metadata(dict_metadata, print_info=False):
+    """For each station and block title of the overview dict_metadata, the first and last
+    datetimes, and the dropouts (times between consecutive packages over 2 hours).
+    Output:
+        - dict_pure_metadata: for each station and header, "first_timestamp" and
+        "last_timestamp" as UTC datetimes, and "data_dropouts" as an int64 array
+        nbr_dropouts x 2 of the POSIX timestamps of the start and end of each dropout.
+    """
     order_dict_metadata(dict_metadata)
 
     dict_pure_metadata = {}
 
     max_acceptable_data_timedelta = datetime.timedelta(hours=2.0)
+    max_acceptable_data_seconds = int(max_acceptable_data_timedelta.total_seconds())
 
     for crrt_station in dict_metadata:
         crrt_station_dict = dict_metadata[crrt_station]
@@ -97,22 +260,23 @@ def generate_stats_on_dict_metadata(dict_metadata, print_info=False):
             crrt_station_header_dict = crrt_station_dict[crrt_header]
             crrt_station_metadata_dict = dict_pure_metadata[crrt_station][crrt_header]
 
-            crrt_station_header_timestamps = crrt_station_header_dict["all_timestamps"]
-            crrt_station_header_dict["first_timestamp"] = crrt_station_header_timestamps[0]
-            crrt_station_header_dict["last_timestamp"] = crrt_station_header_timestamps[-1]
-            crrt_station_header_dict["data_dropouts"] = []
-
-            for crrt_timestamp, next_timestamp in zip(crrt_station_header_timestamps[:-1],
-                                                      crrt_station_header_timestamps[1:]):
-                if (next_timestamp - crrt_timestamp) > max_acceptable_data_timedelta:
-                    logging.warning("found a timedelta {} looking at station {}, header {}, timestamp {} to {}".format(
-                        next_timestamp - crrt_timestamp,
-                        crrt_station,
-                        crrt_header,
-                        crrt_timestamp,
-                        next_timestamp
-                    )) 
-                    crrt_station_header_dict["data_dropouts"].append((crrt_timestamp, next_timestamp))
+            crrt_station_header_timestamps = np.asarray(crrt_station_header_dict["all_timestamps"], dtype=np.int64)
+            crrt_station_header_dict["first_timestamp"] = posix_to_datetime(crrt_station_header_timestamps[0])
+            crrt_station_header_dict["last_timestamp"] = posix_to_datetime(crrt_station_header_timestamps[-1])
+
+            crrt_dropouts_indexes = np.flatnonzero(np.diff(crrt_station_header_timestamps) >
+                                                   max_acceptable_data_seconds)
+            crrt_station_header_dict["data_dropouts"] = np.stack(
+                (crrt_station_header_timestamps[crrt_dropouts_indexes],
+                 crrt_station_header_timestamps[crrt_dropouts_indexes + 1]), axis=1)
+
+            if crrt_dropouts_indexes.shape[0] > 0:
+                logging.info("found {} timedeltas over {} looking at station {}, header {}".format(
+                    crrt_dropouts_indexes.shape[0],
+                    max_acceptable_data_timedelta,
+                    crrt_station,
+                    crrt_header
+                ))
 
             crrt_station_metadata_dict["first_timestamp"] = crrt_station_header_dict["first_timestamp"]
             crrt_station_metadata_dict["last_timestamp"] = crrt_station_header_dict["last_timestamp"]
@@ -122,17 +286,33 @@ def generate_stats_on_dict_metadata(dict_metadata, print_info=False):
                 print("station {}, header {} has data from {} to {}".format(
                     crrt_station,
                     crrt_header,
-                    crrt_station_header_timestamps[0],
-                    crrt_station_header_timestamps[-1]
+                    crrt_station_header_dict["first_timestamp"],
+                    crrt_station_header_dict["last_timestamp"]
                 ))
-                if crrt_station_header_dict["data_dropouts"]:
+                if crrt_station_header_dict["data_dropouts"].shape[0] > 0:
                     print("the following dropouts were found:")
-                    for crrt_dropout in crrt_station_header_dict["data_dropouts"]:
+                    for crrt_dropout in dropouts_as_datetimes(crrt_station_header_dict["data_dropouts"]):
                         print("{} to {}".format(crrt_dropout[0], crrt_dropout[1]))
 
     return dict_pure_metadata
 
 
+def dropouts_segments(data_dropouts, y_position):
+    """The segments, in matplotlib date coordinates, showing the dropouts at height
+    y_position, as an array nbr_dropouts x 2 x 2 for a LineCollection."""
+    segments = np.empty((data_dropouts.shape[0], 2, 2))
+    segments[:, :, 0] = mdates.date2num(data_dropouts.astype("datetime64[s]"))
+    segments[:, :, 1] = y_position
+
+    return segments
+
+
+def add_dropouts_collection(ax, list_segments):
+    """Draw all the dropouts segments as a single LineCollection."""
+    if list_segments:
+        ax.add_collection(LineCollection(np.concatenate(list_segments), linewidths=3.5, colors='r', zorder=3))
+
+
 def show_summary_blocks_one_station(dict_pure_metadata, station_name):
     fig, ax = plt.subplots(nrows=1, ncols=1, figsize=(18, 5))
 
@@ -151,6 +331,7 @@ def show_summary_blocks_one_station(dict_pure_metadata, station_name):
     list_crrt_min_time = []
     list_crrt_max_time = []
     list_crrt_color = []
+    list_dropouts_segments = []
 
     for crrt_block_index, crrt_block in enumerate(sorted(dict_pure_metadata[station_name])):
         if crrt_block_index % 2 == 0:
@@ -170,9 +351,8 @@ def show_summary_blocks_one_station(dict_pure_metadata, station_name):
         plt.plot([crrt_min_time, crrt_max_time], [crrt_block_index, crrt_block_index],
                  linewidth=3.5, color=crrt_color)
 
-        for crrt_dropout in dict_pure_metadata[station_name][crrt_block]["data_dropouts"]:
-            plt.plot([crrt_dropout[0], crrt_dropout[1]], [crrt_block_index, crrt_block_index],
-                     linewidth=3.5, color='r')
+        list_dropouts_segments.append(dropouts_segments(dict_pure_metadata[station_name][crrt_block]["data_dropouts"],
+                                                        crrt_block_index))
 
         list_crrt_block_index.append(crrt_block_index)
         list_crrt_block.append(crrt_block)
@@ -180,6 +360,8 @@ def show_summary_blocks_one_station(dict_pure_metadata, station_name):
         list_crrt_max_time.append(crrt_max_time)
         list_crrt_color.append(crrt_color)
 
+    add_dropouts_collection(ax, list_dropouts_segments)
+
     location_start = global_crrt_max_time + 0.01 * (global_crrt_max_time - global_crrt_min_time)
 
     for (crrt_block_index,
@@ -227,6 +409,7 @@ def show_summary_blocks_across_stations(dict_pure_metadata, list_block_prefixes)
     list_crrt_min_time = []
     list_crrt_max_time = []
     list_crrt_color = []
+    list_dropouts_segments = []
 
     for crrt_station in dict_pure_metadata:
         crrt_list_blocks = list(dict_pure_metadata[crrt_station].keys())
@@ -269,13 +452,14 @@ def show_summary_blocks_across_stations(dict_pure_metadata, list_block_prefixes)
             list_crrt_max_time.append(crrt_max_time)
             list_crrt_color.append(crrt_color)
 
-            for crrt_dropout in dict_pure_metadata[crrt_station][crrt_block]["data_dropouts"]:
-                plt.plot([crrt_dropout[0], crrt_dropout[1]], [crrt_plotting_ind, crrt_plotting_ind],
-                         linewidth=3.5, color='r')
+            list_dropouts_segments.append(dropouts_segments(
+                dict_pure_metadata[crrt_station][crrt_block]["data_dropouts"], crrt_plotting_ind))
 
     if crrt_plotting_ind == -1:
         raise ValueError("no data to plot! Are you sure about the prefixes?")
 
+    add_dropouts_collection(ax, list_dropouts_segments)
+
     crrt_plotting_ind = -1
     crrt_used_station_ind = 0
 
@@ -332,17 +516,12 @@ if __name__ == "__main__":
         if Path("dict_metadata.pkl").is_file():
             os.remove("dict_metadata.pkl")
 
-        if Path("dict_pure_metadata.pkl").is_file():
-            os.remove("dict_pure_metadata.pkl")
-
         with open('dict_metadata.pkl', 'wb') as fh:
             pickle.dump(dict_metadata, fh, protocol=pickle.HIGHEST_PROTOCOL)
 
-        with open('dict_pure_metadata.pkl', 'wb') as fh:
-            pickle.dump(dict_pure_metadata, fh, protocol=pickle.HIGHEST_PROTOCOL)
+        write_overview_store(dict_pure_metadata, "overview_store")
 
-    with open('dict_pure_metadata.pkl', 'rb') as fh:
-        dict_pure_metadata = pickle.load(fh)
+    dict_pure_metadata = OverviewStore("overview_store").load()
 
     show_summary_blocks_one_station(dict_pure_metadata, "Gullfaks C")
     show_summary_blocks_one_station(dict_pure_metadata, "WNG")
@@ -1,8 +1,19 @@
+import os
+
+import tempfile
+
+import shutil
+
+import datetime
+import pytz
+
+import numpy as np
+
 from d22_data_format.datablocs_summary import generate_datablocks_overview_dict,\
-    generate_stats_on_dict_metadata
+    generate_stats_on_dict_metadata, dropouts_as_datetimes
 
 from d22_data_format.helpers.load_test_data import get_parsed_correct_data, \
-    path_to_test_data
+    path_to_test_data, write_dummy_d22_tree
 
 
 def test_1():
@@ -12,4 +23,50 @@ def test_1():
 
     dict_parsed = get_parsed_correct_data("datablocks_pure_metadata_AASTA.py")
 
+    # the reference has the dropouts as lists of datetimes
+    for crrt_station in dict_pure_metadata:
+        for crrt_header in dict_pure_metadata[crrt_station]:
+            crrt_header_dict = dict_pure_metadata[crrt_station][crrt_header]
+            crrt_header_dict["data_dropouts"] = dropouts_as_datetimes(crrt_header_dict["data_dropouts"])
+
     assert dict_pure_metadata == dict_parsed
+
+
+def test_parallel_same_as_serial():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=8)
+        shutil.copytree(tmpdirname + "/dummy", tmpdirname + "/other")
+
+        dict_metadata_serial = generate_datablocks_overview_dict(path_root_data=tmpdirname)
+
+        for crrt_nbr_files_per_task in [1, 3, 100]:
+            dict_metadata_parallel = generate_datablocks_overview_dict(path_root_data=tmpdirname, nbr_workers=2,
+                                                                       nbr_files_per_task=crrt_nbr_files_per_task,
+                                                                       print_progress=True)
+
+            assert list(dict_metadata_parallel) == list(dict_metadata_serial)
+            assert list(dict_metadata_parallel["DUMMY"]) == list(dict_metadata_serial["DUMMY"])
+
+            for crrt_header in dict_metadata_serial["DUMMY"]:
+                np.testing.assert_array_equal(dict_metadata_parallel["DUMMY"][crrt_header]["all_timestamps"],
+                                              dict_metadata_serial["DUMMY"][crrt_header]["all_timestamps"])
+
+        assert dict_metadata_serial["DUMMY"]["WL1"]["all_timestamps"].dtype == np.int64
+        assert len(dict_metadata_serial["DUMMY"]["WL1"]["all_timestamps"]) == 2 * 8 * 24
+
+
+def test_dropouts():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=8)
+        os.remove(tmpdirname + "/dummy/d22/2013/20130903.d22")
+
+        dict_metadata = generate_datablocks_overview_dict(path_root_data=tmpdirname)
+        dict_pure_metadata = generate_stats_on_dict_metadata(dict_metadata)
+
+        crrt_header_dict = dict_pure_metadata["DUMMY"]["WL1"]
+        assert crrt_header_dict["first_timestamp"] == datetime.datetime(2013, 9, 1, 0, 0, tzinfo=pytz.utc)
+        assert crrt_header_dict["last_timestamp"] == datetime.datetime(2013, 9, 8, 23, 0, tzinfo=pytz.utc)
+        assert crrt_header_dict["data_dropouts"].shape == (1, 2)
+        assert dropouts_as_datetimes(crrt_header_dict["data_dropouts"]) == \
+            [(datetime.datetime(2013, 9, 2, 23, 0, tzinfo=pytz.utc),
+              datetime.datetime(2013, 9, 4, 0, 0, tzinfo=pytz.utc))]
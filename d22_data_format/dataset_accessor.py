@@ -2,36 +2,75 @@ import pytz
 
 import datetime
 
-import matplotlib.pyplot as plt
+import numpy as np
 
-import cartopy
-import cartopy.crs as ccrs
-import cartopy.feature as cfeature
+import matplotlib.pyplot as plt
 
 import netCDF4 as nc4
 
-from raise_assert import ras
-from external_water_level_stations.helper.datetimes import assert_is_utc_datetime
+from d22_data_format.helpers.raise_assert import ras
+from d22_data_format.helpers.datetimes import assert_is_utc_datetime
 
-from external_water_level_stations.helper.arrays import find_index_first_greater_or_equal
+# get_data_multiple_stations reads all the stations from the first to the last requested
+# in one hyperslab, unless this is more than max_stations_span_factor times the number of
+# stations requested; the stations are then read one by one
+max_stations_span_factor = 4
 
 
 class DatasetAccessor():
-    def __init__(self, path_to_NetCDF):
+    def __init__(self, path_to_NetCDF, keep_open=False):
+        """Input:
+            - path_to_NetCDF: the NetCDF4 file to access.
+            - keep_open: if True, the file is kept open between the queries (call close(),
+            or use as a context manager, when done). Else (default), the file is opened
+            at each query.
+        The time axis is read once and cached, and the queries only read the data in the
+        time range from the file."""
         self.path_to_NetCDF = path_to_NetCDF
+        self.keep_open = keep_open
+        self.nc4_fh = None
+
+        if self.keep_open:
+            self.nc4_fh = nc4.Dataset(self.path_to_NetCDF, "r", format="NETCDF4")
+
         self.dict_metadata = self.get_dict_stations_metadata()
 
+    def open_dataset(self):
+        """The open dataset if keep_open, else a newly opened dataset, to use as a context
+        manager (the dataset kept open is not closed when leaving the context)."""
+        if self.nc4_fh is not None:
+            return KeptOpenDataset(self.nc4_fh)
+
+        return nc4.Dataset(self.path_to_NetCDF, "r", format="NETCDF4")
+
+    def close(self):
+        if self.nc4_fh is not None:
+            self.nc4_fh.close()
+            self.nc4_fh = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
     def get_dict_stations_metadata(self):
         dict_stations_metadata = {}
 
-        with nc4.Dataset(self.path_to_NetCDF, "r", format="NETCDF4") as nc4_fh:
+        with self.open_dataset() as nc4_fh:
             self.station_ids = nc4_fh["stationid"][:]
             self.number_of_stations = len(self.station_ids)
 
+            # the time axis, cached as an int64 array
+            self.timestamps = np.asarray(nc4_fh["timestamps"][:], dtype=np.int64)
+
+            array_lats = nc4_fh["latitude"][:]
+            array_lons = nc4_fh["longitude"][:]
+
             for crrt_ind in range(self.number_of_stations):
-                crrt_station_id = nc4_fh["stationid"][crrt_ind]
-                crrt_lat = nc4_fh["latitude"][crrt_ind]
-                crrt_lon = nc4_fh["longitude"][crrt_ind]
+                crrt_station_id = self.station_ids[crrt_ind]
+                crrt_lat = array_lats[crrt_ind]
+                crrt_lon = array_lons[crrt_ind]
 
                 crrt_dict_metadata = {}
                 crrt_dict_metadata["station_index"] = crrt_ind
@@ -49,6 +88,10 @@ class DatasetAccessor():
 
     def visualize_station_positions(self):
         """Visualize the position of the stations."""
+        # cartopy is only needed for the map
+        import cartopy
+        import cartopy.crs as ccrs
+        import cartopy.feature as cfeature
 
         # The data to plot are defined in lat/lon coordinate system, so PlateCarree()
         # is the appropriate choice of coordinate reference system:
@@ -145,25 +188,112 @@ class DatasetAccessor():
             - data_prediction: the prediction.
         """
 
-        ras(station_id in self.station_ids)
+        ras(station_id in self.dict_metadata)
         assert_is_utc_datetime(datetime_start)
         assert_is_utc_datetime(datetime_end)
         ras(datetime_start <= datetime_end)
 
         nc4_index = self.dict_metadata[station_id]["station_index"]
 
-        timestamp_start = datetime_start.timestamp()
-        timestamp_end = datetime_end.timestamp()
-
-        with nc4.Dataset(self.path_to_NetCDF, "r", format="NETCDF4") as nc4_fh:
-            data_timestamp_full = nc4_fh["timestamps"][:]
-            data_observation_full = nc4_fh["observation"][nc4_index][:]
+        first_index, last_index = self.time_range_indexes(datetime_start, datetime_end)
 
-        first_index = find_index_first_greater_or_equal(data_timestamp_full, timestamp_start)
-        last_index = find_index_first_greater_or_equal(data_timestamp_full, timestamp_end) + 1
+        # only the hyperslab of the station over the time range is read
+        with self.open_dataset() as nc4_fh:
+            data_observation = nc4_fh["observation"][nc4_index, first_index:last_index]
 
         data_datetime = [datetime.datetime.fromtimestamp(crrt_timestamp, pytz.utc) for
-                         crrt_timestamp in data_timestamp_full[first_index:last_index]]
-        data_observation = data_observation_full[first_index:last_index]
+                         crrt_timestamp in self.timestamps[first_index:last_index].tolist()]
 
         return(data_datetime, data_observation)
+
+    def get_data_multiple_stations(self, list_station_ids, time_windows, as_datetime64=False):
+        """Get the data of several stations over one or several time windows, as arrays.
+        For each window, the rows of all the stations are read as a single hyperslab,
+        from the first to the last station requested (unless these are far apart, see
+        max_stations_span_factor), and the stations are then selected in memory.
+        Input:
+            - list_station_ids: the station IDs
+            - time_windows: a (datetime_start, datetime_end) tuple, or a list of such tuples,
+            the limits of the extracted data (both included).
+            - as_datetime64: if True, give the times as a datetime64[s] array, else as an
+            int64 array of POSIX timestamps.
+        Output:
+            - for a single window, (data_times, data_observations), with data_observations
+            an array stations x times; for a list of windows, the list of these for each window.
+        """
+        single_window = isinstance(time_windows, tuple)
+
+        if single_window:
+            time_windows = [time_windows]
+
+        for crrt_station_id in list_station_ids:
+            ras(crrt_station_id in self.dict_metadata)
+
+        for (crrt_datetime_start, crrt_datetime_end) in time_windows:
+            assert_is_utc_datetime(crrt_datetime_start)
+            assert_is_utc_datetime(crrt_datetime_end)
+            ras(crrt_datetime_start <= crrt_datetime_end)
+
+        # the station indexes are read in increasing order, and put back in the requested order
+        array_station_indexes = np.array([self.dict_metadata[crrt_station_id]["station_index"]
+                                          for crrt_station_id in list_station_ids], dtype=np.int64)
+        sorted_station_indexes, inverse_indexes = np.unique(array_station_indexes, return_inverse=True)
+
+        if sorted_station_indexes.shape[0] > 0:
+            first_station_index = int(sorted_station_indexes[0])
+            last_station_index = int(sorted_station_indexes[-1]) + 1
+            # else, reading the stations in between would cost more than one read per station
+            read_as_slab = last_station_index - first_station_index <= \
+                max_stations_span_factor * sorted_station_indexes.shape[0]
+
+        list_results = []
+
+        with self.open_dataset() as nc4_fh:
+            for (crrt_datetime_start, crrt_datetime_end) in time_windows:
+                first_index, last_index = self.time_range_indexes(crrt_datetime_start, crrt_datetime_end)
+
+                if len(list_station_ids) == 0 or first_index == last_index:
+                    data_observations = np.empty((len(list_station_ids), last_index - first_index),
+                                                 dtype=nc4_fh["observation"].dtype)
+                elif read_as_slab:
+                    data_observations = nc4_fh["observation"][first_station_index:last_station_index,
+                                                              first_index:last_index]
+                    data_observations = data_observations[sorted_station_indexes - first_station_index]
+                    data_observations = data_observations[inverse_indexes.reshape(-1)]
+                else:
+                    # netCDF4 reads the rows one by one
+                    data_observations = nc4_fh["observation"][sorted_station_indexes, first_index:last_index]
+                    data_observations = data_observations[inverse_indexes.reshape(-1)]
+
+                data_times = self.timestamps[first_index:last_index]
+
+                if as_datetime64:
+                    data_times = data_times.astype("datetime64[s]")
+
+                list_results.append((data_times, data_observations))
+
+        if single_window:
+            return list_results[0]
+
+        return list_results
+
+    def time_range_indexes(self, datetime_start, datetime_end):
+        """The slice first_index:last_index of the time axis that is within
+        [datetime_start; datetime_end], from the cached time axis."""
+        first_index = int(np.searchsorted(self.timestamps, datetime_start.timestamp(), side="left"))
+        last_index = int(np.searchsorted(self.timestamps, datetime_end.timestamp(), side="right"))
+
+        return (first_index, last_index)
+
+
+class KeptOpenDataset():
+    """Context manager giving a dataset that is kept open, without closing it on exit."""
+
+    def __init__(self, nc4_fh):
+        self.nc4_fh = nc4_fh
+
+    def __enter__(self):
+        return self.nc4_fh
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
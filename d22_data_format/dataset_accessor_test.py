@@ -0,0 +1,99 @@
+import datetime
+import pytz
+
+import tempfile
+
+import numpy as np
+
+import d22_data_format.dataset_accessor as dataset_accessor_module
+from d22_data_format.dataset_accessor import DatasetAccessor
+from d22_data_format.netcdf_writer import TimeSeriesNetCDFWriter
+
+
+def test_get_data():
+    list_station_ids = ["heimdal", "draugen", "sleipner"]
+    timestamps = 1.0e9 + 600 * np.arange(1000, dtype=np.int64)
+    observations = np.random.RandomState(0).rand(3, 1000)
+    observations[1, 100:200] = np.nan
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_to_NetCDF = tmpdirname + "/dataset.nc4"
+
+        with TimeSeriesNetCDFWriter(path_to_NetCDF, list_station_ids, list_latitudes=[59.6, 64.4, 58.4],
+                                    list_longitudes=[2.2, 7.8, 1.9], time_chunk_size=64) as netcdf_writer:
+            netcdf_writer.append(timestamps[:500], observations[:, :500])
+            netcdf_writer.append(timestamps[500:], observations[:, 500:])
+
+        for crrt_keep_open in [False, True]:
+            with DatasetAccessor(path_to_NetCDF, keep_open=crrt_keep_open) as dataset_accessor:
+                assert list(dataset_accessor.station_ids) == list_station_ids
+                assert dataset_accessor.dict_metadata["draugen"]["station_index"] == 1
+                assert np.float32(dataset_accessor.dict_metadata["draugen"]["latitude"]) == np.float32(64.4)
+
+                # a range on the time base, and a range between the times of the time base
+                for (crrt_offset_start, crrt_offset_end) in [(0, 0), (300, 300)]:
+                    datetime_start = datetime.datetime.fromtimestamp(timestamps[150] - crrt_offset_start, pytz.utc)
+                    datetime_end = datetime.datetime.fromtimestamp(timestamps[620] + crrt_offset_end, pytz.utc)
+
+                    for ind, crrt_station_id in enumerate(list_station_ids):
+                        data_datetime, data_observation = dataset_accessor.get_data(crrt_station_id, datetime_start,
+                                                                                    datetime_end)
+
+                        assert data_datetime[0] == datetime.datetime.fromtimestamp(timestamps[150], pytz.utc)
+                        assert data_datetime[-1] == datetime.datetime.fromtimestamp(timestamps[620], pytz.utc)
+
+                        expected_observation = observations[ind, 150:621].astype(np.float32)
+                        expected_observation[np.isnan(expected_observation)] = 1.0e37
+                        np.testing.assert_array_equal(data_observation, expected_observation)
+
+
+def test_get_data_multiple_stations():
+    list_station_ids = ["heimdal", "draugen", "sleipner", "heidrun"]
+    timestamps = 1.0e9 + 600 * np.arange(1000, dtype=np.int64)
+    observations = np.random.RandomState(0).rand(4, 1000)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_to_NetCDF = tmpdirname + "/dataset.nc4"
+
+        with TimeSeriesNetCDFWriter(path_to_NetCDF, list_station_ids, time_chunk_size=64) as netcdf_writer:
+            netcdf_writer.append(timestamps, observations)
+
+        with DatasetAccessor(path_to_NetCDF, keep_open=True) as dataset_accessor:
+            list_index_ranges = [(0, 999), (10, 20), (500, 500)]
+            list_windows = [(datetime.datetime.fromtimestamp(timestamps[crrt_start], pytz.utc),
+                             datetime.datetime.fromtimestamp(timestamps[crrt_end], pytz.utc))
+                            for (crrt_start, crrt_end) in list_index_ranges]
+            list_requested = ["sleipner", "heimdal", "sleipner"]
+
+            list_results = dataset_accessor.get_data_multiple_stations(list_requested, list_windows)
+
+            for (data_times, data_observations), (crrt_start, crrt_end), crrt_window in \
+                    zip(list_results, list_index_ranges, list_windows):
+                assert data_times.dtype == np.int64
+                np.testing.assert_array_equal(data_times, timestamps[crrt_start:crrt_end + 1])
+                assert data_observations.shape == (3, crrt_end + 1 - crrt_start)
+
+                for ind, crrt_station_id in enumerate(list_requested):
+                    _, data_observation = dataset_accessor.get_data(crrt_station_id, *crrt_window)
+                    np.testing.assert_array_equal(data_observations[ind], data_observation)
+
+            data_times, data_observations = dataset_accessor.get_data_multiple_stations(
+                ["draugen"], list_windows[1], as_datetime64=True)
+            assert data_times[0] == np.datetime64(int(timestamps[10]), "s")
+            assert data_observations.shape == (1, 11)
+
+            # stations far apart, read one by one
+            data_times, data_observations = dataset_accessor.get_data_multiple_stations(
+                ["heidrun", "heimdal"], list_windows[1])
+            max_stations_span_factor = dataset_accessor_module.max_stations_span_factor
+
+            try:
+                dataset_accessor_module.max_stations_span_factor = 1
+                data_times_rows, data_observations_rows = dataset_accessor.get_data_multiple_stations(
+                    ["heidrun", "heimdal"], list_windows[1])
+            finally:
+                dataset_accessor_module.max_stations_span_factor = max_stations_span_factor
+
+            np.testing.assert_array_equal(data_times_rows, data_times)
+            np.testing.assert_array_equal(data_observations_rows, data_observations)
+            np.testing.assert_array_equal(data_observations[0], observations[3, 10:21].astype(np.float32))
@@ -8,12 +8,33 @@ from d22_data_format.helpers.folders_navigation import get_sorted_subfolders
 from d22_data_format.helpers.raise_assert import ras
 
 
-def d22_files_in_dir_generator(path_root_data=None, list_stations_subfolders=None):
+def d22_files_in_dir_generator(path_root_data=None, list_stations_subfolders=None, archive_index=None,
+                               datetime_start=None, datetime_end=None):
+    """A generator for the d22 files, in the order of d22_global_dirs_generator.
+    Input:
+        - path_root_data, list_stations_subfolders: as d22_global_dirs_generator.
+        - archive_index: if not None, an ArchiveIndex (for the same path_root_data)
+        to take the files from, instead of walking the archive tree.
+        - datetime_start, datetime_end: with an archive_index, only the files that
+        may have packages within [datetime_start; datetime_end].
+    Output:
+        - The files, as Path, as a generator.
+    """
+    if archive_index is not None:
+        for crrt_entry in archive_index.files(folder=list_stations_subfolders,
+                                              datetime_start=datetime_start,
+                                              datetime_end=datetime_end):
+            yield Path(crrt_entry.path)
+        return
+
+    ras(datetime_start is None and datetime_end is None, "selecting files by time needs an archive_index")
+
     for crrt_folder in d22_global_dirs_generator(path_root_data, list_stations_subfolders):
         files = sorted([x for x in Path(crrt_folder).glob("*") if x.is_file()])
         for crrt_file in files:
             yield crrt_file
 
+
 def d22_global_dirs_generator(path_root_data=None, list_stations_subfolders=None):
     """A generator for the global dirs where d22 data are contained.
     Input:
@@ -12,29 +12,26 @@ import logging
 from d22_data_format.helpers.raise_assert import ras
 
 
-def hampel(x, k, t0=3, use_tqdm=False):
+def hampel(x, k, t0=3, use_tqdm=False, implementation="windows"):
     '''adapted from hampel function in R package pracma
     x= 1-d numpy array of numbers to be filtered
     k= number of items in (window-1)/2 (# forward and backward wanted to capture in median filter)
     t0= number of standard deviations to use; 3 is default
+    implementation= "windows" (default) works on blocks of windows at once, "loop" is the original
+    sample by sample loop; both give the same output and mask
     '''
     # NOTE: this is adapted from: https://stackoverflow.com/questions/46819260/
     # filtering-outliers-how-to-make-median-based-hampel-function-faster
 
     ras(isinstance(x, np.ndarray))
     ras(isinstance(k, int))
+    ras(implementation in ["windows", "loop"])
 
     y = np.copy(x)  # y is the corrected series
 
     y = np.squeeze(y)
     ras(len(y.shape) == 1)
 
-    mask_modified = np.zeros((y.shape[0]), dtype=bool)
-
-    n = y.shape[0]
-
-    L = 1.4826
-
     if use_tqdm:
         wrapper = tqdm.tqdm
     else:
@@ -42,6 +39,20 @@ def hampel(x, k, t0=3, use_tqdm=False):
             return it
         wrapper = nop
 
+    if implementation == "loop":
+        return hampel_loop(y, k, t0, wrapper)
+    else:
+        return hampel_windows(y, k, t0, wrapper)
+
+
+def hampel_loop(y, k, t0, wrapper):
+    """The sample by sample hampel; y is modified in place."""
+    mask_modified = np.zeros((y.shape[0]), dtype=bool)
+
+    n = y.shape[0]
+
+    L = 1.4826
+
     for i in wrapper(range((k + 1), (n - k))):
         excluding_crrt_point = np.concatenate((
             y[(i - k):(i)],
@@ -66,6 +77,147 @@ def hampel(x, k, t0=3, use_tqdm=False):
     return (y, mask_modified)
 
 
+def sorted_rows_nanmedian(sorted_rows, nbr_valid):
+    """The median of each row of a 2d array sorted along its rows, with nbr_valid
+    values that are not NaN at the start of each row (as after np.sort). Same as
+    np.nanmedian on each row, NaN if there is no valid value."""
+    ind_low = np.maximum(nbr_valid - 1, 0) // 2
+    ind_high = nbr_valid // 2
+
+    low = np.take_along_axis(sorted_rows, ind_low[:, None], axis=1)[:, 0]
+    high = np.take_along_axis(sorted_rows, np.minimum(ind_high, sorted_rows.shape[1] - 1)[:, None], axis=1)[:, 0]
+
+    return np.where(nbr_valid > 0, (low + high) / 2, np.nan)
+
+
+def sorted_rows_median_abs_deviation(sorted_rows, nbr_valid, x0):
+    """The median of the absolute deviations to x0 of each row of a 2d array sorted
+    along its rows (with nbr_valid values that are not NaN at the start of each row),
+    x0 being the median of the row. Same as np.nanmedian(np.abs(row - x0)).
+
+    The deviations to the median are two sorted sequences: x0 - row[p - 1 - i] on the
+    left and row[p + j] - x0 on the right of p = nbr_valid // 2, so their order
+    statistics are found by binary search, instead of sorting the deviations."""
+    nbr_rows = sorted_rows.shape[0]
+    p = nbr_valid // 2
+    nbr_right = nbr_valid - p
+
+    # the two middle order statistics, for all the rows at once
+    rows = np.concatenate((np.arange(nbr_rows), np.arange(nbr_rows)))
+    kth = np.concatenate((np.maximum(nbr_valid - 1, 0) // 2, nbr_valid // 2))
+    p = np.concatenate((p, p))
+    nbr_right = np.concatenate((nbr_right, nbr_right))
+    x0 = np.concatenate((x0, x0))
+
+    def left(ind):
+        return x0 - sorted_rows[rows, np.maximum(p - 1 - ind, 0)]
+
+    def right(ind):
+        return sorted_rows[rows, np.minimum(p + ind, sorted_rows.shape[1] - 1)] - x0
+
+    # the number of deviations from the left among the kth + 1 smallest: the first i
+    # for which the next left deviation is not smaller than the last right one
+    ind_min = np.maximum(0, kth + 1 - nbr_right)
+    ind_max = np.minimum(kth + 1, p)
+
+    while True:
+        to_search = ind_min < ind_max
+        if not to_search.any():
+            break
+
+        ind_mid = (ind_min + ind_max) // 2
+        take_more_left = np.logical_and(to_search, left(ind_mid) < right(kth - ind_mid))
+        ind_min = np.where(take_more_left, ind_mid + 1, ind_min)
+        ind_max = np.where(np.logical_and(to_search, ~take_more_left), ind_mid, ind_max)
+
+    last_left = np.where(ind_min > 0, left(ind_min - 1), -np.inf)
+    last_right = np.where(kth - ind_min >= 0, right(kth - ind_min), -np.inf)
+    order_statistics = np.maximum(last_left, last_right)
+
+    return np.where(nbr_valid > 0, (order_statistics[:nbr_rows] + order_statistics[nbr_rows:]) / 2, np.nan)
+
+
+def hampel_windows(y, k, t0, wrapper, max_nbr_elements_block=2**18):
+    """Same as hampel_loop, but computing the medians on blocks of windows at once.
+    y is modified in place.
+
+    In the loop, the left half of each window already contains the samples removed
+    before, so the samples are not independent. Each block of samples is computed
+    assuming that the previous decisions in the block are right, and the samples
+    whose left half window changed are computed again, until nothing changes. This
+    is the same as the loop: the first sample of the block has its final window, and
+    each round fixes at least one more sample. Outliers are sparse, so a block
+    usually needs a couple of rounds only."""
+    x = np.copy(y)
+    mask_modified = np.zeros((y.shape[0]), dtype=bool)
+
+    n = y.shape[0]
+
+    L = 1.4826
+
+    if n - k <= k + 1:
+        return (y, mask_modified)
+
+    # views on all the half windows of size k
+    windows_view_y = np.lib.stride_tricks.sliding_window_view(y, k)
+    windows_view_x = np.lib.stride_tricks.sliding_window_view(x, k)
+
+    block_size = max(1, max_nbr_elements_block // (2 * k))
+
+    # reused between the blocks, to avoid allocating a large array each time
+    buffer_windows = np.empty((block_size, 2 * k))
+
+    def compute_is_removed(indexes):
+        # a sample is removed if its window is all NaN, or if it is an outlier
+        windows = buffer_windows[:indexes.shape[0]]
+        windows[:, :k] = windows_view_y[indexes - k]
+        windows[:, k:] = windows_view_x[indexes + 1]
+
+        # the NaNs are sorted last
+        windows.sort(axis=1)
+        nbr_valid = 2 * k - np.count_nonzero(np.isnan(windows), axis=1)
+        x0 = sorted_rows_nanmedian(windows, nbr_valid)
+
+        S0 = L * sorted_rows_median_abs_deviation(windows, nbr_valid, x0)
+
+        with np.errstate(invalid="ignore"):
+            is_outlier = np.abs(x[indexes] - x0) > t0 * S0
+
+        is_all_nan = nbr_valid == 0
+
+        return (np.logical_or(is_all_nan, is_outlier), np.logical_and(~is_all_nan, is_outlier))
+
+    list_blocks_start = list(range(k + 1, n - k, block_size))
+
+    for crrt_block_start in wrapper(list_blocks_start):
+        crrt_block_end = min(crrt_block_start + block_size, n - k)
+        # only the samples that are not NaN can be changed
+        indexes_to_compute = crrt_block_start + np.flatnonzero(~np.isnan(x[crrt_block_start:crrt_block_end]))
+
+        while indexes_to_compute.shape[0] > 0:
+            is_removed, is_outlier = compute_is_removed(indexes_to_compute)
+            mask_modified[indexes_to_compute] = is_outlier
+
+            is_changed = is_removed != np.isnan(y[indexes_to_compute])
+            indexes_changed = indexes_to_compute[is_changed]
+
+            if indexes_changed.shape[0] == 0:
+                break
+
+            y[indexes_changed] = np.where(is_removed[is_changed], np.nan, x[indexes_changed])
+
+            # the samples with a changed sample in their left half window
+            is_to_compute = np.zeros((crrt_block_end - crrt_block_start + k + 1,), dtype=np.int64)
+            np.add.at(is_to_compute, indexes_changed - crrt_block_start + 1, 1)
+            np.add.at(is_to_compute, indexes_changed - crrt_block_start + k + 1, -1)
+            is_to_compute = np.cumsum(is_to_compute)[:crrt_block_end - crrt_block_start] > 0
+            is_to_compute[np.isnan(x[crrt_block_start:crrt_block_end])] = False
+
+            indexes_to_compute = crrt_block_start + np.flatnonzero(is_to_compute)
+
+    return (y, mask_modified)
+
+
 def three_stages_hampel(array_in, datetime_resolution, use_tqdm=True):
     ras(isinstance(array_in, np.ndarray))
 
@@ -89,11 +241,20 @@ def three_stages_hampel(array_in, datetime_resolution, use_tqdm=True):
 
 
 def interpolate_short_dropouts(array_in, max_nbr_dropout_points=3, use_tqdm=False):
+    """Interpolate the NaN points that have a valid point at most max_nbr_dropout_points
+    before and after them (and are not too close to the edges), from the valid points
+    within 2 * max_nbr_dropout_points + 1 around them. Linear interpolation if
+    max_nbr_dropout_points < 4, else quadratic.
+
+    The interpolated value is a linear combination of the valid points around, with
+    weights that only depend on which points around are valid. So the NaN points are
+    grouped by pattern of valid points around them, the weights are computed once per
+    pattern, and all the points of a group are interpolated at once."""
     crrt_array = np.copy(array_in)
     crrt_array_interpolated = np.copy(array_in)
 
-    # find the points where dropout
-    indexes_nan = np.where(np.isnan(crrt_array))[0]
+    nbr_points = crrt_array.shape[0]
+    half_width = max_nbr_dropout_points
 
     if max_nbr_dropout_points < 4:
         kind_interp = "linear"
@@ -107,49 +268,73 @@ def interpolate_short_dropouts(array_in, max_nbr_dropout_points=3, use_tqdm=Fals
             return it
         wrapper = nop
 
-    # if nbr of consecutive points with dropout < max_nbr_dropout_points in both
-    # directions, interpolate using 
-    for crrt_index in wrapper(indexes_nan):
-        if crrt_index >= max_nbr_dropout_points + 1 and crrt_index <= crrt_array.shape[0] - max_nbr_dropout_points - 2:
-            if (not np.isnan(crrt_array[crrt_index - max_nbr_dropout_points: crrt_index]).all()) and \
-                    (not np.isnan(crrt_array[crrt_index: crrt_index + max_nbr_dropout_points + 1]).all()):
-                # build array not nan values and indexes
-                list_valid_indexes = []
-                list_valid_values = []
-                list_invalid_indexes = []
-
-                for crrt_interp_index in range(crrt_index - 2 * max_nbr_dropout_points - 1,
-                                               crrt_index - max_nbr_dropout_points - 1):
-                    if crrt_interp_index >= 0 and not np.isnan(crrt_array[crrt_interp_index]):
-                        list_valid_indexes.append(crrt_interp_index)
-                        list_valid_values.append(crrt_array[crrt_interp_index])
-
-                for crrt_interp_index in range(crrt_index - max_nbr_dropout_points - 1,
-                                               crrt_index + max_nbr_dropout_points + 1):
-                    if not np.isnan(crrt_array[crrt_interp_index]):
-                        list_valid_indexes.append(crrt_interp_index)
-                        list_valid_values.append(crrt_array[crrt_interp_index])
-                    else:
-                        list_invalid_indexes.append(crrt_interp_index)
-
-                for crrt_interp_index in range(crrt_index + max_nbr_dropout_points + 1,
-                                               crrt_index + 2 * max_nbr_dropout_points + 1):
-                    if crrt_interp_index < crrt_array.shape[0] and not np.isnan(crrt_array[crrt_interp_index]):
-                        list_valid_indexes.append(crrt_interp_index)
-                        list_valid_values.append(crrt_array[crrt_interp_index])
-
-                try:
-                    # interpolate
-                    interpolator = interpolate.interp1d(np.array(list_valid_indexes),
-                                                        np.array(list_valid_values),
-                                                        kind=kind_interp)
-
-                    crrt_array_interpolated[crrt_index] = interpolator(np.array([crrt_index]))
-
-                except Exception as e:
-                    logging.warning("encountered a problem interpolating index {} of current array".format(crrt_index))
-                    logging.warning("exception content:")
-                    logging.warning(str(e))
+    # 1. the NaN points, not too close to the edges
+    # 2. keep the ones with a valid point at most max_nbr_dropout_points before and after
+    # 3. the pattern of valid points around each of them
+    # 4. interpolate, one pattern at a time
+
+    # 1.
+    is_nan = np.isnan(crrt_array)
+    indexes_valid = np.flatnonzero(~is_nan)
+    indexes_nan = np.flatnonzero(is_nan)
+    indexes_nan = indexes_nan[np.logical_and(indexes_nan >= half_width + 1,
+                                             indexes_nan <= nbr_points - half_width - 2)]
+
+    if indexes_nan.shape[0] == 0 or indexes_valid.shape[0] == 0:
+        return crrt_array_interpolated
+
+    # 2.
+    position_next_valid = np.searchsorted(indexes_valid, indexes_nan)
+    previous_valid = indexes_valid[np.maximum(position_next_valid - 1, 0)]
+    next_valid = indexes_valid[np.minimum(position_next_valid, indexes_valid.shape[0] - 1)]
+
+    is_short_dropout = np.logical_and.reduce((
+        position_next_valid > 0,
+        previous_valid >= indexes_nan - half_width,
+        position_next_valid < indexes_valid.shape[0],
+        next_valid <= indexes_nan + half_width,
+    ))
+    indexes_nan = indexes_nan[is_short_dropout]
+
+    if indexes_nan.shape[0] == 0:
+        return crrt_array_interpolated
+
+    # 3.
+    offsets_around = np.arange(-2 * half_width - 1, 2 * half_width + 1)
+    indexes_around = indexes_nan[:, None] + offsets_around
+    is_inside = np.logical_and(indexes_around >= 0, indexes_around < nbr_points)
+    indexes_around = np.clip(indexes_around, 0, nbr_points - 1)
+    is_valid_around = np.logical_and(is_inside, ~is_nan[indexes_around])
+
+    # a code per pattern, with a bit per point around, to group the NaN points quickly
+    if offsets_around.shape[0] <= 62:
+        pattern_codes = is_valid_around.astype(np.int64) @ (1 << np.arange(offsets_around.shape[0], dtype=np.int64))
+    else:
+        pattern_codes = np.unique(is_valid_around, axis=0, return_inverse=True)[1].reshape(-1)
+
+    (_, pattern_of_nan, nbr_nan_per_pattern) = np.unique(pattern_codes, return_inverse=True, return_counts=True)
+    rows_by_pattern = np.split(np.argsort(pattern_of_nan.reshape(-1), kind="stable"),
+                               np.cumsum(nbr_nan_per_pattern)[:-1])
+
+    # 4.
+    for crrt_rows in wrapper(rows_by_pattern):
+        crrt_pattern = is_valid_around[crrt_rows[0]]
+        crrt_offsets = offsets_around[crrt_pattern]
+
+        try:
+            # the weight of each valid point around, as the interpolation of the unit vectors
+            interpolator = interpolate.interp1d(crrt_offsets, np.eye(crrt_offsets.shape[0]),
+                                                kind=kind_interp, axis=0)
+            crrt_weights = interpolator(0.0)
+
+            crrt_array_interpolated[indexes_nan[crrt_rows]] = \
+                crrt_array[indexes_around[crrt_rows][:, crrt_pattern]] @ crrt_weights
+
+        except Exception as e:
+            logging.warning("encountered a problem interpolating indexes {} of current array".format(
+                indexes_nan[crrt_rows]))
+            logging.warning("exception content:")
+            logging.warning(str(e))
 
     return crrt_array_interpolated
 
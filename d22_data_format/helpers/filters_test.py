@@ -7,6 +7,26 @@ def test_hampel_1():
     _ = filters.hampel(array_in, 12, t0=3)
 
 
+def test_hampel_windows_same_as_loop():
+    random_generator = np.random.default_rng(seed=0)
+
+    for crrt_k in [1, 3, 12, 40]:
+        array_in = np.cumsum(random_generator.standard_normal(2000))
+        # outliers, including some in a row, dropouts, a long dropout, and ties
+        array_in[random_generator.random(2000) < 0.05] += 20.0
+        array_in[500:510] = -30.0
+        array_in[random_generator.random(2000) < 0.1] = np.nan
+        array_in[1000:1000 + 3 * crrt_k] = np.nan
+        array_in[1500:] = np.round(array_in[1500:])
+
+        (array_loop, mask_loop) = filters.hampel(array_in, crrt_k, t0=3, implementation="loop")
+        (array_windows, mask_windows) = filters.hampel(array_in, crrt_k, t0=3, implementation="windows")
+
+        assert np.array_equal(array_loop, array_windows, equal_nan=True)
+        assert np.array_equal(mask_loop, mask_windows)
+        assert mask_windows.any()
+
+
 def test_interpolate_short_dropouts_1():
     array_in = np.array([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0])
     array_right = np.copy(array_in)
@@ -52,6 +72,16 @@ def test_interpolate_short_dropouts_4():
 
     assert np.allclose(array_out, array_right, equal_nan=True)
 
+def test_interpolate_short_dropouts_quadratic():
+    array_in = np.arange(30.0)**2
+    array_right = np.copy(array_in)
+    array_in[[10, 11, 14, 20, 21, 22, 23, 24, 25]] = np.nan
+    array_right[[20, 21, 24, 25]] = np.nan
+
+    array_out = filters.interpolate_short_dropouts(array_in, max_nbr_dropout_points=4)
+
+    assert np.allclose(array_out, array_right, equal_nan=True)
+
 
 if __name__ == "__main__":
     test_interpolate_short_dropouts_1()
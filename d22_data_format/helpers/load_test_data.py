@@ -21,3 +21,25 @@ def get_parsed_correct_data(parsed_data_pyname):
     exec(open(full_path).read(), globals())
 
     return(dict_parsed)
+
+
+def write_dummy_d22_tree(path_root_data, nbr_days=4):
+    """Write a small d22 tree with a station folder "dummy", holding nbr_days
+    daily files with 1 package every hour, and 1 file cut in the middle of a package."""
+    path_d22 = path_root_data + "/dummy/d22/2013/"
+    os.makedirs(path_d22)
+
+    for crrt_day in range(1, nbr_days + 1):
+        list_lines = []
+        for crrt_hour in range(24):
+            list_lines += ["!!!!", "DF022 1", "DUMMY ", "{:02}-09-2013".format(crrt_day), "{:02}:00".format(crrt_hour),
+                           "\fMD1-2", "{:.2f}".format(crrt_day + crrt_hour / 100.0),
+                           "\fWL1-5", "56.72", "{:.2f}".format(-crrt_hour), "55.8", "57.51",
+                           "\f$$$$$$$"]
+
+        with open(path_d22 + "201309{:02}.d22".format(crrt_day), "w", encoding="latin-1") as crrt_fh:
+            crrt_fh.write("\n".join(list_lines) + "\n")
+
+    with open(path_d22 + "201309{:02}.d22".format(nbr_days + 1), "w", encoding="latin-1") as crrt_fh:
+        crrt_fh.write("\n".join(["!!!!", "DF022 1", "DUMMY ", "{:02}-09-2013".format(nbr_days + 1), "00:00",
+                                 "\fMD1-2"]) + "\n")
@@ -1,40 +1,383 @@
+import io
+import array
+import bisect
+import os
 import logging
-import gzip
+import codecs
+import collections
+import mmap
+import queue
+import threading
+import zlib
+
+import numpy as np
+
+# the size of the chunks read from the files: large enough that the per chunk python
+# overhead is negligible, small enough that a few chunks in flight do not use much memory
+default_chunk_size = 2**20
+
+
+def is_gz_file(path_to_file, automatic_gzip_recognition=True):
+    """If the file should be read as a gz file."""
+    return automatic_gzip_recognition and str(path_to_file)[-3:] == ".gz"
+
+
+def iter_gz_chunks(path_to_file, chunk_size=default_chunk_size):
+    """Yield the decompressed content of a gz file as bytes chunks, decompressing chunk_size
+    bytes of compressed data at a time. Several gz members one after the other are
+    decompressed one after the other, as gzip.open does."""
+    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    member_started = False
+
+    with open(str(path_to_file), "rb") as crrt_fh:
+        while True:
+            compressed_chunk = crrt_fh.read(chunk_size)
+
+            if not compressed_chunk:
+                break
+
+            while compressed_chunk:
+                member_started = True
+                decompressed_chunk = decompressor.decompress(compressed_chunk)
+
+                if decompressed_chunk:
+                    yield decompressed_chunk
+
+                if decompressor.eof:
+                    # start of the next member, if any
+                    compressed_chunk = decompressor.unused_data
+                    decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+                    member_started = False
+                else:
+                    compressed_chunk = b""
+
+    if member_started:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached: {}".format(path_to_file))
+
+
+def iter_plain_chunks(path_to_file, chunk_size=default_chunk_size):
+    """Yield the content of a plain file as memoryview chunks of about chunk_size, on a
+    memory map of the file; a chunk should not be used once the next one is asked for.
+    Each chunk but the last ends just after a b"\\n", so that no line (nor \\r\\n) is
+    split between two chunks."""
+    with open(str(path_to_file), "rb") as crrt_fh:
+        file_size = os.fstat(crrt_fh.fileno()).st_size
+
+        # an empty file cannot be memory mapped
+        if file_size == 0:
+            return
+
+        with mmap.mmap(crrt_fh.fileno(), 0, access=mmap.ACCESS_READ) as crrt_mmap:
+            ind_start = 0
+
+            while ind_start < file_size:
+                ind_end = crrt_mmap.rfind(b"\n", ind_start, ind_start + chunk_size) + 1
+
+                if ind_end == 0:
+                    # a line longer than the chunk size: go to its end
+                    ind_end = crrt_mmap.find(b"\n", ind_start + chunk_size) + 1
+
+                if ind_end == 0:
+                    ind_end = file_size
+
+                # a view, not a copy; it is released before the mmap is closed
+                with memoryview(crrt_mmap)[ind_start:ind_end] as crrt_view:
+                    yield crrt_view
+
+                ind_start = ind_end
+
+
+def iter_in_background(iterator, max_queue_size=4):
+    """Run iterator on a background thread, and yield its items. At most max_queue_size
+    items are waiting at any time. This allows to overlap the decompression (zlib releases
+    the GIL) with the processing of the items. An exception in the background thread is
+    raised again here. If the consumer stops early, the background thread stops too."""
+    queue_items = queue.Queue(maxsize=max_queue_size)
+    event_stop = threading.Event()
+    end_marker = object()
+
+    def put(item):
+        while not event_stop.is_set():
+            try:
+                queue_items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for crrt_item in iterator:
+                if not put((crrt_item, None)):
+                    return
+        except Exception as crrt_except:
+            put((end_marker, crrt_except))
+            return
+        put((end_marker, None))
+
+    thread_producer = threading.Thread(target=producer, daemon=True)
+    thread_producer.start()
+
+    try:
+        while True:
+            crrt_item, crrt_except = queue_items.get()
+
+            if crrt_item is end_marker:
+                if crrt_except is not None:
+                    raise crrt_except
+                return
+
+            yield crrt_item
+    finally:
+        event_stop.set()
+        thread_producer.join()
+
+
+def iter_decoded_chunks(path_to_file, encoding="ascii", errors="strict", automatic_gzip_recognition=True,
+                        background_decompression=False, chunk_size=default_chunk_size):
+    """Yield the content of a file as str chunks, each decoded in one go. The gz files are
+    decompressed by chunks (optionally on a background thread), and their newlines are
+    kept as they are. The plain files are read from a memory map, and their newlines are
+    translated as when opening them in text mode (\\r\\n and \\r become \\n)."""
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+
+    if is_gz_file(path_to_file, automatic_gzip_recognition):
+        iterator_chunks = iter_gz_chunks(path_to_file, chunk_size=chunk_size)
+
+        if background_decompression:
+            iterator_chunks = iter_in_background(iterator_chunks)
+
+        for crrt_chunk in iterator_chunks:
+            yield decoder.decode(crrt_chunk)
+
+        yield decoder.decode(b"", final=True)
+
+    else:
+        for crrt_chunk in iter_plain_chunks(path_to_file, chunk_size=chunk_size):
+            crrt_chunk = decoder.decode(crrt_chunk)
+
+            if "\r" in crrt_chunk:
+                crrt_chunk = crrt_chunk.replace("\r\n", "\n").replace("\r", "\n")
+
+            yield crrt_chunk
+
+        yield decoder.decode(b"", final=True)
 
 
 class FileLinesYielder():
-    def __init__(self, nbr_context_lines=5):
+    def __init__(self, nbr_context_lines=5, trace=False, background_decompression=False,
+                 chunk_size=default_chunk_size):
+        """Input:
+            - nbr_context_lines: the number of last read lines kept in list_lines, to
+            give some context in the error messages.
+            - trace: if True, log (INFO) each line read. This is slow, and meant for
+            looking into a given file only.
+            - background_decompression: if True, the gz files are decompressed on a
+            background thread, while the lines are being used.
+            - chunk_size: the size of the chunks the file is read by.
+        """
         self.nbr_context_lines = nbr_context_lines
-        self.list_lines = self.nbr_context_lines * ["!!EMPTY_CONTEXT_LINE!!"]
+        self.trace = trace
+        self.background_decompression = background_decompression
+        self.chunk_size = chunk_size
+        # a fixed size ring: appending a line drops the oldest one
+        self.list_lines = collections.deque(self.nbr_context_lines * ["!!EMPTY_CONTEXT_LINE!!"],
+                                            maxlen=self.nbr_context_lines)
 
     def file_lines_yielder(self, path_to_file, encoding="ascii", errors="strict", automatic_gzip_recognition=True):
-        # NOTE: this starts to be a mess, because the encoding / errors handling are different between gz and
-        # the open command. But but, working for now...
+        """Yield the lines of the file, with their line endings. The file is read and
+        decoded by large chunks (see iter_decoded_chunks), and the chunks are split
+        into lines."""
         self.path_to_file = path_to_file
 
-        if automatic_gzip_recognition and str(self.path_to_file)[-3:] == ".gz":
-            open_command = gzip.open
-            flags_open = "rb"
-            decode_encoding = encoding
-            encoding = None
-            errors = None
+        # the logging level is checked once per file, not at each line
+        trace_lines = self.trace and logging.getLogger().isEnabledFor(logging.INFO)
+        append_context_line = self.list_lines.append
+
+        self.crrt_ind = -1
+        incomplete_line = ""
+
+        for crrt_chunk in iter_decoded_chunks(path_to_file, encoding=encoding, errors=errors,
+                                              automatic_gzip_recognition=automatic_gzip_recognition,
+                                              background_decompression=self.background_decompression,
+                                              chunk_size=self.chunk_size):
+            if not crrt_chunk:
+                continue
 
-            def decode(input):
-                return input.decode(decode_encoding)
-        else:
-            open_command = open
-            flags_open = "r"
+            list_chunk_lines = split_lines_keepends(incomplete_line + crrt_chunk)
 
-            def decode(input):
-                return input
+            # the last line may continue in the next chunk
+            if list_chunk_lines[-1][-1:] != "\n":
+                incomplete_line = list_chunk_lines.pop()
+            else:
+                incomplete_line = ""
 
-        with open_command(str(self.path_to_file), flags_open, encoding=encoding, errors=errors) as crrt_fh:
-            for self.crrt_ind, self.crrt_line in enumerate(crrt_fh):
-                self.to_yield = decode(self.crrt_line)
+            for self.crrt_line in list_chunk_lines:
+                self.crrt_ind += 1
+                self.to_yield = self.crrt_line
 
-                logging.info("line {}: {} decoded: {}".format(self.crrt_ind, self.crrt_line, self.to_yield))
+                if trace_lines:
+                    logging.info("line %s: %s", self.crrt_ind, self.crrt_line)
 
-                self.list_lines.pop(0)
-                self.list_lines.append(self.to_yield)
+                append_context_line(self.to_yield)
 
                 yield self.to_yield
+
+        if incomplete_line:
+            self.crrt_ind += 1
+            self.crrt_line = self.to_yield = incomplete_line
+
+            if trace_lines:
+                logging.info("line %s: %s", self.crrt_ind, self.crrt_line)
+
+            append_context_line(self.to_yield)
+
+            yield self.to_yield
+
+
+def read_file_content(path_to_file, encoding="ascii", errors="strict", automatic_gzip_recognition=True,
+                      background_decompression=False):
+    """Read the whole content of a file in one go, as a single str. The newline
+    handling is the same as in FileLinesYielder, so that splitting the content
+    with split_lines_keepends gives the same lines as file_lines_yielder."""
+    list_chunks = list(iter_decoded_chunks(path_to_file, encoding=encoding, errors=errors,
+                                           automatic_gzip_recognition=automatic_gzip_recognition,
+                                           background_decompression=background_decompression))
+
+    if len(list_chunks) == 2:
+        # a single chunk and the (empty) end of the decoding
+        return list_chunks[0]
+
+    return "".join(list_chunks)
+
+
+def split_lines_keepends(content):
+    """Split a str into lines, keeping the line endings. Only \\n is a line
+    delimiter (as when iterating a file), unlike str.splitlines that would
+    also split on the \\f used in the d22 block titles."""
+    return io.StringIO(content, newline="\n").readlines()
+
+
+class MappedLines():
+    """The lines of a plain file, on a memory map of the file. Only the offsets of the
+    line starts are computed up front (one int64 per line); a line is decoded to a str
+    only when it is accessed, and runs of lines can be converted to float straight from
+    the bytes. For indexing, slicing, len and index, this behaves as the list of the lines
+    read in text mode (with their line endings, \\r\\n translated to \\n).
+
+    A lone \\r (not followed by \\n) would be a line break in text mode but not here,
+    has_lone_cr tells if the file has any; such a file should be read as text instead."""
+
+    def __init__(self, path_to_file, encoding="ascii", errors="strict"):
+        self.encoding = encoding
+        self.errors = errors
+
+        # the map keeps its own handle on the file
+        with open(str(path_to_file), "rb") as crrt_fh:
+            self.file_size = os.fstat(crrt_fh.fileno()).st_size
+
+            # an empty file cannot be memory mapped
+            if self.file_size == 0:
+                self.mmap = b""
+                self.line_starts = array.array("q")
+                self.has_lone_cr = False
+                return
+
+            self.mmap = mmap.mmap(crrt_fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # the numpy view on the map must be dropped before the map can be closed
+        array_bytes = np.frombuffer(self.mmap, dtype=np.uint8)
+        ind_newlines = np.flatnonzero(array_bytes == ord("\n"))
+        nbr_cr = np.count_nonzero(array_bytes == ord("\r"))
+        nbr_crlf = np.count_nonzero(array_bytes[ind_newlines[ind_newlines > 0] - 1] == ord("\r"))
+        del array_bytes
+
+        self.has_lone_cr = nbr_cr != nbr_crlf
+
+        # the start of each line, and the end of the last one; an array.array gives fast
+        # access to single python ints, for little memory
+        line_starts = np.concatenate(([0], ind_newlines + 1)).astype(np.int64)
+        if line_starts[-1] != self.file_size:
+            line_starts = np.append(line_starts, self.file_size)
+
+        self.line_starts = array.array("q", line_starts.tobytes())
+
+    def __len__(self):
+        return len(self.line_starts) - 1 if len(self.line_starts) > 0 else 0
+
+    def line_bytes(self, ind):
+        """The bytes of line ind, with their line ending as in the file."""
+        return self.mmap[self.line_starts[ind]:self.line_starts[ind + 1]]
+
+    def __getitem__(self, ind):
+        if isinstance(ind, slice):
+            return [self[crrt_ind] for crrt_ind in range(*ind.indices(len(self)))]
+
+        if ind < 0:
+            ind += len(self)
+
+        if ind < 0:
+            raise IndexError("line index out of range")
+
+        # raises IndexError past the last line
+        crrt_line = self.mmap[self.line_starts[ind]:self.line_starts[ind + 1]].decode(self.encoding, self.errors)
+
+        if crrt_line[-2:] == "\r\n":
+            crrt_line = crrt_line[:-2] + "\n"
+
+        return crrt_line
+
+    def index(self, line, ind_start=0):
+        """The index of the first line equal to line, at or after ind_start; raise
+        ValueError if there is none, as list.index."""
+        if "\r" in line:
+            # the lines have no \r, once translated
+            raise ValueError("{} is not in the lines".format(line))
+
+        if line[-1:] != "\n":
+            # not used by the parser; as a list would do it
+            for crrt_ind in range(ind_start, len(self)):
+                if self[crrt_ind] == line:
+                    return crrt_ind
+            raise ValueError("{} is not in the lines".format(line))
+
+        line_content = line[:-1].encode(self.encoding, self.errors)
+        offset = self.line_starts[ind_start] if ind_start < len(self) else self.file_size
+
+        while True:
+            ind_found = self.mmap.find(line_content, offset)
+
+            if ind_found == -1:
+                raise ValueError("{} is not in the lines".format(line))
+
+            ind_after = ind_found + len(line_content)
+
+            if (ind_found == 0 or self.mmap[ind_found - 1] == ord("\n")) and \
+                    (self.mmap[ind_after:ind_after + 1] == b"\n" or self.mmap[ind_after:ind_after + 2] == b"\r\n"):
+                return bisect.bisect_left(self.line_starts, ind_found)
+
+            offset = ind_found + 1
+
+    def floats(self, ind_start, ind_end):
+        """The lines ind_start to ind_end (excluded) converted to float, straight from
+        the bytes. Raise ValueError if any of them cannot be converted; note that a few
+        non ASCII whitespaces, that float accepts around a str, are not accepted around
+        bytes, so the caller should then try again from the str."""
+        block_bytes = self.mmap[self.line_starts[ind_start]:self.line_starts[ind_end]]
+        return list(map(float, block_bytes.split(b"\n", ind_end - ind_start - 1)))
+
+    def line_startswith(self, ind, bytes_in):
+        """If line ind starts with bytes_in, checked on the map without decoding the line."""
+        crrt_line_start = self.line_starts[ind]
+        return self.mmap[crrt_line_start:crrt_line_start + len(bytes_in)] == bytes_in
+
+    def lines_contain(self, bytes_in, ind_start, ind_end):
+        """If the lines ind_start to ind_end (excluded) contain bytes_in, searched on the
+        map without decoding the lines; bytes_in should not span several lines."""
+        return self.mmap.find(bytes_in, self.line_starts[ind_start], self.line_starts[ind_end]) != -1
+
+    def close(self):
+        """Close the memory map; the lines cannot be accessed any longer. Otherwise, the
+        map is closed when the MappedLines is garbage collected."""
+        if not isinstance(self.mmap, bytes):
+            self.mmap.close()
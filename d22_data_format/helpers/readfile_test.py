@@ -1,6 +1,10 @@
 import tempfile
 
-from d22_data_format.helpers.readfile import FileLinesYielder
+import gzip
+
+import pytest
+
+from d22_data_format.helpers.readfile import FileLinesYielder, MappedLines, read_file_content
 
 
 def test_file_lines_yielder_class():
@@ -18,3 +22,85 @@ def test_file_lines_yielder_class():
                           "This is line 3!"]
 
         assert list(result) == correct_result
+
+
+def test_file_lines_yielder_context_lines():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        tmpfile = tmpdirname + "/test_1.txt"
+
+        with open(tmpfile, "w", encoding="ascii", errors="strict") as crrt_fh:
+            crrt_fh.write("line1\nline2\nline3\n")
+
+        file_lines_yielder_instance = FileLinesYielder(nbr_context_lines=2, trace=True)
+        result = file_lines_yielder_instance.file_lines_yielder(tmpfile)
+
+        assert next(result) == "line1\n"
+        assert list(file_lines_yielder_instance.list_lines) == ["!!EMPTY_CONTEXT_LINE!!", "line1\n"]
+
+        assert list(result) == ["line2\n", "line3\n"]
+        assert list(file_lines_yielder_instance.list_lines) == ["line2\n", "line3\n"]
+
+
+def test_chunked_reading():
+    content = "".join(["line {}\r\n".format(crrt_ind) for crrt_ind in range(100)]) + "caf\xe9\rend"
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_plain = tmpdirname + "/test.txt"
+        path_gz = tmpdirname + "/test.txt.gz"
+
+        with open(path_plain, "w", encoding="latin-1", newline="") as crrt_fh:
+            crrt_fh.write(content)
+
+        # two gz members
+        with open(path_gz, "wb") as crrt_fh:
+            crrt_fh.write(gzip.compress(content[:333].encode("latin-1")))
+            crrt_fh.write(gzip.compress(content[333:].encode("latin-1")))
+
+        with open(path_plain, "r", encoding="latin-1") as crrt_fh:
+            correct_lines_plain = list(crrt_fh)
+
+        with gzip.open(path_gz, "rb") as crrt_fh:
+            correct_lines_gz = [crrt_line.decode("latin-1") for crrt_line in crrt_fh]
+
+        for crrt_background_decompression in [False, True]:
+            file_lines_yielder_instance = FileLinesYielder(background_decompression=crrt_background_decompression,
+                                                           chunk_size=64)
+            file_lines_yielder = file_lines_yielder_instance.file_lines_yielder
+
+            assert list(file_lines_yielder(path_plain, encoding="latin-1")) == correct_lines_plain
+            assert list(file_lines_yielder(path_gz, encoding="latin-1")) == correct_lines_gz
+
+            assert read_file_content(path_plain, encoding="latin-1") == "".join(correct_lines_plain)
+            assert read_file_content(path_gz, encoding="latin-1",
+                                     background_decompression=crrt_background_decompression) == content
+
+
+def test_mapped_lines():
+    content = "!!!!\r\nHeimdal \r\n1.5\r\n-2.0\r\n\r\n!!!!\r\n3.0\r\nend"
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        path_plain = tmpdirname + "/test.txt"
+
+        with open(path_plain, "w", encoding="latin-1", newline="") as crrt_fh:
+            crrt_fh.write(content)
+
+        with open(path_plain, "r", encoding="latin-1") as crrt_fh:
+            correct_lines = list(crrt_fh)
+
+        mapped_lines = MappedLines(path_plain, encoding="latin-1")
+
+        assert not mapped_lines.has_lone_cr
+        assert len(mapped_lines) == len(correct_lines)
+        assert mapped_lines[:] == correct_lines
+        assert mapped_lines[1] == "Heimdal \n"
+
+        assert mapped_lines.index("!!!!\n", 0) == 0
+        assert mapped_lines.index("!!!!\n", 1) == 5
+        with pytest.raises(ValueError):
+            mapped_lines.index("!!!!\r\n", 0)
+
+        assert mapped_lines.floats(2, 4) == [1.5, -2.0]
+        with pytest.raises(ValueError):
+            mapped_lines.floats(1, 3)
+
+        mapped_lines.close()
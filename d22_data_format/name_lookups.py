@@ -13,13 +13,68 @@ from d22_data_format.helpers.folders_navigation import get_sorted_subfolders
 from d22_data_format.helpers.readfile import FileLinesYielder
 
 
-def generate_dict_folder_to_id(quick=False):
+def list_station_ids_in_file(crrt_file, quick=False):
+    """List the "station IDs", really data package titles, used in a d22 file, by
+    scanning the package headers. If quick, only look at the first package."""
+    list_station_ids = []
+
+    try:
+        file_lines_yielder_instance = FileLinesYielder()
+        file_lines_yielder = file_lines_yielder_instance.file_lines_yielder
+        line_yielder = file_lines_yielder(crrt_file,
+                                          automatic_gzip_recognition=True,
+                                          encoding="latin-1")
+
+        while True:
+            # find the next data package start
+            while True:
+                crrt_line = next(line_yielder)
+                if crrt_line == "!!!!\n" or crrt_line == "!!!!\r\n":
+                    break
+
+            # get the title
+            _ = next(line_yielder)
+            line_3 = next(line_yielder)
+
+            crrt_station_id = line_3[:-2].rstrip()
+
+            if crrt_station_id not in list_station_ids:
+                list_station_ids.append(crrt_station_id)
+
+            # if we do a quick test, only look at the first title in each file
+            if quick:
+                break
+    except:
+        pass
+
+    return list_station_ids
+
+
+def generate_dict_folder_to_id(quick=False, parsed_file_cache=None, archive_index=None):
     """Go through all the data, and create a lookup dict of the different "station IDs",
-    really data package titles, used in each station folder."""
+    really data package titles, used in each station folder. If parsed_file_cache is
+    not None, the IDs are taken from the cached parsed files when possible. If
+    archive_index is not None, the IDs are taken from the index only."""
     path_root_data = "/lustre/storeB/immutable/archive/projects/metproduction/DNMI_OFFSHORE/"
 
     dict_folder_to_id = {}
 
+    if archive_index is not None:
+        for crrt_folder in archive_index.folders():
+            dict_folder_to_id[crrt_folder] = []
+
+            for crrt_entry in archive_index.files(folder=crrt_folder):
+                list_station_ids = crrt_entry.list_station_ids
+
+                if quick:
+                    list_station_ids = list_station_ids[:1]
+
+                for crrt_station_id in list_station_ids:
+                    if crrt_station_id not in [tpl[0] for tpl in dict_folder_to_id[crrt_folder]]:
+                        dict_folder_to_id[crrt_folder].append((crrt_station_id, crrt_entry.path))
+
+        return dict_folder_to_id
+
     stations_subfolders = get_sorted_subfolders(path_root_data)
 
     for crrt_station_path in stations_subfolders:
@@ -44,39 +99,28 @@ def generate_dict_folder_to_id(quick=False):
             files = sorted([str(x) for x in Path(crrt_subfolder).glob("*") if x.is_file()])
 
             for crrt_file in files:
-                try:
-                    logging.info("looking at the file: {}".format(crrt_file))
-
-                    file_lines_yielder_instance = FileLinesYielder()
-                    file_lines_yielder = file_lines_yielder_instance.file_lines_yielder
-                    line_yielder = file_lines_yielder(crrt_file,
-                                                      automatic_gzip_recognition=True,
-                                                      encoding="latin-1")
-
-                    while True:
-                        # find the next data package start
-                        while True:
-                            crrt_line = next(line_yielder)
-                            if crrt_line == "!!!!\n" or crrt_line == "!!!!\r\n":
-                                break
-
-                        # get the title
-                        _ = next(line_yielder)
-                        line_3 = next(line_yielder)
-
-                        crrt_station_id = line_3[:-2].rstrip()
-
-                        # add the title to the summarizing dict
-                        if crrt_station_id not in [tpl[0] for tpl in dict_folder_to_id[crrt_folder]]:
-                            logging.warning("add id {} for station {} based on file {}".
-                                            format(crrt_station_id, crrt_folder, crrt_file))
-                            dict_folder_to_id[crrt_folder].append((crrt_station_id, crrt_file))
-
-                        # if we do a quick test, only look at the first title in each file
+                logging.info("looking at the file: {}".format(crrt_file))
+
+                list_station_ids = None
+
+                if parsed_file_cache is not None:
+                    try:
+                        list_station_ids = parsed_file_cache.get_or_parse(crrt_file).stations()
                         if quick:
-                            break
-                except:
-                    pass
+                            list_station_ids = list_station_ids[:1]
+                    except Exception:
+                        # the full parsing failed, fall back on the header scan
+                        list_station_ids = None
+
+                if list_station_ids is None:
+                    list_station_ids = list_station_ids_in_file(crrt_file, quick=quick)
+
+                # add the titles to the summarizing dict
+                for crrt_station_id in list_station_ids:
+                    if crrt_station_id not in [tpl[0] for tpl in dict_folder_to_id[crrt_folder]]:
+                        logging.warning("add id {} for station {} based on file {}".
+                                        format(crrt_station_id, crrt_folder, crrt_file))
+                        dict_folder_to_id[crrt_folder].append((crrt_station_id, crrt_file))
 
     return dict_folder_to_id
 
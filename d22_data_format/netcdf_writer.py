@@ -0,0 +1,221 @@
+"""Write time series on a common time base to a chunked, compressed NetCDF4 file, with
+the layout of the WL dataset (the one DatasetAccessor reads):
+    - dimensions: station, time (unlimited)
+    - stationid (station): str
+    - latitude, longitude (station): f4
+    - timestamps (time): i8, POSIX timestamps
+    - observation (station, time): f4, missing values as fill_value (1.0e37)
+
+The time entries are appended chunk by chunk, so that a long extraction can be written
+as it goes without holding the whole dataset in memory, see write_extracted_time_series."""
+
+import logging
+
+import datetime
+
+import numpy as np
+
+import netCDF4 as nc4
+
+from d22_data_format.helpers.datetimes import assert_is_utc_datetime
+from d22_data_format.helpers.raise_assert import ras
+
+default_fill_value = 1.0e37
+
+# one chunk of observation is 1 station x default_time_chunk_size entries,
+# that is a bit less than 2 months at 10 minutes resolution
+default_time_chunk_size = 8192
+
+
+class TimeSeriesNetCDFWriter():
+    def __init__(self, path_to_NetCDF, list_station_ids, list_latitudes=None, list_longitudes=None,
+                 fill_value=default_fill_value, time_chunk_size=default_time_chunk_size, complevel=4,
+                 observation_units="none", dict_attributes=None, dict_observation_attributes=None):
+        """Create the NetCDF4 file, with no time entry yet.
+        Input:
+            - path_to_NetCDF: the file to create (overwritten if it exists).
+            - list_station_ids: the ID string of each station.
+            - list_latitudes, list_longitudes: the position of each station, None
+            (default) if not known (then written as fill_value).
+            - fill_value: the value written in observation for missing data (NaN).
+            - time_chunk_size: the number of time entries per chunk on disk.
+            - complevel: the zlib compression level.
+            - observation_units: the units of the observations.
+            - dict_attributes: the global attributes of the file (title, description, ...).
+            - dict_observation_attributes: further attributes of observation (description,
+            standard_name, ...).
+        """
+        nbr_stations = len(list_station_ids)
+
+        if list_latitudes is None:
+            list_latitudes = nbr_stations * [fill_value]
+        if list_longitudes is None:
+            list_longitudes = nbr_stations * [fill_value]
+
+        ras(nbr_stations > 0)
+        ras(len(list_latitudes) == nbr_stations)
+        ras(len(list_longitudes) == nbr_stations)
+        ras(time_chunk_size > 0)
+
+        self.path_to_NetCDF = path_to_NetCDF
+        self.nbr_stations = nbr_stations
+        self.fill_value = fill_value
+        self.nbr_time_entries = 0
+        self.last_timestamp = None
+
+        self.nc4_fh = nc4.Dataset(self.path_to_NetCDF, "w", format="NETCDF4")
+        self.nc4_fh.set_auto_mask(False)
+
+        if dict_attributes is not None:
+            for crrt_name, crrt_value in dict_attributes.items():
+                self.nc4_fh.setncattr(crrt_name, crrt_value)
+
+        _ = self.nc4_fh.createDimension('station', nbr_stations)
+        _ = self.nc4_fh.createDimension('time', None)
+
+        stationid = self.nc4_fh.createVariable("stationid", str, ('station'))
+        latitude = self.nc4_fh.createVariable('latitude', 'f4', ('station'))
+        longitude = self.nc4_fh.createVariable('longitude', 'f4', ('station'))
+        self.timestamps = self.nc4_fh.createVariable('timestamps', 'i8', ('time'),
+                                                     zlib=True, complevel=complevel,
+                                                     chunksizes=(time_chunk_size,))
+        self.observation = self.nc4_fh.createVariable('observation', 'f4', ('station', 'time'),
+                                                      zlib=True, complevel=complevel,
+                                                      chunksizes=(1, time_chunk_size))
+
+        stationid.description = "unique ID string of each station"
+        stationid.units = "none"
+
+        latitude.description = "latitude of each station"
+        latitude.units = "degree North"
+
+        longitude.description = "longitude of each station"
+        longitude.units = "degree East"
+
+        self.timestamps.description = "common time base for all data"
+        self.timestamps.units = "POSIX timestamp"
+
+        self.observation.description = "observation at each station over the time base"
+        self.observation.units = "{}, fill value: {}".format(observation_units, fill_value)
+
+        if dict_observation_attributes is not None:
+            for crrt_name, crrt_value in dict_observation_attributes.items():
+                self.observation.setncattr(crrt_name, crrt_value)
+
+        for ind, crrt_station_id in enumerate(list_station_ids):
+            stationid[ind] = crrt_station_id
+
+        latitude[:] = np.array(list_latitudes, dtype=np.float32)
+        longitude[:] = np.array(list_longitudes, dtype=np.float32)
+
+    def append(self, timestamps, observations):
+        """Append time entries at the end of the file.
+        Input:
+            - timestamps: the int64 POSIX timestamps of the entries, increasing, and after
+            the ones already written.
+            - observations: array stations x entries, NaN for the missing data.
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        observations = np.array(observations, dtype=np.float32)
+
+        ras(timestamps.ndim == 1)
+        ras(observations.shape == (self.nbr_stations, timestamps.shape[0]))
+
+        nbr_entries = timestamps.shape[0]
+
+        if nbr_entries == 0:
+            return
+
+        ras(np.all(np.diff(timestamps) > 0), "the timestamps must be increasing")
+        ras(self.last_timestamp is None or timestamps[0] > self.last_timestamp,
+            "the timestamps must be after the ones already written")
+
+        observations[np.isnan(observations)] = self.fill_value
+
+        crrt_start = self.nbr_time_entries
+        crrt_end = crrt_start + nbr_entries
+
+        self.timestamps[crrt_start:crrt_end] = timestamps
+        self.observation[:, crrt_start:crrt_end] = observations
+
+        self.nbr_time_entries = crrt_end
+        self.last_timestamp = timestamps[-1]
+
+    def append_time_series(self, dict_time_series, list_keys):
+        """Append the output of DataExtractor.data_as_time_series, the station i being
+        dict_time_series[list_keys[i]] (typically, list_keys is a list of DataSpec)."""
+        ras(len(list_keys) == self.nbr_stations)
+
+        self.append(dict_time_series["timestamps"],
+                    np.array([dict_time_series[crrt_key] for crrt_key in list_keys], dtype=np.float32))
+
+    def close(self):
+        self.nc4_fh.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def write_extracted_time_series(data_extractor, list_data_specs, netcdf_writer, datetime_start, datetime_end,
+                                datetime_resolution, datetime_window=datetime.timedelta(days=30)):
+    """Extract the specs on the time base [datetime_start; datetime_end[ with step
+    datetime_resolution, window by window, and append each window to netcdf_writer (the
+    station i being list_data_specs[i]). Only one window of data is held in memory at a
+    time. This gives the same time series as a single data_extractor.extract_data_as_time_series
+    over the whole time base, except for a sample exactly half a resolution from a
+    window bound, that can then be used on both sides of the bound. A window with no
+    archive file (for example a gap in the archive) is written as missing values.
+    Input:
+        - data_extractor: the DataExtractor to use
+        - list_data_specs: the specs to extract, that can be in several folders
+        - netcdf_writer: a TimeSeriesNetCDFWriter with a station per spec
+        - datetime_start, datetime_end, datetime_resolution: the time base
+        - datetime_window: the length of the windows, a multiple of datetime_resolution
+    """
+    assert_is_utc_datetime(datetime_start)
+    assert_is_utc_datetime(datetime_end)
+    ras(datetime_start < datetime_end)
+    ras(datetime_window >= datetime_resolution)
+    ras(datetime_window % datetime_resolution == datetime.timedelta(0),
+        "the window must be a multiple of the resolution")
+
+    crrt_window_start = datetime_start
+
+    while crrt_window_start < datetime_end:
+        crrt_window_end = min(crrt_window_start + datetime_window, datetime_end)
+
+        logging.info("extract and write {} to {}".format(crrt_window_start, crrt_window_end))
+
+        dict_time_series = data_extractor.extract_data_as_time_series(list_data_specs, crrt_window_start,
+                                                                      crrt_window_end, datetime_resolution)
+        netcdf_writer.append_time_series(dict_time_series, list_data_specs)
+
+        crrt_window_start = crrt_window_end
+
+
+def read_time_series_netcdf(path_to_NetCDF):
+    """Read a whole file written by TimeSeriesNetCDFWriter.
+    Output:
+        - dict_time_series: "timestamps" is the int64 array of the POSIX timestamps,
+        and each station ID gives its float64 array of observations, NaN where missing.
+    """
+    with nc4.Dataset(path_to_NetCDF, "r", format="NETCDF4") as nc4_fh:
+        nc4_fh.set_auto_mask(False)
+
+        fill_value = float(nc4_fh["observation"].units.split(":")[-1])
+
+        dict_time_series = {}
+        dict_time_series["timestamps"] = nc4_fh["timestamps"][:].astype(np.int64)
+
+        observations = nc4_fh["observation"][:]
+        is_missing = observations == np.float32(fill_value)
+        observations = observations.astype(np.float64)
+        observations[is_missing] = np.nan
+
+        for ind, crrt_station_id in enumerate(nc4_fh["stationid"][:]):
+            dict_time_series[crrt_station_id] = observations[ind]
+
+    return dict_time_series
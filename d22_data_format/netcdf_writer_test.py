@@ -0,0 +1,80 @@
+import datetime
+import pytz
+
+import tempfile
+
+import numpy as np
+
+import netCDF4 as nc4
+
+from d22_data_format.data_extractor import DataExtractor, DataSpec
+from d22_data_format.netcdf_writer import TimeSeriesNetCDFWriter, write_extracted_time_series, \
+    read_time_series_netcdf
+from d22_data_format.helpers.load_test_data import write_dummy_d22_tree
+
+
+def test_write_extracted_time_series():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination"),
+                       DataSpec("dummy", "DUMMY", "WL1", "max_water_level_ref_LAT")]
+
+    datetime_start = datetime.datetime(2013, 9, 1, 12, 0, 0, tzinfo=pytz.utc)
+    datetime_end = datetime.datetime(2013, 9, 5, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_resolution = datetime.timedelta(minutes=30)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname)
+        path_to_NetCDF = tmpdirname + "/dataset.nc4"
+
+        dict_reference = DataExtractor(path_root_data=tmpdirname).extract_data_as_time_series(
+            list_data_specs, datetime_start, datetime_end, datetime_resolution)
+
+        # windows of one day, chunks on disk of a bit less than a day
+        with TimeSeriesNetCDFWriter(path_to_NetCDF, [str(crrt_spec) for crrt_spec in list_data_specs],
+                                    list_latitudes=[60.0, 60.0], time_chunk_size=40) as netcdf_writer:
+            write_extracted_time_series(DataExtractor(path_root_data=tmpdirname), list_data_specs, netcdf_writer,
+                                        datetime_start, datetime_end, datetime_resolution,
+                                        datetime_window=datetime.timedelta(days=1))
+
+        dict_time_series = read_time_series_netcdf(path_to_NetCDF)
+
+        np.testing.assert_array_equal(dict_time_series["timestamps"], dict_reference["timestamps"])
+        for crrt_spec in list_data_specs:
+            np.testing.assert_allclose(dict_time_series[str(crrt_spec)], dict_reference[crrt_spec], rtol=1.0e-6)
+        assert np.sum(~np.isnan(dict_time_series[str(list_data_specs[0])])) == 84
+
+        # the layout of the WL dataset
+        with nc4.Dataset(path_to_NetCDF, "r", format="NETCDF4") as nc4_fh:
+            nc4_fh.set_auto_mask(False)
+
+            assert nc4_fh["timestamps"].dtype == np.int64
+            assert nc4_fh["observation"].dtype == np.float32
+            assert nc4_fh["observation"].dimensions == ("station", "time")
+            assert nc4_fh["observation"].chunking() == [1, 40]
+            assert nc4_fh["observation"][1, 0] == np.float32(1.0e37)
+            assert list(nc4_fh["latitude"][:]) == [60.0, 60.0]
+            assert list(nc4_fh["stationid"][:]) == [str(crrt_spec) for crrt_spec in list_data_specs]
+
+
+def test_write_extracted_time_series_empty_windows():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination")]
+
+    # the first two windows of 30 days are before the first file
+    datetime_start = datetime.datetime(2013, 7, 1, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_end = datetime.datetime(2013, 9, 3, 0, 0, 0, tzinfo=pytz.utc)
+    datetime_resolution = datetime.timedelta(hours=1)
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=2)
+        path_to_NetCDF = tmpdirname + "/dataset.nc4"
+
+        with TimeSeriesNetCDFWriter(path_to_NetCDF, [str(crrt_spec) for crrt_spec in list_data_specs]) \
+                as netcdf_writer:
+            write_extracted_time_series(DataExtractor(path_root_data=tmpdirname), list_data_specs, netcdf_writer,
+                                        datetime_start, datetime_end, datetime_resolution)
+
+        dict_time_series = read_time_series_netcdf(path_to_NetCDF)
+        crrt_time_series = dict_time_series[str(list_data_specs[0])]
+
+        assert dict_time_series["timestamps"].shape == (64 * 24,)
+        assert np.all(np.isnan(crrt_time_series[:62 * 24]))
+        assert np.sum(~np.isnan(crrt_time_series)) == 48
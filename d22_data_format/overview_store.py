@@ -0,0 +1,161 @@
+"""A compact on disk store of the datablocks overview (the dict_pure_metadata given by
+generate_stats_on_dict_metadata), that replaces the pickled dict_pure_metadata.pkl.
+
+The store is a folder of .npy files, that are memory mapped when opened:
+    - blocks_<generation>.npy: a table with a row per station / block title, in the
+    order of dict_pure_metadata: station, block, first_timestamp, last_timestamp (int64
+    POSIX timestamps), and the dropouts_start / dropouts_count of its rows in the
+    dropouts.
+    - dropouts_<generation>.npy: int64 array nbr_dropouts x 2, the start / end POSIX
+    timestamps of all the dropouts, block after block.
+    - version.npy: the format version of the store, and the generation of the blocks
+    and dropouts files that go together. It is replaced last when the store is written
+    again, so that a reader always gets a consistent pair.
+
+Loading a station or the blocks with a given prefix only reads the table and the
+dropouts of these blocks, not the rest of the store."""
+
+import os
+
+import uuid
+
+import numpy as np
+
+from d22_data_format.columnar_result import datetime_to_posix, posix_to_datetime
+from d22_data_format.helpers.raise_assert import ras
+
+# increase if the content of the store changes
+overview_store_format_version = 2
+
+# the prefixes of the files of a generation of the store
+list_generation_file_prefixes = ["blocks_", "dropouts_"]
+
+
+def write_overview_store(dict_pure_metadata, path_store_dir):
+    """Write dict_pure_metadata to the store folder path_store_dir (created if needed,
+    the files of a previous store are replaced)."""
+    # 1. the dropouts of all the blocks, one after the other
+    # 2. the table of the blocks
+    # 3. write the files of a new generation, then point version.npy to it (written to a
+    #    temporary file and renamed, in one step), then remove the previous generations
+
+    list_rows = []
+    list_dropouts = []
+    crrt_dropouts_start = 0
+
+    # 1.
+    for crrt_station in dict_pure_metadata:
+        for crrt_block in dict_pure_metadata[crrt_station]:
+            crrt_block_dict = dict_pure_metadata[crrt_station][crrt_block]
+            crrt_dropouts = np.asarray(crrt_block_dict["data_dropouts"], dtype=np.int64).reshape(-1, 2)
+
+            list_rows.append((crrt_station, crrt_block,
+                              datetime_to_posix(crrt_block_dict["first_timestamp"]),
+                              datetime_to_posix(crrt_block_dict["last_timestamp"]),
+                              crrt_dropouts_start, crrt_dropouts.shape[0]))
+            list_dropouts.append(crrt_dropouts)
+            crrt_dropouts_start += crrt_dropouts.shape[0]
+
+    # 2.
+    max_len_station = max([1] + [len(crrt_row[0]) for crrt_row in list_rows])
+    max_len_block = max([1] + [len(crrt_row[1]) for crrt_row in list_rows])
+
+    blocks_dtype = np.dtype([("station", "U{}".format(max_len_station)),
+                             ("block", "U{}".format(max_len_block)),
+                             ("first_timestamp", np.int64),
+                             ("last_timestamp", np.int64),
+                             ("dropouts_start", np.int64),
+                             ("dropouts_count", np.int64)])
+
+    array_blocks = np.array(list_rows, dtype=blocks_dtype)
+
+    if list_dropouts:
+        array_dropouts = np.concatenate(list_dropouts)
+    else:
+        array_dropouts = np.empty((0, 2), dtype=np.int64)
+
+    # 3.
+    os.makedirs(path_store_dir, exist_ok=True)
+
+    generation = uuid.uuid4().hex
+
+    np.save(os.path.join(path_store_dir, "dropouts_{}.npy".format(generation)), array_dropouts, allow_pickle=False)
+    np.save(os.path.join(path_store_dir, "blocks_{}.npy".format(generation)), array_blocks, allow_pickle=False)
+
+    path_version = os.path.join(path_store_dir, "version.npy")
+    path_version_tmp = path_version + ".tmp.npy"
+    np.save(path_version_tmp, np.array([str(overview_store_format_version), generation]), allow_pickle=False)
+    os.replace(path_version_tmp, path_version)
+
+    # also the files left by an interrupted writing
+    for crrt_filename in os.listdir(path_store_dir):
+        if any([crrt_filename.startswith(crrt_prefix) for crrt_prefix in list_generation_file_prefixes]) and \
+                generation not in crrt_filename:
+            os.remove(os.path.join(path_store_dir, crrt_filename))
+
+
+class OverviewStore():
+    def __init__(self, path_store_dir):
+        """Open the store folder path_store_dir, written by write_overview_store. The
+        arrays are memory mapped, so nothing is read from disk until used. A store
+        written again later does not change what this one gives."""
+        self.path_store_dir = path_store_dir
+
+        # the generation may be removed between reading version.npy and opening its files,
+        # if the store is written again meanwhile; then use the new generation
+        for _ in range(3):
+            version = np.load(os.path.join(path_store_dir, "version.npy"))
+            ras(int(version[0]) == overview_store_format_version,
+                "overview store of version {}, expected {}; generate it again".format(
+                    int(version[0]), overview_store_format_version))
+            self.generation = str(version[1])
+
+            try:
+                self.array_blocks = np.load(os.path.join(path_store_dir, "blocks_{}.npy".format(self.generation)),
+                                            mmap_mode="r")
+                self.array_dropouts = np.load(os.path.join(path_store_dir,
+                                                           "dropouts_{}.npy".format(self.generation)),
+                                              mmap_mode="r")
+                break
+            except FileNotFoundError:
+                continue
+        else:
+            raise Exception("the overview store {} keeps being written again".format(path_store_dir))
+
+    def stations(self):
+        """The stations, in the order of the store."""
+        return list(dict.fromkeys(self.array_blocks["station"].tolist()))
+
+    def block_titles(self, station):
+        return self.array_blocks["block"][self.array_blocks["station"] == station].tolist()
+
+    def load(self, list_stations=None, list_block_prefixes=None):
+        """A dict_pure_metadata with only the given stations and the block titles that
+        start with one of the given prefixes (None for all). The dropouts are read-only
+        views of the memory mapped store."""
+        is_selected = np.ones(self.array_blocks.shape[0], dtype=bool)
+
+        if list_stations is not None:
+            is_selected &= np.isin(self.array_blocks["station"], list(list_stations))
+
+        if list_block_prefixes is not None:
+            has_prefix = np.zeros(self.array_blocks.shape[0], dtype=bool)
+            for crrt_prefix in list_block_prefixes:
+                has_prefix |= np.char.startswith(self.array_blocks["block"], crrt_prefix)
+            is_selected &= has_prefix
+
+        dict_pure_metadata = {}
+
+        for crrt_row in self.array_blocks[is_selected].tolist():
+            (crrt_station, crrt_block, crrt_first, crrt_last, crrt_dropouts_start, crrt_dropouts_count) = crrt_row
+
+            if crrt_station not in dict_pure_metadata:
+                dict_pure_metadata[crrt_station] = {}
+
+            dict_pure_metadata[crrt_station][crrt_block] = {
+                "first_timestamp": posix_to_datetime(crrt_first),
+                "last_timestamp": posix_to_datetime(crrt_last),
+                "data_dropouts": self.array_dropouts[crrt_dropouts_start:crrt_dropouts_start + crrt_dropouts_count],
+            }
+
+        return dict_pure_metadata
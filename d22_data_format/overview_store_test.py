@@ -0,0 +1,61 @@
+import os
+
+import tempfile
+
+import numpy as np
+
+from d22_data_format.datablocs_summary import generate_datablocks_overview_dict, generate_stats_on_dict_metadata
+from d22_data_format.overview_store import OverviewStore, write_overview_store
+from d22_data_format.helpers.load_test_data import write_dummy_d22_tree
+
+
+def assert_same_pure_metadata(dict_pure_metadata_1, dict_pure_metadata_2):
+    assert list(dict_pure_metadata_1) == list(dict_pure_metadata_2)
+
+    for crrt_station in dict_pure_metadata_1:
+        assert list(dict_pure_metadata_1[crrt_station]) == list(dict_pure_metadata_2[crrt_station])
+
+        for crrt_block in dict_pure_metadata_1[crrt_station]:
+            crrt_dict_1 = dict_pure_metadata_1[crrt_station][crrt_block]
+            crrt_dict_2 = dict_pure_metadata_2[crrt_station][crrt_block]
+
+            assert crrt_dict_1["first_timestamp"] == crrt_dict_2["first_timestamp"]
+            assert crrt_dict_1["last_timestamp"] == crrt_dict_2["last_timestamp"]
+            np.testing.assert_array_equal(crrt_dict_1["data_dropouts"], crrt_dict_2["data_dropouts"])
+
+
+def test_overview_store():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=8)
+        os.remove(tmpdirname + "/dummy/d22/2013/20130903.d22")
+
+        dict_pure_metadata = generate_stats_on_dict_metadata(generate_datablocks_overview_dict(tmpdirname))
+
+        # a second station, with no dropout
+        dict_pure_metadata["OTHER"] = {"WL1": dict(dict_pure_metadata["DUMMY"]["WL1"])}
+        dict_pure_metadata["OTHER"]["WL1"]["data_dropouts"] = np.empty((0, 2), dtype=np.int64)
+
+        path_store_dir = tmpdirname + "/overview_store"
+        write_overview_store({"DUMMY": dict_pure_metadata["DUMMY"]}, path_store_dir)
+        overview_store_before = OverviewStore(path_store_dir)
+
+        # writing again replaces the store, an already open store keeps its content
+        write_overview_store(dict_pure_metadata, path_store_dir)
+        assert len(os.listdir(path_store_dir)) == 3
+        assert overview_store_before.stations() == ["DUMMY"]
+        assert_same_pure_metadata(overview_store_before.load(), {"DUMMY": dict_pure_metadata["DUMMY"]})
+
+        overview_store = OverviewStore(path_store_dir)
+
+        assert overview_store.stations() == ["DUMMY", "OTHER"]
+        assert overview_store.block_titles("DUMMY") == ["MD1", "WL1"]
+
+        assert_same_pure_metadata(overview_store.load(), dict_pure_metadata)
+        assert_same_pure_metadata(overview_store.load(list_stations=["OTHER"]),
+                                  {"OTHER": dict_pure_metadata["OTHER"]})
+        assert_same_pure_metadata(overview_store.load(list_block_prefixes=["WL"]),
+                                  {crrt_station: {"WL1": dict_pure_metadata[crrt_station]["WL1"]}
+                                   for crrt_station in ["DUMMY", "OTHER"]})
+        assert overview_store.load(list_stations=["DUMMY"], list_block_prefixes=["CL"]) == {}
+
+        assert overview_store.load()["DUMMY"]["WL1"]["data_dropouts"].shape == (1, 2)
@@ -0,0 +1,209 @@
+"""An on disk cache of the parsed d22 files. The archive files are immutable, so
+there is no need to parse them again at each run.
+
+Each cache entry is the ColumnarD22Result of one d22 file, saved as a compressed
+.npz (numpy arrays only, no pickle), together with the path, size and mtime of the
+d22 file it comes from. An entry is used only if the size and mtime of the d22 file
+are still the same.
+
+The cache can be used by several processes at the same time:
+    - entries are written to a temporary file and atomically renamed, so that a
+    reader never sees a partially written entry.
+    - entries that disappear (for example evicted by another process) or that cannot
+    be read are considered as a cache miss.
+
+The total size of the cache is capped; when it is exceeded, the least recently used
+entries are evicted (the mtime of an entry is refreshed each time it is used). The
+temporary files left by a crash during a write are removed at eviction, once they are
+older than stale_tmp_age_seconds (a younger one may be a write in progress)."""
+
+import logging
+
+import os
+
+import hashlib
+
+import tempfile
+
+import time
+
+import zipfile
+
+import numpy as np
+
+from d22_data_format.columnar_result import ColumnarD22Result, parse_d22_file_columnar
+from d22_data_format.d22_parser import d22_parsing_mode
+from d22_data_format.helpers.raise_assert import ras
+
+default_path_cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "d22_data_format", "parsed_files")
+
+# increase if the content of the cache entries changes, to invalidate the old entries
+cache_format_version = 1
+
+# a temporary file older than this is left by a crash, not a write in progress
+stale_tmp_age_seconds = 3600
+
+
+class ParsedFileCache():
+    def __init__(self, path_cache_dir=None, max_size_bytes=4 * 1024**3,
+                 parsing_mode=d22_parsing_mode.BULK_BUFFER):
+        """Input:
+            - path_cache_dir: where to store the cache entries. None (default) uses
+            ~/.cache/d22_data_format/parsed_files
+            - max_size_bytes: the cap on the total size of the cache entries.
+            - parsing_mode: the D22Parser mode used on cache miss; not HEADER_ONLY, that
+            gives no values.
+        """
+        if path_cache_dir is None:
+            path_cache_dir = default_path_cache_dir
+
+        ras(max_size_bytes > 0)
+        ras(parsing_mode != d22_parsing_mode.HEADER_ONLY, "the cache needs the block values, "
+            "HEADER_ONLY parsing is not supported")
+
+        self.path_cache_dir = str(path_cache_dir)
+        self.max_size_bytes = max_size_bytes
+        self.parsing_mode = parsing_mode
+
+        os.makedirs(self.path_cache_dir, exist_ok=True)
+
+        # estimate of the total size of the cache, refreshed at each eviction
+        self.estimated_size_bytes = None
+
+    def path_to_entry(self, path_to_d22_file):
+        """The cache entry file corresponding to a d22 file."""
+        key = hashlib.sha1(os.path.abspath(str(path_to_d22_file)).encode("utf-8")).hexdigest()
+        return os.path.join(self.path_cache_dir, key + ".npz")
+
+    def get(self, path_to_d22_file):
+        """The ColumnarD22Result of path_to_d22_file if there is a valid entry, else None."""
+        path_to_d22_file = str(path_to_d22_file)
+        path_to_entry = self.path_to_entry(path_to_d22_file)
+        stat_d22_file = os.stat(path_to_d22_file)
+
+        try:
+            with np.load(path_to_entry, allow_pickle=False) as npz_content:
+                dict_arrays = {crrt_key: npz_content[crrt_key] for crrt_key in npz_content.files}
+
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+        if not (
+            int(dict_arrays.pop("cache_format_version")) == cache_format_version and
+            str(dict_arrays.pop("source_path").item()) == os.path.abspath(path_to_d22_file) and
+            int(dict_arrays.pop("source_size")) == stat_d22_file.st_size and
+            int(dict_arrays.pop("source_mtime_ns")) == stat_d22_file.st_mtime_ns
+        ):
+            logging.info("outdated cache entry for {}".format(path_to_d22_file))
+            return None
+
+        # refresh the entry, for the least recently used eviction
+        try:
+            os.utime(path_to_entry)
+        except OSError:
+            pass
+
+        return ColumnarD22Result.from_dict_arrays(dict_arrays)
+
+    def put(self, path_to_d22_file, columnar_result, stat_d22_file=None):
+        """Store the ColumnarD22Result of path_to_d22_file. stat_d22_file should be
+        the os.stat of the d22 file taken before parsing it."""
+        path_to_d22_file = str(path_to_d22_file)
+
+        if stat_d22_file is None:
+            stat_d22_file = os.stat(path_to_d22_file)
+
+        dict_arrays = columnar_result.to_dict_arrays()
+        dict_arrays["cache_format_version"] = np.array(cache_format_version)
+        dict_arrays["source_path"] = np.array(os.path.abspath(path_to_d22_file))
+        dict_arrays["source_size"] = np.array(stat_d22_file.st_size, dtype=np.int64)
+        dict_arrays["source_mtime_ns"] = np.array(stat_d22_file.st_mtime_ns, dtype=np.int64)
+
+        path_to_entry = self.path_to_entry(path_to_d22_file)
+
+        with tempfile.NamedTemporaryFile(dir=self.path_cache_dir, suffix=".tmp", delete=False) as crrt_fh:
+            path_tmp = crrt_fh.name
+            try:
+                np.savez_compressed(crrt_fh, **dict_arrays)
+            except Exception:
+                crrt_fh.close()
+                os.remove(path_tmp)
+                raise
+
+        os.replace(path_tmp, path_to_entry)
+
+        if self.estimated_size_bytes is None:
+            self.evict()
+        else:
+            self.estimated_size_bytes += os.path.getsize(path_to_entry)
+            if self.estimated_size_bytes > self.max_size_bytes:
+                self.evict()
+
+    def get_or_parse(self, path_to_d22_file):
+        """The ColumnarD22Result of path_to_d22_file, from the cache if possible, else
+        by parsing the file and storing the result in the cache."""
+        columnar_result = self.get(path_to_d22_file)
+
+        if columnar_result is None:
+            stat_d22_file = os.stat(str(path_to_d22_file))
+            columnar_result = parse_d22_file_columnar(path_to_d22_file, parsing_mode=self.parsing_mode)
+            self.put(path_to_d22_file, columnar_result, stat_d22_file=stat_d22_file)
+
+        return columnar_result
+
+    def evict(self):
+        """Remove the stale temporary files, and the least recently used entries until
+        the cache is below its size cap (with some margin, so that eviction does not
+        run at each put)."""
+        list_entries = []
+        stale_tmp_mtime_ns = time.time_ns() - stale_tmp_age_seconds * 10**9
+
+        with os.scandir(self.path_cache_dir) as iterator_entries:
+            for crrt_entry in iterator_entries:
+                if crrt_entry.name.endswith(".npz") or crrt_entry.name.endswith(".tmp"):
+                    try:
+                        crrt_stat = crrt_entry.stat()
+                    except FileNotFoundError:
+                        continue
+
+                    if crrt_entry.name.endswith(".tmp"):
+                        if crrt_stat.st_mtime_ns < stale_tmp_mtime_ns:
+                            try:
+                                os.remove(crrt_entry.path)
+                                logging.info("removed stale temporary file {}".format(crrt_entry.path))
+                            except FileNotFoundError:
+                                pass
+                        continue
+
+                    list_entries.append((crrt_stat.st_mtime_ns, crrt_stat.st_size, crrt_entry.path))
+
+        total_size = sum([crrt_entry[1] for crrt_entry in list_entries])
+
+        if total_size > self.max_size_bytes:
+            target_size = 0.9 * self.max_size_bytes
+
+            for (_, crrt_size, crrt_path) in sorted(list_entries):
+                if total_size <= target_size:
+                    break
+
+                try:
+                    os.remove(crrt_path)
+                    logging.info("evicted cache entry {}".format(crrt_path))
+                except FileNotFoundError:
+                    pass
+
+                total_size -= crrt_size
+
+        self.estimated_size_bytes = total_size
+
+    def clear(self):
+        """Remove all the entries."""
+        with os.scandir(self.path_cache_dir) as iterator_entries:
+            for crrt_entry in iterator_entries:
+                if crrt_entry.name.endswith(".npz"):
+                    try:
+                        os.remove(crrt_entry.path)
+                    except FileNotFoundError:
+                        pass
+
+        self.estimated_size_bytes = 0
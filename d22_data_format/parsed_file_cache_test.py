@@ -0,0 +1,100 @@
+import os
+
+import time
+
+import tempfile
+
+import pytest
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.parsed_file_cache import ParsedFileCache, stale_tmp_age_seconds
+from d22_data_format.data_extractor import DataExtractor, DataSpec
+from d22_data_format.helpers.load_test_data import write_dummy_d22_tree
+
+
+def test_cache_hit_and_invalidation():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=1)
+        path_to_d22_file = tmpdirname + "/dummy/d22/2013/20130901.d22"
+        parsed_file_cache = ParsedFileCache(path_cache_dir=tmpdirname + "/cache/")
+
+        assert parsed_file_cache.get(path_to_d22_file) is None
+
+        columnar_result = parsed_file_cache.get_or_parse(path_to_d22_file)
+        columnar_result_cached = parsed_file_cache.get(path_to_d22_file)
+
+        assert columnar_result_cached is not None
+        assert columnar_result_cached.to_dict_result() == columnar_result.to_dict_result()
+        assert columnar_result_cached.to_dict_result() == \
+            D22Parser(path_to_d22_file=path_to_d22_file).perform_parsing()
+
+        # any change in size or mtime invalidates the entry
+        with open(path_to_d22_file, "a", encoding="latin-1") as crrt_fh:
+            crrt_fh.write("\n")
+
+        assert parsed_file_cache.get(path_to_d22_file) is None
+
+        parsed_file_cache.get_or_parse(path_to_d22_file)
+        assert parsed_file_cache.get(path_to_d22_file) is not None
+
+        stat_d22_file = os.stat(path_to_d22_file)
+        os.utime(path_to_d22_file, ns=(stat_d22_file.st_atime_ns, stat_d22_file.st_mtime_ns + 1000))
+
+        assert parsed_file_cache.get(path_to_d22_file) is None
+
+        with pytest.raises(Exception, match="HEADER_ONLY"):
+            ParsedFileCache(path_cache_dir=tmpdirname + "/cache/", parsing_mode=d22_parsing_mode.HEADER_ONLY)
+
+
+def test_cache_lru_eviction():
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname, nbr_days=3)
+        list_paths = [tmpdirname + "/dummy/d22/2013/2013090{}.d22".format(crrt_day) for crrt_day in [1, 2, 3]]
+
+        parsed_file_cache = ParsedFileCache(path_cache_dir=tmpdirname + "/cache/")
+        parsed_file_cache.get_or_parse(list_paths[0])
+        size_one_entry = os.path.getsize(parsed_file_cache.path_to_entry(list_paths[0]))
+
+        # room for 2 entries only
+        parsed_file_cache = ParsedFileCache(path_cache_dir=tmpdirname + "/cache/",
+                                            max_size_bytes=int(2.5 * size_one_entry))
+        parsed_file_cache.get_or_parse(list_paths[1])
+
+        # make sure that the mtime resolution does not hide the access order
+        time.sleep(0.01)
+        assert parsed_file_cache.get(list_paths[0]) is not None
+
+        parsed_file_cache.get_or_parse(list_paths[2])
+
+        assert parsed_file_cache.get(list_paths[0]) is not None
+        assert parsed_file_cache.get(list_paths[1]) is None
+        assert parsed_file_cache.get(list_paths[2]) is not None
+
+        # a temporary file left by a crash is removed at eviction, not a recent one
+        for crrt_name in ["stale.tmp", "recent.tmp"]:
+            with open(tmpdirname + "/cache/" + crrt_name, "wb") as crrt_fh:
+                crrt_fh.write(b"0" * size_one_entry)
+
+        time_stale = time.time() - 2 * stale_tmp_age_seconds
+        os.utime(tmpdirname + "/cache/stale.tmp", (time_stale, time_stale))
+
+        parsed_file_cache.evict()
+        assert sorted(os.listdir(tmpdirname + "/cache/"))[-1] == "recent.tmp"
+        assert not os.path.exists(tmpdirname + "/cache/stale.tmp")
+
+
+def test_data_extractor_with_cache():
+    list_data_specs = [DataSpec("dummy", "DUMMY", "MD1", "magnetic_declination")]
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        write_dummy_d22_tree(tmpdirname)
+        parsed_file_cache = ParsedFileCache(path_cache_dir=tmpdirname + "/cache/")
+
+        dict_result_no_cache = DataExtractor(path_root_data=tmpdirname).extract_available_data(list_data_specs)
+
+        data_extractor = DataExtractor(path_root_data=tmpdirname, parsed_file_cache=parsed_file_cache)
+        dict_result_first_run = data_extractor.extract_available_data(list_data_specs)
+        dict_result_second_run = data_extractor.extract_available_data(list_data_specs)
+
+    assert dict_result_no_cache == dict_result_first_run
+    assert dict_result_no_cache == dict_result_second_run
@@ -0,0 +1,115 @@
+"""Benchmark the spec lookup of DataExtractor: the linear search through the list of
+specs for every (station, block, field) of every file, against the DataSpecIndex that
+goes straight to the blocks used by the specs. A year of daily files is simulated by
+using 365 times the same parsed file, so that only the lookup / extraction is timed.
+Run with a d22 file as argument, or without argument to use the example data."""
+
+import sys
+
+import time
+
+import logging
+
+import math
+
+from d22_data_format.columnar_result import parse_d22_file_columnar
+from d22_data_format.data_block_interpreters import process_dict_blocks
+from d22_data_format.data_extractor import DataSpec, DataSpecIndex, find_matching_spec, \
+    extract_data_from_columnar
+from d22_data_format.helpers.load_test_data import path_to_test_data
+
+nbr_files_one_year = 365
+
+
+def extract_data_linear_search(columnar_result, list_data_specs):
+    """The reference: go through all blocks and all extracted fields, and look for a
+    matching spec in the list of specs."""
+    dict_data = {crrt_spec: [] for crrt_spec in list_data_specs}
+
+    for crrt_station_id, crrt_block_id, crrt_block in columnar_result.iter_blocks():
+        if crrt_block.dict_extracted is None:
+            continue
+
+        for crrt_block_field in crrt_block.dict_extracted:
+            matching_spec = find_matching_spec(list_data_specs, crrt_station_id, crrt_block_id, crrt_block_field)
+
+            if matching_spec is not None:
+                crrt_column = crrt_block.dict_extracted[crrt_block_field]
+                dict_data[matching_spec].extend(
+                    [(crrt_datetime, crrt_value) for (crrt_datetime, crrt_value, crrt_masked)
+                     in zip(crrt_block.datetimes(), crrt_column.data.tolist(), crrt_column.mask.tolist())
+                     if not crrt_masked]
+                )
+
+    return dict_data
+
+
+def same_data(dict_data_1, dict_data_2):
+    """Equality of two extraction results, with NaN == NaN."""
+    if dict_data_1.keys() != dict_data_2.keys():
+        return False
+
+    for crrt_spec in dict_data_1:
+        list_1 = dict_data_1[crrt_spec]
+        list_2 = dict_data_2[crrt_spec]
+
+        if len(list_1) != len(list_2):
+            return False
+
+        for ((crrt_datetime_1, crrt_value_1), (crrt_datetime_2, crrt_value_2)) in zip(list_1, list_2):
+            if crrt_datetime_1 != crrt_datetime_2:
+                return False
+            if not (crrt_value_1 == crrt_value_2 or (math.isnan(crrt_value_1) and math.isnan(crrt_value_2))):
+                return False
+
+    return True
+
+
+def generate_specs(columnar_result, nbr_specs_min=50):
+    """Specs for all the interpreted fields of the file, padded with specs for
+    stations that are not in the file, so that there are at least nbr_specs_min."""
+    list_data_specs = []
+
+    for crrt_station_id, crrt_block_id, crrt_block in columnar_result.iter_blocks():
+        if crrt_block.dict_extracted is not None:
+            for crrt_block_field in crrt_block.dict_extracted:
+                list_data_specs.append(DataSpec("folder", crrt_station_id, crrt_block_id, crrt_block_field))
+
+    crrt_dummy_ind = 0
+    while len(list_data_specs) < nbr_specs_min:
+        list_data_specs.append(DataSpec("folder", "no_station_{}".format(crrt_dummy_ind),
+                                        "WL1", "average_water_level_ref_LAT"))
+        crrt_dummy_ind += 1
+
+    return list_data_specs
+
+
+if __name__ == "__main__":
+    # the block interpreters complain about all the corrupt blocks
+    logging.basicConfig(level=logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        path_to_d22_file = sys.argv[1]
+    else:
+        path_to_d22_file = path_to_test_data("20130923.d22")
+
+    columnar_result = parse_d22_file_columnar(path_to_d22_file)
+    process_dict_blocks(columnar_result)
+
+    list_data_specs = generate_specs(columnar_result)
+    print("{} specs, {} files".format(len(list_data_specs), nbr_files_one_year))
+
+    time_start = time.perf_counter()
+    for _ in range(nbr_files_one_year):
+        dict_data_linear = extract_data_linear_search(columnar_result, list_data_specs)
+    duration_linear = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    data_spec_index = DataSpecIndex(list_data_specs)
+    for _ in range(nbr_files_one_year):
+        dict_data_index = extract_data_from_columnar(columnar_result, data_spec_index)
+    duration_index = time.perf_counter() - time_start
+
+    print("linear search : {:.3f} s".format(duration_linear))
+    print("spec index    : {:.3f} s (speedup x{:.1f})".format(duration_index, duration_linear / duration_index))
+    print("same result   : {}".format(same_data(dict_data_linear, dict_data_index)))
@@ -0,0 +1,49 @@
+"""Benchmark the hampel filter implementations on a long synthetic series (default
+1M samples, as 20 years of 10 minutes data). The loop implementation is slow, so it
+is run on the first nbr_samples_loop samples only and its time is scaled linearly
+(it is linear in the number of samples).
+Run as: python script_benchmark_filters.py [nbr_samples] [nbr_samples_loop]"""
+
+import sys
+
+import time
+
+import numpy as np
+
+from d22_data_format.helpers.filters import hampel
+
+if __name__ == "__main__":
+    nbr_samples = 1000000
+    nbr_samples_loop = 50000
+
+    if len(sys.argv) > 1:
+        nbr_samples = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        nbr_samples_loop = int(sys.argv[2])
+
+    # a slow signal with noise, 1% outliers and 2% dropouts
+    random_generator = np.random.default_rng(seed=0)
+    array_in = np.sin(np.arange(nbr_samples) / 500.0) + 0.1 * random_generator.standard_normal(nbr_samples)
+    array_in[random_generator.random(nbr_samples) < 0.01] += 5.0
+    array_in[random_generator.random(nbr_samples) < 0.02] = np.nan
+
+    # k: one day and one hour of 10 minutes samples, as in three_stages_hampel
+    for crrt_k in [144, 6]:
+        time_start = time.perf_counter()
+        (array_windows, mask_windows) = hampel(array_in, crrt_k, t0=5, implementation="windows")
+        duration_windows = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        (array_loop, mask_loop) = hampel(array_in[:nbr_samples_loop], crrt_k, t0=5, implementation="loop")
+        duration_loop = (time.perf_counter() - time_start) * nbr_samples / nbr_samples_loop
+
+        # the samples of the prefix, except the last k ones, are filtered as in the full series
+        nbr_samples_compared = nbr_samples_loop - crrt_k - 1
+        same_result = np.array_equal(array_loop[:nbr_samples_compared], array_windows[:nbr_samples_compared],
+                                     equal_nan=True) and \
+            np.array_equal(mask_loop[:nbr_samples_compared], mask_windows[:nbr_samples_compared])
+
+        print("k = {}, {} samples".format(crrt_k, nbr_samples))
+        print("    loop    : {:.2f} s (scaled from {} samples)".format(duration_loop, nbr_samples_loop))
+        print("    windows : {:.2f} s (speedup x{:.1f})".format(duration_windows, duration_loop / duration_windows))
+        print("    same result: {}".format(same_result))
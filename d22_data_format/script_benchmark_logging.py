@@ -0,0 +1,115 @@
+"""Measure the per line cost of the instrumentation of the line by line reading: the
+previous FileLinesYielder (formatting a logging string at each line even when INFO is
+disabled, and a list as context buffer), against the current one (level guarded and
+opt-in trace, and a fixed size ring as context buffer). The line by line parsing is
+timed with and without trace too. Run with a d22 file as argument, or without argument
+to use the example data."""
+
+import sys
+
+import os
+
+import time
+
+import logging
+
+import gzip
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.helpers.readfile import FileLinesYielder
+from d22_data_format.helpers.load_test_data import path_to_test_data
+
+
+class ReferenceFileLinesYielder():
+    """The FileLinesYielder before the low overhead instrumentation, as reference."""
+
+    def __init__(self, nbr_context_lines=5):
+        self.nbr_context_lines = nbr_context_lines
+        self.list_lines = self.nbr_context_lines * ["!!EMPTY_CONTEXT_LINE!!"]
+
+    def file_lines_yielder(self, path_to_file, encoding="ascii", errors="strict", automatic_gzip_recognition=True):
+        self.path_to_file = path_to_file
+
+        if automatic_gzip_recognition and str(self.path_to_file)[-3:] == ".gz":
+            open_command = gzip.open
+            flags_open = "rb"
+            decode_encoding = encoding
+            encoding = None
+            errors = None
+
+            def decode(input):
+                return input.decode(decode_encoding)
+        else:
+            open_command = open
+            flags_open = "r"
+
+            def decode(input):
+                return input
+
+        with open_command(str(self.path_to_file), flags_open, encoding=encoding, errors=errors) as crrt_fh:
+            for self.crrt_ind, self.crrt_line in enumerate(crrt_fh):
+                self.to_yield = decode(self.crrt_line)
+
+                logging.info("line {}: {} decoded: {}".format(self.crrt_ind, self.crrt_line, self.to_yield))
+
+                self.list_lines.pop(0)
+                self.list_lines.append(self.to_yield)
+
+                yield self.to_yield
+
+
+def time_function(function, nbr_repeats=3):
+    """The best wall time over nbr_repeats calls, and the result of the last call."""
+    list_durations = []
+
+    for _ in range(nbr_repeats):
+        time_start = time.perf_counter()
+        result = function()
+        list_durations.append(time.perf_counter() - time_start)
+
+    return (min(list_durations), result)
+
+
+def read_all_lines(file_lines_yielder_instance, path_to_d22_file):
+    return list(file_lines_yielder_instance.file_lines_yielder(path_to_d22_file, encoding="latin-1"))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        path_to_d22_file = sys.argv[1]
+    else:
+        path_to_d22_file = path_to_test_data("20130923.d22")
+
+    # the usual setup: warnings only
+    logging.basicConfig(level=logging.WARNING)
+
+    duration_reference, list_lines_reference = \
+        time_function(lambda: read_all_lines(ReferenceFileLinesYielder(), path_to_d22_file))
+    duration_current, list_lines_current = \
+        time_function(lambda: read_all_lines(FileLinesYielder(), path_to_d22_file))
+    duration_parsing, _ = \
+        time_function(lambda: D22Parser(path_to_d22_file, parsing_mode=d22_parsing_mode.LINE_BY_LINE).perform_parsing())
+
+    nbr_lines = len(list_lines_current)
+
+    # tracing one file, the log going to devnull so that only the instrumentation is timed
+    logging.getLogger().setLevel(logging.INFO)
+
+    with open(os.devnull, "w") as devnull:
+        logging.getLogger().handlers[0].setStream(devnull)
+        duration_trace, _ = \
+            time_function(lambda: read_all_lines(FileLinesYielder(trace=True), path_to_d22_file), nbr_repeats=1)
+        duration_parsing_trace, _ = \
+            time_function(lambda: D22Parser(path_to_d22_file, trace=True).perform_parsing(), nbr_repeats=1)
+
+    def per_line(duration):
+        return 1.0e9 * duration / nbr_lines
+
+    print("{}: {} lines".format(path_to_d22_file, nbr_lines))
+    print("    reading, previous instrumentation: {:.0f} ns / line".format(per_line(duration_reference)))
+    print("    reading, current instrumentation : {:.0f} ns / line (speedup x{:.1f})".format(
+        per_line(duration_current), duration_reference / duration_current))
+    print("    reading, with trace              : {:.0f} ns / line".format(per_line(duration_trace)))
+    print("    same lines                       : {}".format(list_lines_reference == list_lines_current))
+    print("    line by line parsing             : {:.0f} ns / line".format(per_line(duration_parsing)))
+    print("    line by line parsing, with trace : {:.0f} ns / line".format(per_line(duration_parsing_trace)))
@@ -0,0 +1,57 @@
+"""Compare the wall time of the different parsing modes of D22Parser. Run with
+the d22 files to use as arguments, or without arguments to use the example data."""
+
+import sys
+
+import time
+
+import logging
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode
+from d22_data_format.helpers.load_test_data import path_to_test_data
+
+
+def time_parsing(path_to_d22_file, parsing_mode, nbr_repeats=3):
+    """Return the best wall time over nbr_repeats parsings, and the parsed dict."""
+    list_durations = []
+
+    for _ in range(nbr_repeats):
+        time_start = time.perf_counter()
+        dict_result = D22Parser(path_to_d22_file=path_to_d22_file, parsing_mode=parsing_mode).perform_parsing()
+        list_durations.append(time.perf_counter() - time_start)
+
+    return (min(list_durations), dict_result)
+
+
+def same_blocks(dict_result, dict_result_header_only):
+    """If a HEADER_ONLY dict has the same stations, times, blocks and nbr_entries as a full one."""
+    def without_entries(dict_in):
+        return {crrt_station: {crrt_datetime: {crrt_block_title: crrt_dict_block["nbr_entries"]
+                                               for crrt_block_title, crrt_dict_block in crrt_package.items()}
+                               for crrt_datetime, crrt_package in crrt_dict_station.items()}
+                for crrt_station, crrt_dict_station in dict_in.items()}
+
+    return without_entries(dict_result) == without_entries(dict_result_header_only)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+
+    if len(sys.argv) > 1:
+        list_paths = sys.argv[1:]
+    else:
+        list_paths = [path_to_test_data("20130923.d22"),
+                      path_to_test_data("20020927.d22.gz"),
+                      path_to_test_data("20150101.d22")]
+
+    for crrt_path in list_paths:
+        duration_lines, dict_lines = time_parsing(crrt_path, d22_parsing_mode.LINE_BY_LINE)
+        duration_bulk, dict_bulk = time_parsing(crrt_path, d22_parsing_mode.BULK_BUFFER)
+        duration_header, dict_header = time_parsing(crrt_path, d22_parsing_mode.HEADER_ONLY)
+
+        print("{}".format(crrt_path))
+        print("    line by line: {:.4f} s".format(duration_lines))
+        print("    bulk buffer : {:.4f} s (speedup x{:.1f})".format(duration_bulk, duration_lines / duration_bulk))
+        print("    same result : {}".format(dict_lines == dict_bulk))
+        print("    header only : {:.4f} s (speedup x{:.1f})".format(duration_header, duration_lines / duration_header))
+        print("    same blocks : {}".format(same_blocks(dict_lines, dict_header)))
@@ -0,0 +1,133 @@
+"""Measure the reading throughput (MB/s of decoded content) of plain and gz d22 files:
+the previous reading (gzip.open and a decoding per line for the gz files, text mode
+open for the plain files) against the chunked reading (large chunks decompressed with
+zlib and decoded in one go, memory map for the plain files), with and without the
+decompression on a background thread. Run with d22 files as arguments (a .gz copy of
+each plain file is made), or without argument to use the example data."""
+
+import sys
+
+import os
+
+import time
+
+import gzip
+
+import collections
+
+import shutil
+
+import tempfile
+
+import logging
+
+from d22_data_format.d22_parser import D22Parser, d22_parsing_mode, d22_encoding
+from d22_data_format.helpers.readfile import FileLinesYielder, read_file_content
+from d22_data_format.helpers.load_test_data import path_to_test_data
+
+
+def reference_lines(path_to_file):
+    """The lines, as read by FileLinesYielder before the chunked reading: iteration on
+    the file object, and decoding of each line for the gz files."""
+    list_context_lines = collections.deque(5 * ["!!EMPTY_CONTEXT_LINE!!"], maxlen=5)
+    list_lines = []
+
+    if str(path_to_file)[-3:] == ".gz":
+        crrt_fh = gzip.open(str(path_to_file), "rb")
+
+        def decode(input):
+            return input.decode(d22_encoding)
+    else:
+        crrt_fh = open(str(path_to_file), "r", encoding=d22_encoding)
+
+        def decode(input):
+            return input
+
+    with crrt_fh:
+        for crrt_ind, crrt_line in enumerate(crrt_fh):
+            to_yield = decode(crrt_line)
+            list_context_lines.append(to_yield)
+            list_lines.append(to_yield)
+
+    return list_lines
+
+
+def reference_content(path_to_file):
+    """The content, as read before the chunked reading."""
+    if str(path_to_file)[-3:] == ".gz":
+        with gzip.open(str(path_to_file), "rb") as crrt_fh:
+            return crrt_fh.read().decode(d22_encoding)
+
+    with open(str(path_to_file), "r", encoding=d22_encoding) as crrt_fh:
+        return crrt_fh.read()
+
+
+def time_function(function, nbr_repeats=3):
+    """The best wall time over nbr_repeats calls, and the result of the last call."""
+    list_durations = []
+
+    for _ in range(nbr_repeats):
+        time_start = time.perf_counter()
+        result = function()
+        list_durations.append(time.perf_counter() - time_start)
+
+    return (min(list_durations), result)
+
+
+def benchmark_file(path_to_file):
+    size_mb = len(reference_content(path_to_file).encode(d22_encoding)) / 1.0e6
+
+    def print_throughput(label, duration, duration_reference=None):
+        if duration_reference is None:
+            print("    {:40}: {:7.1f} MB/s".format(label, size_mb / duration))
+        else:
+            print("    {:40}: {:7.1f} MB/s (speedup x{:.1f})".format(label, size_mb / duration,
+                                                                     duration_reference / duration))
+
+    print("{}: {:.1f} MB".format(path_to_file, size_mb))
+
+    duration_lines_reference, list_lines_reference = time_function(lambda: reference_lines(path_to_file))
+    duration_lines, list_lines = time_function(
+        lambda: list(FileLinesYielder().file_lines_yielder(path_to_file, encoding=d22_encoding)))
+    print_throughput("lines, previous", duration_lines_reference)
+    print_throughput("lines, chunked", duration_lines, duration_lines_reference)
+
+    duration_content_reference, content_reference = time_function(lambda: reference_content(path_to_file))
+    duration_content, content = time_function(lambda: read_file_content(path_to_file, encoding=d22_encoding))
+    print_throughput("whole content, previous", duration_content_reference)
+    print_throughput("whole content, chunked", duration_content, duration_content_reference)
+
+    print("    {:40}: {}".format("same lines and content",
+                                 list_lines == list_lines_reference and content == content_reference))
+
+    duration_parsing, _ = time_function(
+        lambda: D22Parser(path_to_file, parsing_mode=d22_parsing_mode.LINE_BY_LINE).perform_parsing())
+    duration_parsing_background, _ = time_function(
+        lambda: D22Parser(path_to_file, parsing_mode=d22_parsing_mode.LINE_BY_LINE,
+                          background_decompression=True).perform_parsing())
+    print_throughput("line by line parsing", duration_parsing)
+    print_throughput("line by line parsing, background thread", duration_parsing_background, duration_parsing)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.CRITICAL)
+
+    if len(sys.argv) > 1:
+        list_paths = sys.argv[1:]
+    else:
+        list_paths = [path_to_test_data("20130923.d22")]
+
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        for crrt_path in list_paths:
+            if str(crrt_path)[-3:] == ".gz":
+                benchmark_file(crrt_path)
+                continue
+
+            path_gz = os.path.join(tmpdirname, os.path.basename(crrt_path) + ".gz")
+
+            with open(crrt_path, "rb") as crrt_fh_in:
+                with gzip.open(path_gz, "wb") as crrt_fh_out:
+                    shutil.copyfileobj(crrt_fh_in, crrt_fh_out)
+
+            benchmark_file(crrt_path)
+            benchmark_file(path_gz)
@@ -1,29 +1,22 @@
 import logging
 
-import os
-from pathlib import Path
-
-import pickle
-
 from d22_data_format.datablocs_summary import generate_datablocks_overview_dict, \
     generate_stats_on_dict_metadata, show_summary_blocks_across_stations, \
     show_summary_blocks_one_station
+from d22_data_format.overview_store import OverviewStore, write_overview_store
 
 logging.basicConfig(level=logging.WARNING)
 
+# the files are processed in parallel, with as many processes as CPUs
 if False:
-    dict_metadata = generate_datablocks_overview_dict()
+    dict_metadata = generate_datablocks_overview_dict(nbr_workers=None, print_progress=True)
     dict_pure_metadata = generate_stats_on_dict_metadata(dict_metadata, print_info=True)
 
-    if Path("dict_pure_metadata.pkl").is_file():
-        os.remove("dict_pure_metadata.pkl")
-
-    with open('dict_pure_metadata.pkl', 'wb') as fh:
-        pickle.dump(dict_pure_metadata, fh, protocol=pickle.HIGHEST_PROTOCOL)
+    write_overview_store(dict_pure_metadata, "overview_store")
 
-with open('dict_pure_metadata.pkl', "rb") as fh:
-    dict_pure_metadata = pickle.load(fh)
+# only the station / blocks to plot are read from the store
+overview_store = OverviewStore("overview_store")
 
-show_summary_blocks_one_station(dict_pure_metadata, "Heimdal")
+show_summary_blocks_one_station(overview_store.load(list_stations=["Heimdal"]), "Heimdal")
 
-show_summary_blocks_across_stations(dict_pure_metadata, list_block_prefixes=["WL"])
+show_summary_blocks_across_stations(overview_store.load(list_block_prefixes=["WL"]), list_block_prefixes=["WL"])